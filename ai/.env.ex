@@ -3,6 +3,7 @@
 # OpenAI Configuration
 # OPENAI_API_KEY=your_openai_api_key_here
 OPENROUTER_API_KEY=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
+OPENROUTER_BASE_URL=https://openrouter.ai/api/v1
 OPENAI_MODEL=gpt-4o-mini
 OPENAI_MAX_TOKENS=1000
 OPENAI_TEMPERATURE=0.7
@@ -20,4 +21,127 @@ HOST=0.0.0.0
 PORT=8000
 
 # Security
-SECRET_KEY=your-secret-key-change-in-production
\ No newline at end of file
+SECRET_KEY=your-secret-key-change-in-production
+
+# AI Service Concurrency
+AI_MAX_CONCURRENCY=32
+AI_HTTP_MAX_CONNECTIONS=100
+AI_HTTP_MAX_KEEPALIVE=20
+
+# Answer Cache (LRU + TTL)
+ANSWER_CACHE_MAX_ENTRIES=1000
+ANSWER_CACHE_TTL=3600
+
+# Local intent classifier (LLM fallback below threshold)
+INTENT_CONFIDENCE_THRESHOLD=0.75
+# INTENT_LOG_PATH=intent_decisions.jsonl
+# Rotate the intent log to <path>.1 once it reaches this size
+INTENT_LOG_MAX_BYTES=5000000
+
+# Schema pruning for SQL generation prompts
+SCHEMA_MAX_TABLES=12
+SCHEMA_PROMPT_MAX_CHARS=8000
+# Schemas up to this size are sent verbatim (byte-stable prefix for provider prompt caching) instead of pruned per question
+SCHEMA_STABLE_MAX_CHARS=6000
+
+# Schema cache (background refresh before expiry)
+SCHEMA_CACHE_TTL=3600
+SCHEMA_REFRESH_MARGIN=300
+SCHEMA_RETRY_INTERVAL=30
+
+# Conversation history token budgets
+HISTORY_TOKEN_BUDGET=3000
+FORMAT_HISTORY_TOKEN_BUDGET=1000
+HISTORY_SUMMARY_TOKENS=400
+
+# Local rendering of common query-result shapes (skips the formatting LLM call)
+LOCAL_RENDER_ENABLED=true
+LOCAL_RENDER_MAX_ROWS=20
+
+# Query result encoding in formatting prompts
+FORMAT_RESULT_TOKEN_BUDGET=1500
+FORMAT_RESULT_TEXT_CHARS=120
+
+# Coalesce identical in-flight requests (one upstream call / stream per key)
+SINGLE_FLIGHT_ENABLED=true
+
+# Speculative execution for ambiguous questions (decision, SQL and answer in parallel)
+SPECULATIVE_EXECUTION=false
+SPECULATIVE_TOKEN_BUDGET=20000
+
+# Catalog retrieval (BM25 index over /api/v1/rag/* public data)
+CATALOG_RAG_ENABLED=true
+CATALOG_REFRESH_INTERVAL=600
+CATALOG_TOP_K=5
+CATALOG_MIN_SCORE=1.0
+
+# Health probes (/health/live, /health/ready) - cached upstream probe, no LLM calls
+UPSTREAM_PROBE_INTERVAL=30
+UPSTREAM_PROBE_TIMEOUT=5
+UPSTREAM_FAILURE_THRESHOLD=3
+READINESS_REQUIRE_SCHEMA=true
+
+# Model routing per stage/complexity (JSON or path to a JSON file); prices in USD per 1M tokens [prompt, completion]
+# MODEL_ROUTES={"decision": {"model": "gpt-4.1-nano"}, "sql_generation:simple": {"model": "gpt-4.1-nano"}, "answer:complex": {"model": "gpt-4o", "max_tokens": 1500}}
+# MODEL_PRICES={"gpt-4o-mini": [0.15, 0.6, 0.075]}  (USD per 1M tokens: prompt, completion, cached prompt; cached defaults to 50% of prompt)
+COMPLEX_QUESTION_TOKENS=40
+
+# Resilient upstream client: endpoint pool ("url|key,url|key"), per-stage deadlines, hedging, circuit breaker
+# UPSTREAM_ENDPOINTS=https://openrouter.ai/api/v1|sk-or-key-1,https://openrouter.ai/api/v1|sk-or-key-2
+UPSTREAM_TIMEOUT=60
+UPSTREAM_STAGE_TIMEOUTS=decision=5,sql_generation=20,answer=60,catalog=45,format=45
+HEDGE_ENABLED=true
+HEDGE_PERCENTILE=95
+HEDGE_MIN_DELAY=0.5
+HEDGE_MAX_RATIO=0.1
+CIRCUIT_FAILURE_THRESHOLD=5
+CIRCUIT_RESET_TIMEOUT=30
+ANSWER_CACHE_STALE_SECONDS=86400
+
+# Production server (start.py with DEBUG=False): gunicorn + UvicornWorker
+# WEB_CONCURRENCY=4  # default: number of CPU cores
+GRACEFUL_TIMEOUT=30
+WORKER_TIMEOUT=120
+KEEPALIVE_TIMEOUT=5
+AI_PRELOAD=true
+MAX_REQUESTS=0
+MAX_REQUESTS_JITTER=0
+# Schema/answer cache shared between workers (SQLite file); set automatically when running more than one worker
+# SHARED_CACHE_PATH=/tmp/chatai-cache-8000.sqlite3
+SHARED_CACHE_MAX_ENTRIES=20000
+# Seconds a request waits for another worker's SQLite write lock before skipping the cache
+SHARED_CACHE_BUSY_TIMEOUT=0.05
+
+# Persistent LLM response store (decisions, generated SQL, answers) reused across restarts; empty = disabled
+# Mount this path on a volume in containers so it survives redeploys
+RESPONSE_STORE_PATH=data/response_store.sqlite3
+RESPONSE_STORE_MAX_ENTRIES=50000
+RESPONSE_STORE_MAX_MB=256
+RESPONSE_STORE_TTL=604800
+RESPONSE_STORE_WARMUP_ENTRIES=2000
+RESPONSE_STORE_FLUSH_INTERVAL=30
+# Seconds a cache lookup/write waits for another worker's SQLite write lock before counting a miss / skipping the write
+RESPONSE_STORE_BUSY_TIMEOUT=0.05
+
+# Static check of generated SQL before it is sent to the Node API (read-only SELECT, LIMIT, estimated cost)
+SQL_GUARD_ENABLED=true
+SQL_MAX_ROWS=100
+# LIMIT when TEXT/BLOB/JSON columns are selected
+SQL_WIDE_MAX_ROWS=20
+# Reject queries estimated to examine more rows than this (single-table, single-row aggregates are only flagged)
+SQL_MAX_EXAMINED_ROWS=1000000
+# Row estimate for tables without statistics in the schema
+SQL_DEFAULT_TABLE_ROWS=10000
+
+# Request tracing: share of traces written to the log (0-1, decided per trace ID),
+# requests slower than TRACE_SLOW_SECONDS are always logged with full detail (also at /traces/slow)
+TRACE_SAMPLE_RATE=0.01
+TRACE_SLOW_SECONDS=5
+TRACE_SLOW_KEEP=50
+LOG_LEVEL=INFO
+
+# Bulk /ask-batch endpoint: max questions per batch, questions processed concurrently
+# (default, and the cap for the per-request "concurrency" field)
+BATCH_MAX_QUESTIONS=1000
+BATCH_CONCURRENCY=4
+BATCH_MAX_CONCURRENCY=16
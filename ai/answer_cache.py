@@ -0,0 +1,127 @@
+"""
+Cache câu trả lời trong bộ nhớ (LRU + TTL) cho ChatAIService, tùy chọn có tầng thứ hai
+dùng chung giữa các worker (SharedCache)
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from shared_cache import SharedCache
+
+
+class AnswerCache:
+    """
+    Cache LRU có giới hạn số entry và thời gian sống (TTL) cho mỗi entry; entry hết hạn được giữ
+    thêm `stale_seconds` để dùng khi upstream không khả dụng (get_stale).
+    Khi có `shared`: miss trong bộ nhớ sẽ tra tầng dùng chung, set ghi xuyên xuống tầng dùng chung
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 3600, stale_seconds: float = 0,
+                 shared: Optional[SharedCache] = None):
+        self.max_entries = max_entries
+        self.shared = shared
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_hits = 0
+        self.shared_hits = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Lấy giá trị theo key, trả về None nếu không có hoặc đã hết hạn
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return self._get_shared(key)
+
+        expires_at, value = entry
+        now = time.monotonic()
+        if expires_at < now:
+            if expires_at + self.stale_seconds < now:
+                del self._entries[key]
+            self.expirations += 1
+            return self._get_shared(key)
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def _get_shared(self, key: str) -> Optional[Any]:
+        """
+        Tra tầng dùng chung (worker khác có thể đã trả lời câu hỏi này), đưa lên bộ nhớ với TTL còn lại
+        """
+        entry = self.shared.get_entry(key) if self.shared is not None else None
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at_wall = entry
+        self._store(key, value, max(0.0, expires_at_wall - time.time()))
+        self.hits += 1
+        self.shared_hits += 1
+        return value
+
+    def get_stale(self, key: str) -> Optional[Any]:
+        """
+        Lấy giá trị kể cả khi đã hết hạn (trong khoảng stale_seconds), không tính vào hit/miss
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at + self.stale_seconds < time.monotonic():
+            del self._entries[key]
+            return None
+        self.stale_hits += 1
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Lưu giá trị, loại bỏ entry ít dùng nhất khi vượt giới hạn
+        """
+        if self.shared is not None:
+            self.shared.set(key, value, self.ttl_seconds)
+        self._store(key, value, self.ttl_seconds)
+
+    def warm(self, key: str, value: Any, ttl_seconds: float) -> None:
+        """
+        Nạp entry vào bộ nhớ (vd. từ ResponseStore khi khởi động) với TTL còn lại, không ghi xuống tầng dùng chung
+        """
+        self._store(key, value, min(ttl_seconds, self.ttl_seconds))
+
+    def _store(self, key: str, value: Any, ttl_seconds: float) -> None:
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Thống kê hit/miss/eviction của cache
+        """
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "stale_hits": self.stale_hits,
+            "shared_hits": self.shared_hits,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,247 @@
+"""
+Render câu trả lời trực tiếp từ kết quả query cho các dạng phổ biến (đếm, tổng hợp
+một giá trị, đếm theo nhóm, danh sách/top-N entity) mà không cần gọi LLM.
+Kết quả không nhận dạng được trả về None để caller dùng LLM.
+"""
+
+import re
+from typing import Any, Dict, List, Optional, Set
+
+from result_encoder import OPTIONAL_COLUMNS
+from sql_templates import ENTITY_PHRASES, canonicalize
+from text_utils import fold_text
+import tracing
+
+
+ENTITY_LABELS = {
+    "courses": "khóa học", "problems": "bài tập", "documents": "tài liệu",
+    "users": "người dùng", "contests": "cuộc thi",
+}
+
+COLUMN_LABELS = {
+    "rating": "Đánh giá", "students": "Học viên", "level": "Cấp độ", "difficulty": "Độ khó",
+    "acceptance": "Tỉ lệ chấp nhận", "solved_count": "Lượt giải", "price": "Giá",
+    "original_price": "Giá gốc", "duration": "Thời lượng", "category": "Danh mục",
+    "category_name": "Danh mục", "instructor_name": "Giảng viên", "start_time": "Bắt đầu",
+    "end_time": "Kết thúc", "status": "Trạng thái", "created_at": "Ngày tạo",
+    "points": "Điểm", "xp": "XP", "lessons": "Bài học", "downloads": "Lượt tải",
+}
+
+VALUE_LABELS = {
+    "Easy": "Dễ", "Medium": "Trung bình", "Hard": "Khó",
+    "Beginner": "Cơ bản", "Intermediate": "Trung cấp", "Advanced": "Nâng cao",
+}
+
+AGGREGATE_LABELS = {"avg": "trung bình", "min": "thấp nhất", "max": "cao nhất", "sum": "tổng"}
+
+# Cột dùng làm tên hiển thị của mỗi dòng
+TITLE_COLUMNS = ["title", "name", "full_name", "username"]
+
+# Cột không hiển thị trong danh sách (id nội bộ, text dài, thông tin cá nhân)
+HIDDEN_COLUMNS = {
+    "id", "description", "content", "thumbnail", "image", "avatar_url", "email", "password",
+    "is_deleted", "slug", "updated_at",
+}
+
+# Cột văn bản dài mà danh sách không hiển thị: kết quả có nội dung của cột hoặc câu hỏi nhắc tới
+# (cùng cụm từ với result_encoder) thì để LLM trả lời để không bỏ mất dữ liệu người dùng hỏi
+TEXT_COLUMNS = {column: OPTIONAL_COLUMNS[column] for column in ("description", "content")}
+
+# Câu hỏi cần phân tích/tư vấn thì để LLM trả lời kể cả khi render được
+ADVICE_PHRASES = [
+    "nen", "goi y", "so sanh", "tu van", "tai sao", "vi sao", "giai thich", "phan tich",
+    "recommend", "suggest", "compare", "why", "explain",
+]
+
+# Cột gợi ý entity khi câu hỏi không nhắc tới
+ENTITY_HINT_COLUMNS = {
+    "difficulty": "problems", "acceptance": "problems", "solved_count": "problems",
+    "start_time": "contests", "students": "courses",
+}
+
+_COUNT_KEY_RE = re.compile(r"^(total|count|count\(\*\)|cnt|so_luong|num_\w+|\w+_count|count_\w+|total_\w+)$")
+_AGGREGATE_KEY_RE = re.compile(r"^(avg|average|min|max|sum)(?:_(\w+)|\((\w+)\))?$|^(\w+)_(avg|average|min|max|sum)$")
+
+
+def _is_number(value: Any) -> bool:
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, (int, float)):
+        return True
+    # MySQL DECIMAL/AVG trả về dạng chuỗi qua driver Node
+    return isinstance(value, str) and re.fullmatch(r"-?\d+(\.\d+)?", value.strip()) is not None
+
+
+def format_number(value: Any) -> str:
+    if isinstance(value, str):
+        value = float(value) if "." in value else int(value)
+    if isinstance(value, float):
+        if value.is_integer():
+            return str(int(value))
+        return f"{value:.2f}".rstrip("0").rstrip(".")
+    return str(value)
+
+
+def _format_value(value: Any) -> str:
+    if _is_number(value):
+        return format_number(value)
+    text = str(value)
+    return VALUE_LABELS.get(text, text)
+
+
+def _contains(folded: str, phrase: str) -> bool:
+    return re.search(r"\b" + re.escape(phrase) + r"\b", folded) is not None
+
+
+class AnswerRenderer:
+    """
+    Renderer local cho kết quả query, kèm thống kê số lần render local và số lần cần LLM
+    """
+
+    def __init__(self, max_rows: int = 20):
+        self.max_rows = max_rows
+        self.counters = {"count": 0, "aggregate": 0, "grouped": 0, "list": 0, "llm": 0}
+
+    def _entities(self, folded: str) -> Set[str]:
+        """
+        Các entity câu hỏi nhắc tới (cụm dài khớp trước, phần đã khớp không được khớp lại)
+        """
+        entities = set()
+        for phrase in sorted(ENTITY_PHRASES, key=len, reverse=True):
+            pattern = r"\b" + re.escape(phrase) + r"\b"
+            if re.search(pattern, folded):
+                entities.add(ENTITY_PHRASES[phrase])
+                folded = re.sub(pattern, " ", folded)
+        return entities
+
+    def _entity(self, folded: str, columns: List[str]) -> Optional[str]:
+        entities = self._entities(folded)
+        if entities:
+            return entities.pop()
+        for column in columns:
+            if column in ENTITY_HINT_COLUMNS:
+                return ENTITY_HINT_COLUMNS[column]
+        return None
+
+    def render(self, question: str, query_result: list) -> Optional[str]:
+        """
+        Trả về câu trả lời đã render, hoặc None nếu cần LLM
+        """
+        shape = None
+        answer = None
+        folded = fold_text(question)
+        # Câu hỏi nhắc tới nhiều entity ("bài tập trong khóa học X", "khóa học của người dùng Y"):
+        # không biết kết quả thuộc entity nào nên để LLM trả lời
+        if (query_result and all(isinstance(row, dict) and row for row in query_result)
+                and len(self._entities(folded)) <= 1):
+            columns = list(query_result[0].keys())
+            entity = self._entity(folded, columns)
+            label = ENTITY_LABELS.get(entity, "kết quả")
+
+            if len(query_result) == 1 and len(columns) == 1:
+                shape, answer = self._render_single(
+                    columns[0], query_result[0][columns[0]], entity, label, self._whole_table(question))
+            elif len(columns) == 2:
+                shape, answer = "grouped", self._render_grouped(query_result, columns, label)
+
+            if (answer is None and not any(_contains(folded, phrase) for phrase in ADVICE_PHRASES)
+                    and not self._needs_text(folded, query_result, columns)):
+                shape, answer = "list", self._render_list(query_result, columns, label)
+
+        if answer is None:
+            self.counters["llm"] += 1
+            return None
+        self.counters[shape] += 1
+        tracing.annotate(local_render=shape)
+        return answer
+
+    def _needs_text(self, folded: str, rows: list, columns: List[str]) -> bool:
+        for column, phrases in TEXT_COLUMNS.items():
+            if column in columns and any(row.get(column) not in (None, "") for row in rows):
+                return True
+            if any(_contains(folded, phrase) for phrase in phrases):
+                return True
+        return False
+
+    def _whole_table(self, question: str) -> bool:
+        """
+        Câu hỏi đếm toàn bộ một entity, không kèm điều kiện lọc ("có bao nhiêu khóa học")
+        """
+        query = canonicalize(question)
+        return query is not None and query.aggregate == "count" and not query.filters
+
+    def _render_single(self, key: str, value: Any, entity: Optional[str], label: str, whole_table: bool = False):
+        if not _is_number(value):
+            return None, None
+        key = key.lower()
+        if _COUNT_KEY_RE.match(key):
+            if entity and whole_table:
+                return "count", f"Hiện tại hệ thống có **{format_number(value)}** {label}."
+            if entity:
+                # Đếm có điều kiện: không khẳng định đây là tổng số của cả hệ thống
+                return "count", f"Có **{format_number(value)}** {label} phù hợp với câu hỏi của bạn."
+            return "count", f"Dựa trên dữ liệu từ hệ thống, có **{format_number(value)}** kết quả."
+
+        match = _AGGREGATE_KEY_RE.match(key)
+        if not match:
+            return None, None
+        func = (match.group(1) or match.group(5)).replace("average", "avg")
+        column = match.group(2) or match.group(3) or match.group(4) or ""
+        column_label = COLUMN_LABELS.get(column, column.replace("_", " ")).lower()
+        subject = f"{column_label} {AGGREGATE_LABELS[func]}" if column_label else AGGREGATE_LABELS[func]
+        subject = subject[0].upper() + subject[1:]
+        if entity:
+            subject += f" của các {label}"
+        return "aggregate", f"{subject} là **{format_number(value)}**."
+
+    def _render_grouped(self, rows: list, columns: List[str], label: str) -> Optional[str]:
+        group_col, count_col = columns
+        if not _COUNT_KEY_RE.match(count_col.lower()):
+            group_col, count_col = count_col, group_col
+        if not _COUNT_KEY_RE.match(count_col.lower()) or group_col.lower() in TITLE_COLUMNS:
+            return None
+        if not all(_is_number(row.get(count_col)) for row in rows):
+            return None
+
+        group_label = COLUMN_LABELS.get(group_col, group_col.replace("_", " ")).lower()
+        lines = [f"Số lượng {label} theo {group_label}:"]
+        for row in rows[:self.max_rows]:
+            group = row.get(group_col)
+            name = _format_value(group) if group is not None else "Không xác định"
+            lines.append(f"- {name}: **{format_number(row[count_col])}**")
+        if len(rows) > self.max_rows:
+            lines.append(f"- ... và {len(rows) - self.max_rows} nhóm khác")
+        return "\n".join(lines)
+
+    def _render_list(self, rows: list, columns: List[str], label: str) -> Optional[str]:
+        title_col = next((column for column in TITLE_COLUMNS if column in columns), None)
+        if title_col is None:
+            return None
+        detail_cols = [
+            column for column in columns
+            if column != title_col and column not in HIDDEN_COLUMNS
+            and (column in COLUMN_LABELS or _COUNT_KEY_RE.match(column.lower()))
+        ]
+
+        lines = [f"Tìm thấy **{len(rows)}** {label}:", ""]
+        for position, row in enumerate(rows[:self.max_rows], 1):
+            line = f"{position}. **{row.get(title_col) or 'Không có tên'}**"
+            details = [
+                f"{COLUMN_LABELS.get(column, 'Số lượng')}: {_format_value(row[column])}"
+                for column in detail_cols if row.get(column) not in (None, "")
+            ]
+            if details:
+                line += " — " + " · ".join(details)
+            lines.append(line)
+        if len(rows) > self.max_rows:
+            lines.append(f"\n... và {len(rows) - self.max_rows} {label} khác.")
+        return "\n".join(lines)
+
+    def stats(self) -> Dict[str, Any]:
+        local = sum(value for key, value in self.counters.items() if key != "llm")
+        total = local + self.counters["llm"]
+        return {
+            **self.counters,
+            "local": local,
+            "local_rate": round(local / total, 4) if total else 0.0,
+        }
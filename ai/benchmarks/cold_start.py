@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Đo latency của đợt traffic đầu tiên sau khi restart AI service, có và không có ResponseStore:
+1. Khởi động với store rỗng, gửi một đợt câu hỏi (ghi kết quả xuống store)
+2. Restart không có store: cùng đợt câu hỏi phải gọi lại LLM (hành vi khi deploy trước đây)
+3. Restart với store: cùng đợt câu hỏi được phục vụ từ cache đã warmup
+
+Chạy từ thư mục ai/:
+    python benchmarks/cold_start.py
+    python benchmarks/cold_start.py --requests 48 --concurrency 8 --latency 0.5 --tokens-per-second 40
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import uuid
+from typing import Any, Dict, List
+
+import httpx
+
+from run_benchmarks import SCENARIOS, print_results, run_scenario, start_mocks, start_service, stop_stack
+
+
+async def run_wave(args, base_url: str, run_id: str) -> List[Dict[str, Any]]:
+    return [
+        await run_scenario(base_url, name, args.concurrency, args.requests, run_id)
+        for name in args.scenarios.split(",")
+    ]
+
+
+async def run_phase(args, label: str, store_path: str, run_id: str) -> List[Dict[str, Any]]:
+    """
+    Khởi động service (store_path rỗng = tắt store), gửi một đợt request rồi dừng service
+    """
+    process = await start_service(args, {"RESPONSE_STORE_PATH": store_path})
+    base_url = f"http://127.0.0.1:{args.service_port}"
+    try:
+        async with httpx.AsyncClient(timeout=10.0) as http:
+            store = (await http.get(f"{base_url}/stats")).json().get("response_store")
+        results = await run_wave(args, base_url, run_id)
+    finally:
+        stop_stack([process])
+    print(f"\n{label}")
+    if store:
+        print(f"response store: {store['entries']} entries, {store['warmed']} warmed at startup")
+    print_results(results)
+    return results
+
+
+def print_speedup(cold: List[Dict[str, Any]], warm: List[Dict[str, Any]]) -> None:
+    print("\nRestart with store vs restart without store:")
+    for before, after in zip(cold, warm):
+        parts = []
+        for metric in ("p50", "p95"):
+            if before[metric] and after[metric]:
+                parts.append(f"{metric} {before[metric]:.3f}s -> {after[metric]:.3f}s ({before[metric] / after[metric]:.1f}x)")
+        print(f"  {before['scenario']:>14}: " + ", ".join(parts))
+
+
+async def main_async(args) -> int:
+    unknown = [name for name in args.scenarios.split(",") if name not in SCENARIOS]
+    if unknown:
+        print(f"Unknown scenarios: {', '.join(unknown)} (available: {', '.join(SCENARIOS)})")
+        return 2
+
+    store_path = args.store or os.path.join(tempfile.gettempdir(), f"ai-cold-start-{uuid.uuid4().hex[:6]}.sqlite3")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(store_path + suffix):
+            os.remove(store_path + suffix)
+
+    processes: List[subprocess.Popen] = await start_mocks(args)
+    run_id = uuid.uuid4().hex[:6]
+    try:
+        print("=" * 96)
+        print(f"COLD START BENCHMARK (mock LLM latency {args.latency}s, {args.tokens_per_second} tokens/s)")
+        print(f"{args.requests} requests per scenario, concurrency {args.concurrency}, store {store_path}")
+        print("=" * 96)
+        await run_phase(args, "1. First start, empty store", store_path, run_id)
+        cold = await run_phase(args, "2. Restart without store", "", run_id)
+        warm = await run_phase(args, "3. Restart with store (warmup)", store_path, run_id)
+        print_speedup(cold, warm)
+    finally:
+        stop_stack(processes)
+        if not args.store:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(store_path + suffix):
+                    os.remove(store_path + suffix)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark latency sau restart với/không với ResponseStore")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Các kịch bản, phân tách bởi dấu phẩy")
+    parser.add_argument("--requests", type=int, default=32, help="Số câu hỏi khác nhau cho mỗi kịch bản")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--store", default="", help="Đường dẫn file store (mặc định: file tạm, xóa sau khi chạy)")
+    parser.add_argument("--latency", type=float, default=0.3, help="Mock LLM: giây tới token đầu tiên")
+    parser.add_argument("--tokens-per-second", type=float, default=80.0, help="Mock LLM: tốc độ sinh token")
+    parser.add_argument("--answer-tokens", type=int, default=120, help="Mock LLM: số token của câu trả lời thường")
+    parser.add_argument("--llm-port", type=int, default=9100)
+    parser.add_argument("--node-port", type=int, default=9101)
+    parser.add_argument("--service-port", type=int, default=9102)
+    parser.add_argument("--verbose", action="store_true", help="Hiện log của mock và service")
+    args = parser.parse_args()
+    # Mock LLM không giả lập request chậm / lỗi trong benchmark này
+    args.slow_ratio, args.slow_latency, args.error_rate = 0.0, 5.0, 0.0
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Load test cho AI service: đo throughput theo số request đồng thời
+
+Ví dụ (bộ benchmark đầy đủ với mock LLM: benchmarks/run_benchmarks.py):
+    python benchmarks/load_test.py --url http://localhost:8000 --endpoint /ask --levels 1,4,16,32 --requests 64
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Dict, List
+
+import httpx
+
+DEFAULT_QUESTIONS = [
+    "Python là gì?",
+    "Có bao nhiêu khóa học?",
+    "Thuật toán quicksort hoạt động như thế nào?",
+    "Danh sách bài tập khó",
+]
+
+
+def percentile(values: List[float], p: float) -> float:
+    """
+    Tính percentile (nearest-rank) của danh sách latency
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(p / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+async def run_level(base_url: str, endpoint: str, concurrency: int, total: int) -> Dict[str, float]:
+    """
+    Gửi `total` request với tối đa `concurrency` request cùng lúc
+    """
+    latencies: List[float] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0, limits=limits) as http:
+        async def one(i: int):
+            nonlocal errors
+            body = {"question": DEFAULT_QUESTIONS[i % len(DEFAULT_QUESTIONS)]}
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await http.post(endpoint, json=body)
+                    await response.aread()
+                    if response.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "elapsed": elapsed,
+        "throughput": total / elapsed if elapsed > 0 else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+
+
+async def main_async(args):
+    levels = [int(x) for x in args.levels.split(",") if x.strip()]
+
+    print("=" * 72)
+    print(f"LOAD TEST {args.url}{args.endpoint}")
+    print("=" * 72)
+    print(f"{'concurrency':>11} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 (s)':>9} {'p95 (s)':>9} {'p99 (s)':>9}")
+
+    for level in levels:
+        result = await run_level(args.url, args.endpoint, level, max(args.requests, level))
+        print(
+            f"{result['concurrency']:>11} {result['requests']:>9} {result['errors']:>7} "
+            f"{result['throughput']:>9.2f} {result['p50']:>9.3f} {result['p95']:>9.3f} {result['p99']:>9.3f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test cho AI service")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--endpoint", default="/ask")
+    parser.add_argument("--levels", default="1,4,16,32", help="Các mức concurrency, phân tách bởi dấu phẩy")
+    parser.add_argument("--requests", type=int, default=64, help="Số request cho mỗi mức concurrency")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
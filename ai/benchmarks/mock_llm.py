@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Mock server OpenAI-compatible (/v1/chat/completions) cho benchmark: giả lập latency
+tới token đầu tiên và tốc độ sinh token (tokens/giây), hỗ trợ stream và usage;
+có thể giả lập một tỷ lệ request chậm hoặc lỗi 5xx (kiểm tra hedge, circuit breaker).
+Prompt cache của provider được giả lập theo ranh giới message: các message đầu trùng với prefix
+đã gặp trước đó được báo trong usage.prompt_tokens_details.cached_tokens
+
+Ví dụ:
+    python benchmarks/mock_llm.py --port 9100 --latency 0.3 --tokens-per-second 80
+    OPENROUTER_BASE_URL=http://127.0.0.1:9100/v1 uvicorn service:app --port 8000
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="Mock LLM")
+
+# Ghi đè bằng tham số dòng lệnh
+CONFIG: Dict[str, float] = {
+    "latency": 0.3,
+    "tokens_per_second": 80.0,
+    "answer_tokens": 120,
+    "slow_ratio": 0.0,
+    "slow_latency": 5.0,
+    "error_rate": 0.0,
+    "cache_min_tokens": 0,
+}
+
+# Hash các prefix message đã gặp (LRU), dùng để giả lập prompt cache
+PREFIX_CACHE: "OrderedDict[str, None]" = OrderedDict()
+PREFIX_CACHE_SIZE = 10000
+
+# Từ khóa để mock trả lời YES ở bước decision (giống câu hỏi cần query database)
+DATABASE_KEYWORDS = ("bao nhiêu", "danh sách", "thống kê", "liệt kê", "cao nhất", "nhiều nhất")
+
+SAMPLE_SQL = "SELECT id, title, rating, students FROM courses WHERE is_deleted = false LIMIT 20"
+
+ANSWER_WORDS = (
+    "Đây là câu trả lời mẫu từ mock server để đo hiệu năng của AI service với "
+    "latency và tốc độ sinh token cố định, không phụ thuộc vào upstream thật."
+).split()
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _cached_tokens(messages: List[Dict[str, Any]]) -> int:
+    """
+    Số token của prefix dài nhất (tính theo message, không gồm message cuối) đã gặp ở request trước
+    """
+    digest = hashlib.sha256()
+    cached = prefix_tokens = 0
+    for msg in messages[:-1]:
+        content = str(msg.get("content", ""))
+        digest.update(f"{msg.get('role')}\x00{content}\x01".encode("utf-8"))
+        prefix_tokens += _estimate_tokens(content)
+        key = digest.hexdigest()
+        if key in PREFIX_CACHE:
+            PREFIX_CACHE.move_to_end(key)
+            cached = prefix_tokens
+        else:
+            PREFIX_CACHE[key] = None
+            if len(PREFIX_CACHE) > PREFIX_CACHE_SIZE:
+                PREFIX_CACHE.popitem(last=False)
+    return cached if cached >= CONFIG["cache_min_tokens"] else 0
+
+
+def _reply_tokens(messages: List[Dict[str, Any]], max_tokens: int) -> List[str]:
+    """
+    Chọn nội dung trả lời theo stage (nhận diện qua system prompt), tách thành các token
+    """
+    system = str(messages[0].get("content", "")) if messages else ""
+    last = str(messages[-1].get("content", "")) if messages else ""
+    if "'YES' hoặc 'NO'" in system:
+        question = last.lower()
+        return ["YES" if any(keyword in question for keyword in DATABASE_KEYWORDS) else "NO"]
+    if "chuyên gia SQL" in system:
+        return [word + " " for word in SAMPLE_SQL.split()]
+    count = min(int(CONFIG["answer_tokens"]), max_tokens or int(CONFIG["answer_tokens"]))
+    return [ANSWER_WORDS[i % len(ANSWER_WORDS)] + " " for i in range(count)]
+
+
+def _chunk(completion_id: str, model: str, delta: Dict[str, Any], finish_reason=None) -> str:
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+@app.get("/v1/models")
+async def models():
+    return {"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model", "owned_by": "mock"}]}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    if random.random() < CONFIG["error_rate"]:
+        return JSONResponse({"error": {"message": "mock upstream error", "type": "server_error"}}, status_code=503)
+    latency = CONFIG["slow_latency"] if random.random() < CONFIG["slow_ratio"] else CONFIG["latency"]
+    messages = body.get("messages", [])
+    model = body.get("model", "mock")
+    tokens = _reply_tokens(messages, body.get("max_tokens") or 0)
+    usage = {
+        "prompt_tokens": sum(_estimate_tokens(str(msg.get("content", ""))) for msg in messages),
+        "completion_tokens": len(tokens),
+        "prompt_tokens_details": {"cached_tokens": _cached_tokens(messages)},
+    }
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    token_interval = 1.0 / CONFIG["tokens_per_second"] if CONFIG["tokens_per_second"] > 0 else 0.0
+
+    if body.get("stream"):
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+        async def generate():
+            await asyncio.sleep(latency)
+            yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+            for token in tokens:
+                yield _chunk(completion_id, model, {"content": token})
+                await asyncio.sleep(token_interval)
+            yield _chunk(completion_id, model, {}, finish_reason="stop")
+            if include_usage:
+                payload = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                           "model": model, "choices": [], "usage": usage}
+                yield f"data: {json.dumps(payload)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    await asyncio.sleep(latency + token_interval * len(tokens))
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": "".join(tokens).strip()},
+            "finish_reason": "stop",
+        }],
+        "usage": usage,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible server cho benchmark")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=CONFIG["latency"], help="Giây tới token đầu tiên")
+    parser.add_argument("--tokens-per-second", type=float, default=CONFIG["tokens_per_second"])
+    parser.add_argument("--answer-tokens", type=int, default=CONFIG["answer_tokens"], help="Số token của câu trả lời thường")
+    parser.add_argument("--slow-ratio", type=float, default=CONFIG["slow_ratio"], help="Tỷ lệ request chậm (0-1)")
+    parser.add_argument("--slow-latency", type=float, default=CONFIG["slow_latency"], help="Latency của request chậm (giây)")
+    parser.add_argument("--error-rate", type=float, default=CONFIG["error_rate"], help="Tỷ lệ request trả lỗi 503 (0-1)")
+    parser.add_argument("--cache-min-tokens", type=int, default=CONFIG["cache_min_tokens"],
+                        help="Prefix ngắn hơn số token này không được tính là đã cache (OpenAI: 1024)")
+    args = parser.parse_args()
+    CONFIG.update(
+        latency=args.latency, tokens_per_second=args.tokens_per_second, answer_tokens=args.answer_tokens,
+        slow_ratio=args.slow_ratio, slow_latency=args.slow_latency, error_rate=args.error_rate,
+        cache_min_tokens=args.cache_min_tokens,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
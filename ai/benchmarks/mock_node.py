@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Mock Node.js API cho benchmark: /api/v1/chat-ai/schema (hỗ trợ ETag/304)
+và /api/v1/rag/{category} với dữ liệu catalog mẫu
+
+Ví dụ:
+    python benchmarks/mock_node.py --port 9101
+    NODE_API_URL=http://127.0.0.1:9101 uvicorn service:app --port 8000
+"""
+
+import argparse
+import hashlib
+import json
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+
+app = FastAPI(title="Mock Node API")
+
+SAMPLE_SCHEMA = """# Database Schema
+
+Database: lfysdb
+
+## Table: courses
+
+Columns:
+  - id (bigint, PRIMARY KEY, NOT NULL)
+  - instructor_id (bigint, NOT NULL)
+  - title (varchar(255), NOT NULL)
+  - description (text)
+  - status (enum, INDEXED, NOT NULL, DEFAULT: draft)
+  - students (int, NOT NULL, DEFAULT: 0)
+  - rating (float, NOT NULL, DEFAULT: 0)
+  - level (enum, NOT NULL, DEFAULT: Beginner)
+  - category_id (bigint, NOT NULL)
+  - is_deleted (tinyint, NOT NULL, DEFAULT: 0)
+  - created_at (datetime, NOT NULL)
+
+Foreign Keys:
+  - instructor_id -> users.id
+  - category_id -> course_categories.id
+
+## Table: course_categories
+
+Columns:
+  - id (bigint, PRIMARY KEY, NOT NULL)
+  - name (varchar(255), NOT NULL)
+
+## Table: problems
+
+Columns:
+  - id (bigint, PRIMARY KEY, NOT NULL)
+  - title (varchar(255), NOT NULL)
+  - description (text)
+  - difficulty (enum, NOT NULL)
+  - acceptance (decimal, NOT NULL)
+  - solved_count (int, NOT NULL)
+  - category_id (bigint, NOT NULL)
+  - created_by (bigint, NOT NULL)
+  - is_deleted (tinyint, NOT NULL, DEFAULT: 0)
+  - created_at (datetime, NOT NULL)
+
+Foreign Keys:
+  - created_by -> users.id
+  - category_id -> problem_categories.id
+
+## Table: problem_categories
+
+Columns:
+  - id (bigint, PRIMARY KEY, NOT NULL)
+  - name (varchar(255), NOT NULL)
+
+## Table: documents
+
+Columns:
+  - id (bigint, PRIMARY KEY, NOT NULL)
+  - title (varchar(255), NOT NULL)
+  - description (text)
+  - is_deleted (tinyint, NOT NULL, DEFAULT: 0)
+
+## Table: users
+
+Columns:
+  - id (bigint, PRIMARY KEY, NOT NULL)
+  - name (varchar(255), NOT NULL)
+  - email (varchar(255), UNIQUE, NOT NULL)
+  - role (enum, NOT NULL)
+  - is_active (tinyint, NOT NULL, DEFAULT: 1)
+"""
+
+# Số dòng ước lượng gửi tách khỏi schema text (giống Node: data.rowEstimates)
+ROW_ESTIMATES = {"courses": 5000, "course_categories": 40, "problems": 300000, "documents": 20000, "users": 2000000}
+
+SCHEMA_ETAG = '"' + hashlib.sha256(SAMPLE_SCHEMA.encode("utf-8")).hexdigest()[:16] + '"'
+
+RAG_DATA = {
+    "courses": [
+        {"id": 1, "title": "Lập trình Python cơ bản", "description": "Học Python từ đầu", "level": "Beginner",
+         "rating": 4.5, "students": 1200, "is_free": True},
+        {"id": 2, "title": "JavaScript nâng cao", "description": "Closures, async/await, event loop",
+         "level": "Advanced", "rating": 4.2, "students": 640, "price": 299000},
+        {"id": 3, "title": "Cấu trúc dữ liệu và giải thuật", "description": "Mảng, cây, đồ thị, quy hoạch động",
+         "level": "Intermediate", "rating": 4.8, "students": 2100, "is_free": True},
+    ],
+    "problems": [
+        {"id": 1, "title": "Dãy con tăng dài nhất", "description": "Bài toán quy hoạch động kinh điển",
+         "difficulty": "Medium", "tags": [{"name": "Quy hoạch động"}]},
+        {"id": 2, "title": "Tổng hai số", "description": "Tìm hai phần tử có tổng bằng target",
+         "difficulty": "Easy", "tags": [{"name": "Mảng"}, {"name": "Hash"}]},
+    ],
+    "documents": [
+        {"id": 1, "title": "Git cho người mới bắt đầu", "description": "Commit, branch, merge"},
+    ],
+    "contests": [],
+}
+
+
+@app.get("/api/v1/chat-ai/schema")
+async def schema(request: Request):
+    if request.headers.get("if-none-match") == SCHEMA_ETAG:
+        return Response(status_code=304, headers={"ETag": SCHEMA_ETAG})
+    return Response(
+        content=json.dumps({"success": True, "data": {"schema": SAMPLE_SCHEMA, "format": "text", "rowEstimates": ROW_ESTIMATES}}, ensure_ascii=False),
+        media_type="application/json",
+        headers={"ETag": SCHEMA_ETAG},
+    )
+
+
+@app.get("/api/v1/rag/{category}")
+async def rag(category: str):
+    return {"success": True, "data": {"items": {category: {category[:-1]: RAG_DATA.get(category, [])}}}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Node.js API cho benchmark")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9101)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Đo hiệu quả prompt cache của provider với mock LLM (giả lập cache theo prefix message):
+gửi các kịch bản benchmark rồi in thời gian build prompt, tỷ lệ token prompt được cache
+theo stage và chi phí ước tính theo route (token đã cache tính theo giá cached)
+
+Chạy từ thư mục ai/:
+    python benchmarks/prompt_cache.py
+    python benchmarks/prompt_cache.py --requests 64 --schema-stable-max-chars 0   # luôn lọc schema theo câu hỏi
+"""
+
+import argparse
+import asyncio
+import sys
+import uuid
+from typing import List
+
+import httpx
+
+from run_benchmarks import SCENARIOS, print_results, run_scenario, start_mocks, start_service, stop_stack
+
+
+def print_prompt_stats(stats) -> None:
+    print(f"\n{'stage':>15} {'builds':>7} {'avg build':>10} {'calls':>6} {'prompt tok':>11} {'cached tok':>11} {'cached':>7}")
+    for stage, item in stats["prompts"].items():
+        avg = f"{item['avg_build_us']:.1f}us" if item["avg_build_us"] is not None else "-"
+        print(
+            f"{stage:>15} {item['builds']:>7} {avg:>10} {item['calls']:>6} "
+            f"{item['prompt_tokens']:>11} {item['cached_tokens']:>11} {item['cached_ratio']:>7.1%}"
+        )
+    print(f"\n{'route':>40} {'calls':>6} {'prompt tok':>11} {'cached tok':>11} {'cost usd':>10}")
+    for name, route in stats["model_routes"]["routes"].items():
+        print(
+            f"{name:>40} {route['calls']:>6} {route['prompt_tokens']:>11} "
+            f"{route.get('cached_tokens', 0):>11} {route['cost_usd']:>10.6f}"
+        )
+
+
+async def main_async(args) -> int:
+    unknown = [name for name in args.scenarios.split(",") if name not in SCENARIOS]
+    if unknown:
+        print(f"Unknown scenarios: {', '.join(unknown)} (available: {', '.join(SCENARIOS)})")
+        return 2
+
+    processes = await start_mocks(args)
+    base_url = f"http://127.0.0.1:{args.service_port}"
+    try:
+        processes.append(await start_service(args, {"SCHEMA_STABLE_MAX_CHARS": str(args.schema_stable_max_chars)}))
+        run_id = uuid.uuid4().hex[:6]
+        results: List = [
+            await run_scenario(base_url, name, args.concurrency, args.requests, run_id)
+            for name in args.scenarios.split(",")
+        ]
+        async with httpx.AsyncClient(timeout=10.0) as http:
+            stats = (await http.get(f"{base_url}/stats")).json()
+    finally:
+        stop_stack(processes)
+
+    print("=" * 96)
+    print(f"PROMPT CACHE BENCHMARK ({args.requests} requests per scenario, concurrency {args.concurrency}, "
+          f"SCHEMA_STABLE_MAX_CHARS={args.schema_stable_max_chars})")
+    print("=" * 96)
+    print_results(results)
+    print_prompt_stats(stats)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark prompt cache (token prompt được cache, thời gian build prompt)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Các kịch bản, phân tách bởi dấu phẩy")
+    parser.add_argument("--requests", type=int, default=32, help="Số câu hỏi khác nhau cho mỗi kịch bản")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--schema-stable-max-chars", type=int, default=6000,
+                        help="SCHEMA_STABLE_MAX_CHARS của service (0 = luôn lọc schema theo câu hỏi)")
+    parser.add_argument("--latency", type=float, default=0.1, help="Mock LLM: giây tới token đầu tiên")
+    parser.add_argument("--tokens-per-second", type=float, default=400.0, help="Mock LLM: tốc độ sinh token")
+    parser.add_argument("--answer-tokens", type=int, default=60, help="Mock LLM: số token của câu trả lời thường")
+    parser.add_argument("--llm-port", type=int, default=9100)
+    parser.add_argument("--node-port", type=int, default=9101)
+    parser.add_argument("--service-port", type=int, default=9102)
+    parser.add_argument("--verbose", action="store_true", help="Hiện log của mock và service")
+    args = parser.parse_args()
+    # Mock LLM không giả lập request chậm / lỗi trong benchmark này
+    args.slow_ratio, args.slow_latency, args.error_rate = 0.0, 5.0, 0.0
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
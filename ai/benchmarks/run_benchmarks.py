@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Bộ benchmark offline cho AI service: khởi động mock LLM, mock Node.js API và AI service,
+chạy các kịch bản tải (/ask, /ask-stream, /format-answer) theo nhiều mức concurrency,
+báo cáo throughput, p50/p95/p99 latency và time-to-first-token (endpoint stream)
+
+Chạy từ thư mục ai/:
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --levels 1,8,32 --requests 64 --latency 0.5 --tokens-per-second 40
+    python benchmarks/run_benchmarks.py --output bench.json
+    python benchmarks/run_benchmarks.py --baseline bench.json --max-regression 0.2
+
+Với --url, benchmark chạy trên instance có sẵn (không khởi động mock và service).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from load_test import percentile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(BENCH_DIR)
+
+ASK_QUESTIONS = [
+    "Có bao nhiêu khóa học?",
+    "Python là gì?",
+    "Danh sách bài tập khó",
+    "Thuật toán quicksort hoạt động như thế nào?",
+]
+
+CHAT_QUESTIONS = [
+    "Giải thích đệ quy cho người mới học",
+    "Làm thế nào để debug code Python hiệu quả?",
+    "So sánh mảng và danh sách liên kết",
+]
+
+# Câu hỏi tư vấn để kết quả query đi qua LLM (không render local được)
+FORMAT_QUESTION = "Gợi ý khóa học phù hợp cho người mới bắt đầu"
+FORMAT_ROWS = [
+    {"id": i, "title": f"Khóa học lập trình số {i}", "rating": round(3.5 + (i % 15) / 10, 1),
+     "students": 100 * i, "level": ("Beginner", "Intermediate", "Advanced")[i % 3]}
+    for i in range(1, 13)
+]
+
+
+def _ask_payload(i: int, run_id: str) -> Dict[str, Any]:
+    # Hậu tố riêng cho mỗi request để không trúng answer cache / single-flight
+    return {"question": f"{ASK_QUESTIONS[i % len(ASK_QUESTIONS)]} ({run_id}-{i})"}
+
+
+def _stream_payload(i: int, run_id: str) -> Dict[str, Any]:
+    return {"question": f"{CHAT_QUESTIONS[i % len(CHAT_QUESTIONS)]} ({run_id}-{i})"}
+
+
+def _format_payload(i: int, run_id: str) -> Dict[str, Any]:
+    return {
+        "question": f"{FORMAT_QUESTION} ({run_id}-{i})",
+        "query_result": FORMAT_ROWS,
+        "query_info": {"sql": "SELECT id, title, rating, students, level FROM courses LIMIT 20"},
+    }
+
+
+# tên kịch bản -> (endpoint, có stream hay không, hàm tạo payload)
+SCENARIOS: Dict[str, tuple] = {
+    "ask": ("/ask", False, _ask_payload),
+    "ask-stream": ("/ask-stream", True, _stream_payload),
+    "format-answer": ("/format-answer", False, _format_payload),
+}
+
+
+async def run_scenario(base_url: str, name: str, concurrency: int, total: int, run_id: str) -> Dict[str, Any]:
+    """
+    Gửi `total` request của một kịch bản với tối đa `concurrency` request cùng lúc
+    """
+    endpoint, stream, payload = SCENARIOS[name]
+    latencies: List[float] = []
+    ttfts: List[float] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0, limits=limits) as http:
+        async def one(i: int):
+            nonlocal errors
+            body = payload(i, run_id)
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    if stream:
+                        first_chunk = None
+                        async with http.stream("POST", endpoint, json=body) as response:
+                            if response.status_code != 200:
+                                errors += 1
+                            async for line in response.aiter_lines():
+                                if not line.startswith("data:"):
+                                    continue
+                                event = json.loads(line[5:])
+                                if event.get("type") == "chunk" and first_chunk is None:
+                                    first_chunk = time.perf_counter() - started
+                                elif event.get("type") == "error":
+                                    errors += 1
+                        if first_chunk is not None:
+                            ttfts.append(first_chunk)
+                    else:
+                        response = await http.post(endpoint, json=body)
+                        if response.status_code != 200 or not response.json().get("success", True):
+                            errors += 1
+                except (httpx.HTTPError, ValueError):
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "throughput": total / elapsed if elapsed > 0 else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "ttft_p50": percentile(ttfts, 50) if stream else None,
+        "ttft_p95": percentile(ttfts, 95) if stream else None,
+    }
+
+
+def _start(args: List[str], cwd: str, env: Optional[Dict[str, str]] = None, verbose: bool = False) -> subprocess.Popen:
+    output = None if verbose else subprocess.DEVNULL
+    return subprocess.Popen(args, cwd=cwd, env=env, stdout=output, stderr=output)
+
+
+async def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    """
+    Chờ server trả lời HTTP (bất kỳ status < 500), báo lỗi nếu process đã thoát
+    """
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2.0) as http:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Process exited with code {process.returncode} before {url} was ready")
+            try:
+                if (await http.get(url)).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+async def start_mocks(args) -> List[subprocess.Popen]:
+    """
+    Khởi động mock LLM và mock Node.js API
+    """
+    python = sys.executable
+    processes = [
+        _start([python, "mock_llm.py", "--port", str(args.llm_port), "--latency", str(args.latency),
+                "--tokens-per-second", str(args.tokens_per_second), "--answer-tokens", str(args.answer_tokens),
+                "--slow-ratio", str(args.slow_ratio), "--slow-latency", str(args.slow_latency),
+                "--error-rate", str(args.error_rate)],
+               BENCH_DIR, verbose=args.verbose),
+        _start([python, "mock_node.py", "--port", str(args.node_port)], BENCH_DIR, verbose=args.verbose),
+    ]
+    try:
+        await _wait_ready(f"http://127.0.0.1:{args.llm_port}/docs", processes[0])
+        await _wait_ready(f"http://127.0.0.1:{args.node_port}/api/v1/chat-ai/schema", processes[1])
+    except Exception:
+        stop_stack(processes)
+        raise
+    return processes
+
+
+async def start_service(args, extra_env: Optional[Dict[str, str]] = None) -> subprocess.Popen:
+    """
+    Khởi động AI service trỏ vào hai mock, chờ tới khi /health/ready sẵn sàng
+    """
+    env = {
+        **os.environ,
+        "OPENROUTER_BASE_URL": f"http://127.0.0.1:{args.llm_port}/v1",
+        "OPENROUTER_API_KEY": os.getenv("OPENROUTER_API_KEY", "benchmark"),
+        "NODE_API_URL": f"http://127.0.0.1:{args.node_port}",
+        # Mặc định không lưu bền câu trả lời để các lần chạy so sánh được với nhau
+        "RESPONSE_STORE_PATH": os.getenv("RESPONSE_STORE_PATH", ""),
+        **(extra_env or {}),
+    }
+    process = _start(
+        [sys.executable, "-m", "uvicorn", "service:app", "--host", "127.0.0.1", "--port", str(args.service_port),
+         "--log-level", "warning"],
+        SERVICE_DIR, env=env, verbose=args.verbose,
+    )
+    try:
+        await _wait_ready(f"http://127.0.0.1:{args.service_port}/health/ready", process, timeout=60.0)
+    except Exception:
+        stop_stack([process])
+        raise
+    return process
+
+
+async def start_stack(args) -> List[subprocess.Popen]:
+    """
+    Khởi động mock LLM, mock Node.js API và AI service trỏ vào hai mock đó
+    """
+    processes = await start_mocks(args)
+    try:
+        processes.append(await start_service(args))
+    except Exception:
+        stop_stack(processes)
+        raise
+    return processes
+
+
+def stop_stack(processes: List[subprocess.Popen]) -> None:
+    for process in reversed(processes):
+        if process.poll() is None:
+            process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.3f}"
+
+
+def print_results(results: List[Dict[str, Any]]) -> None:
+    print(f"{'scenario':>14} {'conc':>5} {'reqs':>5} {'errors':>6} {'req/s':>8} {'p50 (s)':>8} "
+          f"{'p95 (s)':>8} {'p99 (s)':>8} {'ttft p50':>9} {'ttft p95':>9}")
+    for r in results:
+        print(
+            f"{r['scenario']:>14} {r['concurrency']:>5} {r['requests']:>5} {r['errors']:>6} {r['throughput']:>8.2f} "
+            f"{_fmt(r['p50']):>8} {_fmt(r['p95']):>8} {_fmt(r['p99']):>8} {_fmt(r['ttft_p50']):>9} {_fmt(r['ttft_p95']):>9}"
+        )
+
+
+def compare_baseline(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], max_regression: float) -> List[str]:
+    """
+    So sánh với kết quả lần chạy trước; trả về danh sách regression vượt ngưỡng
+    """
+    previous = {(r["scenario"], r["concurrency"]): r for r in baseline}
+    regressions = []
+    for r in results:
+        old = previous.get((r["scenario"], r["concurrency"]))
+        if old is None:
+            continue
+        label = f"{r['scenario']} @ concurrency {r['concurrency']}"
+        for metric in ("p95", "ttft_p95"):
+            if r.get(metric) and old.get(metric) and r[metric] > old[metric] * (1 + max_regression):
+                regressions.append(f"{label}: {metric} {old[metric]:.3f}s -> {r[metric]:.3f}s")
+        if old["throughput"] and r["throughput"] < old["throughput"] * (1 - max_regression):
+            regressions.append(f"{label}: throughput {old['throughput']:.2f} -> {r['throughput']:.2f} req/s")
+        if r["errors"] > old["errors"]:
+            regressions.append(f"{label}: errors {old['errors']} -> {r['errors']}")
+    return regressions
+
+
+async def main_async(args) -> int:
+    levels = [int(x) for x in args.levels.split(",") if x.strip()]
+    scenarios = [x.strip() for x in args.scenarios.split(",") if x.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        print(f"Unknown scenarios: {', '.join(unknown)} (available: {', '.join(SCENARIOS)})")
+        return 2
+
+    processes: List[subprocess.Popen] = []
+    base_url = args.url
+    if not base_url:
+        processes = await start_stack(args)
+        base_url = f"http://127.0.0.1:{args.service_port}"
+
+    results = []
+    try:
+        print("=" * 96)
+        print(f"AI SERVICE BENCHMARK {base_url}")
+        if not args.url:
+            print(f"mock LLM: latency {args.latency}s, {args.tokens_per_second} tokens/s, {args.answer_tokens} answer tokens")
+            if args.slow_ratio or args.error_rate:
+                print(f"mock LLM: {args.slow_ratio:.0%} slow requests ({args.slow_latency}s), {args.error_rate:.0%} errors")
+        print("=" * 96)
+        run_id = uuid.uuid4().hex[:6]
+        # Warmup: nạp schema, catalog index, connection pool
+        for name in scenarios:
+            await run_scenario(base_url, name, 1, 2, f"warmup-{run_id}")
+        for name in scenarios:
+            for level in levels:
+                results.append(await run_scenario(base_url, name, level, max(args.requests, level), f"{run_id}{level}"))
+        print_results(results)
+    finally:
+        stop_stack(processes)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_baseline(results, json.load(f), args.max_regression)
+        if regressions:
+            print(f"\nRegressions vs {args.baseline} (threshold {args.max_regression:.0%}):")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print(f"\nNo regressions vs {args.baseline} (threshold {args.max_regression:.0%})")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline cho AI service (mock LLM + mock Node.js API)")
+    parser.add_argument("--url", default="", help="Benchmark instance có sẵn thay vì tự khởi động")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Các kịch bản, phân tách bởi dấu phẩy")
+    parser.add_argument("--levels", default="1,4,16,32", help="Các mức concurrency, phân tách bởi dấu phẩy")
+    parser.add_argument("--requests", type=int, default=64, help="Số request cho mỗi mức concurrency")
+    parser.add_argument("--latency", type=float, default=0.3, help="Mock LLM: giây tới token đầu tiên")
+    parser.add_argument("--tokens-per-second", type=float, default=80.0, help="Mock LLM: tốc độ sinh token")
+    parser.add_argument("--answer-tokens", type=int, default=120, help="Mock LLM: số token của câu trả lời thường")
+    parser.add_argument("--slow-ratio", type=float, default=0.0, help="Mock LLM: tỷ lệ request chậm (0-1)")
+    parser.add_argument("--slow-latency", type=float, default=5.0, help="Mock LLM: latency của request chậm")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Mock LLM: tỷ lệ lỗi 503 (0-1)")
+    parser.add_argument("--llm-port", type=int, default=9100)
+    parser.add_argument("--node-port", type=int, default=9101)
+    parser.add_argument("--service-port", type=int, default=9102)
+    parser.add_argument("--output", default="", help="Ghi kết quả ra file JSON")
+    parser.add_argument("--baseline", default="", help="File JSON của lần chạy trước để phát hiện regression")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Ngưỡng regression (0.2 = 20%%)")
+    parser.add_argument("--verbose", action="store_true", help="Hiện log của mock và service")
+    sys.exit(asyncio.run(main_async(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+So sánh latency của /ask giữa chế độ tuần tự và chế độ suy đoán (SPECULATIVE_EXECUTION=true)
+với các câu hỏi mơ hồ (bộ phân loại local không chắc chắn, phải gọi LLM decision)
+
+Chạy hai instance của AI service, ví dụ:
+    uvicorn service:app --port 8000
+    SPECULATIVE_EXECUTION=true uvicorn service:app --port 8001
+    python benchmarks/speculative_bench.py --baseline-url http://localhost:8000 --speculative-url http://localhost:8001
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from typing import Dict, List
+
+import httpx
+
+from load_test import percentile
+
+AMBIGUOUS_QUESTIONS = [
+    "Mình muốn tìm hiểu thêm về nền tảng này",
+    "Hôm nay nên luyện gì để tiến bộ",
+    "Tôi nên bắt đầu từ đâu",
+    "Giới thiệu giúp mình vài thứ thú vị",
+    "Các bạn có hỗ trợ học nhóm không",
+    "Có gì mới không",
+]
+
+
+async def run(base_url: str, total: int, concurrency: int, run_id: str) -> Dict[str, float]:
+    """
+    Gửi `total` câu hỏi mơ hồ (mỗi câu có hậu tố riêng để không trúng answer cache)
+    """
+    latencies: List[float] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0) as http:
+        async def one(i: int):
+            nonlocal errors
+            question = f"{AMBIGUOUS_QUESTIONS[i % len(AMBIGUOUS_QUESTIONS)]} ({run_id}-{i})"
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await http.post("/ask", json={"question": question})
+                    if response.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(one(i) for i in range(total)))
+        stats = (await http.get("/stats")).json().get("speculation", {})
+
+    return {
+        "errors": errors,
+        "mean": statistics.mean(latencies) if latencies else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "launched": stats.get("launched", 0),
+        "wasted": stats.get("wasted_tokens_estimate", 0),
+    }
+
+
+async def main_async(args):
+    run_id = uuid.uuid4().hex[:6]
+    results = {}
+    for name, url in (("sequential", args.baseline_url), ("speculative", args.speculative_url)):
+        results[name] = await run(url, args.requests, args.concurrency, f"{run_id}{name[0]}")
+
+    print("=" * 72)
+    print(f"SPECULATIVE EXECUTION BENCHMARK ({args.requests} ambiguous questions, concurrency {args.concurrency})")
+    print("=" * 72)
+    print(f"{'mode':>12} {'errors':>7} {'mean (s)':>9} {'p50 (s)':>9} {'p95 (s)':>9} {'speculated':>11}")
+    for name, result in results.items():
+        print(
+            f"{name:>12} {result['errors']:>7} {result['mean']:>9.3f} {result['p50']:>9.3f} "
+            f"{result['p95']:>9.3f} {result['launched']:>11}"
+        )
+    baseline, speculative = results["sequential"], results["speculative"]
+    print()
+    for metric in ("mean", "p50", "p95"):
+        if speculative[metric] > 0:
+            print(f"{metric} speedup: {baseline[metric] / speculative[metric]:.2f}x")
+    print(f"Estimated wasted tokens (speculative instance, cumulative): {speculative['wasted']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chế độ thực thi suy đoán")
+    parser.add_argument("--baseline-url", default="http://localhost:8000")
+    parser.add_argument("--speculative-url", default="http://localhost:8001")
+    parser.add_argument("--requests", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=1)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
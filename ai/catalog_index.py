@@ -0,0 +1,402 @@
+"""
+Index tìm kiếm (BM25) trong bộ nhớ cho dữ liệu public của hệ thống (khóa học, tài liệu,
+bài tập, cuộc thi) lấy từ Node.js RAG API. Câu hỏi dạng "khóa học nào về Python" được trả lời
+từ các đoạn trích tìm được trong một lần gọi LLM thay vì sinh SQL rồi format kết quả.
+"""
+
+import asyncio
+import hashlib
+import heapq
+import json
+import logging
+import math
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from sql_templates import ENTITY_PHRASES, FILLER_WORDS, FILTER_PHRASES, LIST_PHRASES, ORDER_PHRASES, consume_count
+from text_utils import fold_text
+
+logger = logging.getLogger(__name__)
+
+# Category của RAG API -> key của từng item trong response (data.items.<category>.<item>)
+CATEGORIES = {"courses": "course", "documents": "document", "problems": "problem", "contests": "contest"}
+
+# Từ không mang nội dung tìm kiếm (đã bỏ dấu), ngoài FILLER_WORDS của sql_templates
+STOP_WORDS = FILLER_WORDS | {
+    "ve", "lien", "quan", "den", "toi", "minh", "ban", "khong", "va", "cua", "nay", "do",
+    "de", "tim", "kiem", "giup", "muon", "can", "about", "on", "for", "with", "related",
+    "to", "any", "some", "you", "have",
+}
+
+# Cột lọc (độ khó, cấp độ) của từng category
+CATEGORY_FILTERS = {"courses": "level", "documents": "level", "problems": "difficulty"}
+
+# Cụm từ (đã bỏ dấu) cho thấy câu hỏi cần sắp xếp / giới hạn số dòng / so sánh giá trị,
+# hoặc hỏi về dữ liệu của chính người hỏi: các câu này phải đi đường SQL, không trả lời từ đoạn trích
+# ("trên" không có trong danh sách vì hay gặp trong "trên hệ thống"; "trên 4 sao" đã bị loại vì có số)
+RANKING_PHRASES = [
+    "top", "nhat", "dau tien", "cuoi cung", "first", "last", "most", "least", "best", "cheapest",
+]
+COMPARISON_PHRASES = [
+    "duoi", "hon", "toi da", "toi thieu", "it nhat", "nhieu nhat", "trong khoang", "gioi han",
+    "under", "over", "below", "above", "less than", "more than", "at least", "at most", "between",
+]
+PERSONAL_PHRASES = [
+    "cua toi", "cua minh", "cua em", "toi da", "minh da", "em da", "da dang ky", "dang hoc", "da hoc",
+    "da mua", "da nop", "da lam", "da hoan thanh", "my", "mine", "i have", "i ve", "enrolled",
+]
+_NUMBER_RE = re.compile(r"\b\d+\b")
+
+_TERM_RE = re.compile(r"[a-z0-9+#]+")
+
+
+def _consume(text: str, phrases) -> Tuple[str, List[str]]:
+    matched = []
+    for phrase in sorted(phrases, key=len, reverse=True):
+        pattern = r"\b" + re.escape(phrase) + r"\b"
+        if re.search(pattern, text):
+            matched.append(phrase)
+            text = re.sub(pattern, " ", text)
+    return text, matched
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Token đã bỏ dấu: từng âm tiết và cặp âm tiết liền nhau (tiếng Việt ghép từ nhiều âm tiết)
+    """
+    words = [word for word in _TERM_RE.findall(fold_text(text)) if word not in STOP_WORDS]
+    return words + [f"{a}_{b}" for a, b in zip(words, words[1:])]
+
+
+@dataclass
+class CatalogDoc:
+    key: str
+    category: str
+    title: str
+    snippet: str
+    text: str
+    filters: Dict[str, str] = field(default_factory=dict)
+    digest: str = ""
+
+
+@dataclass
+class CatalogQuery:
+    categories: List[str]
+    terms: List[str]
+    filters: Dict[str, str]
+
+
+def _names(items: Optional[List[Dict[str, Any]]], key: str = "name") -> List[str]:
+    return [str(item.get(key)) for item in items or [] if isinstance(item, dict) and item.get(key)]
+
+
+def _short(text: Any, limit: int) -> str:
+    text = re.sub(r"<[^>]+>", " ", str(text or ""))
+    text = re.sub(r"\s+", " ", text).strip()
+    return text if len(text) <= limit else text[:limit].rstrip() + "…"
+
+
+def build_doc(category: str, item: Dict[str, Any], snippet_chars: int = 300) -> Optional[CatalogDoc]:
+    """
+    Chuyển một item của RAG API thành document: text để index và đoạn trích đưa vào prompt
+    """
+    if not isinstance(item, dict) or item.get("id") is None or not item.get("title"):
+        return None
+    title = str(item["title"])
+    description = _short(item.get("description"), snippet_chars)
+    facts: List[str] = []
+    extra: List[str] = []
+    filters: Dict[str, str] = {}
+
+    if category == "courses":
+        category_name = (item.get("category") or {}).get("name")
+        facts += [f"cấp độ {item.get('level')}", f"đánh giá {item.get('rating')}", f"{item.get('students')} học viên"]
+        facts.append("miễn phí" if item.get("is_free") else f"giá {item.get('price')}")
+        if category_name:
+            facts.append(f"danh mục {category_name}")
+        extra += [category_name or ""] + _names(item.get("modules"), "title")
+        extra += [lesson for module in item.get("modules") or [] for lesson in _names(module.get("lessons"), "title")]
+        filters["level"] = item.get("level") or ""
+    elif category == "documents":
+        topic = (item.get("topic") or {}).get("name")
+        facts += [f"cấp độ {item.get('level')}", f"đánh giá {item.get('rating')}"]
+        if topic:
+            facts.append(f"chủ đề {topic}")
+        extra += [topic or ""] + _names(item.get("categories")) + _names(item.get("modules"), "title")
+        filters["level"] = item.get("level") or ""
+    elif category == "problems":
+        category_name = (item.get("category") or {}).get("name")
+        tags = _names(item.get("tags"))
+        facts += [f"độ khó {item.get('difficulty')}", f"tỉ lệ chấp nhận {item.get('acceptance')}%"]
+        if category_name:
+            facts.append(f"danh mục {category_name}")
+        if tags:
+            facts.append("tags " + ", ".join(tags))
+        extra += [category_name or ""] + tags
+        filters["difficulty"] = item.get("difficulty") or ""
+    elif category == "contests":
+        facts += [f"bắt đầu {item.get('start_time')}", f"kết thúc {item.get('end_time')}"]
+        problems = [(cp.get("problem") or {}).get("title") for cp in item.get("problems") or []]
+        extra += [title for title in problems if title]
+        if extra:
+            facts.append("bài tập " + ", ".join(extra[:5]))
+
+    facts = [fact for fact in facts if "None" not in fact]
+    snippet = f"[{category}] {title}: {description}" + (f" ({'; '.join(facts)})" if facts else "")
+    # Tiêu đề được lặp lại để có trọng số cao hơn mô tả
+    text = " ".join([title, title, description, " ".join(extra)])
+    digest = hashlib.sha1(json.dumps([text, snippet], ensure_ascii=False).encode("utf-8")).hexdigest()
+    return CatalogDoc(f"{category}:{item['id']}", category, title, snippet, text, filters, digest)
+
+
+class BM25Index:
+    """
+    Inverted index BM25 hỗ trợ thêm/xóa từng document (cập nhật tăng dần)
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs: Dict[str, CatalogDoc] = {}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._lengths: Dict[str, int] = {}
+        self._total_length = 0
+        # Hệ số chuẩn hóa độ dài của từng document, tính lại khi index thay đổi
+        self._norms: Optional[Dict[str, float]] = None
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    @property
+    def term_count(self) -> int:
+        return len(self._postings)
+
+    def add(self, doc: CatalogDoc) -> None:
+        if doc.key in self.docs:
+            self.remove(doc.key)
+        counts = Counter(tokenize(doc.text))
+        for term, tf in counts.items():
+            self._postings.setdefault(term, {})[doc.key] = tf
+        length = sum(counts.values())
+        self.docs[doc.key] = doc
+        self._lengths[doc.key] = length
+        self._total_length += length
+        self._norms = None
+
+    def remove(self, key: str) -> None:
+        doc = self.docs.pop(key, None)
+        if doc is None:
+            return
+        for term in set(tokenize(doc.text)):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._lengths.pop(key, 0)
+        self._norms = None
+
+    def prepare(self) -> Dict[str, float]:
+        """
+        Tính trước hệ số chuẩn hóa (gọi sau khi cập nhật để lần tìm kiếm đầu không phải tính)
+        """
+        if self._norms is None:
+            avg_length = self._total_length / len(self.docs) if self.docs else 1.0
+            self._norms = {
+                key: self.k1 * (1 - self.b + self.b * length / avg_length)
+                for key, length in self._lengths.items()
+            }
+        return self._norms
+
+    def search(self, terms: List[str], limit: int = 5, categories: Optional[List[str]] = None,
+               filters: Optional[Dict[str, str]] = None) -> List[Tuple[float, CatalogDoc]]:
+        if not terms or not self.docs:
+            return []
+        total = len(self.docs)
+        norms = self.prepare()
+        boost = self.k1 + 1
+        scores: Dict[str, float] = {}
+        for term in set(terms):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            # Bỏ qua term xuất hiện ở gần như mọi document (không phân biệt được, tốn thời gian duyệt)
+            if idf < 0.05:
+                continue
+            for key, tf in postings.items():
+                scores[key] = scores.get(key, 0.0) + idf * tf * boost / (tf + norms[key])
+
+        def allowed(key: str) -> bool:
+            doc = self.docs[key]
+            if categories and doc.category not in categories:
+                return False
+            return not filters or all(
+                doc.filters.get(column) == value for column, value in filters.items() if column in doc.filters
+            )
+
+        top = heapq.nsmallest(limit, ((-score, key) for key, score in scores.items() if allowed(key)))
+        return [(-score, self.docs[key]) for score, key in top]
+
+
+class CatalogIndex:
+    """
+    Index dữ liệu public lấy từ Node.js RAG API, refresh nền theo từng category và chỉ
+    index lại các item đã thay đổi
+    """
+
+    def __init__(self, http_client: httpx.AsyncClient, node_api_url: str, refresh_interval: float = 600,
+                 retry_interval: float = 60, fetch_timeout: float = 30.0, snippet_chars: int = 300):
+        self.http_client = http_client
+        self.base_url = f"{node_api_url}/api/v1/rag"
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.fetch_timeout = fetch_timeout
+        self.snippet_chars = snippet_chars
+        self.index = BM25Index()
+        self.loaded_at: Dict[str, float] = {}
+        self.last_error: Optional[str] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.stats_counters = {
+            "fetches": 0, "failures": 0, "added": 0, "updated": 0, "removed": 0,
+            "searches": 0, "hits": 0, "search_ms_total": 0.0,
+        }
+
+    async def start(self) -> None:
+        """
+        Chạy vòng refresh nền (không chặn startup, index rỗng thì câu hỏi đi đường SQL như cũ)
+        """
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.ensure_future(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            ok = await self.refresh()
+            await asyncio.sleep(self.refresh_interval if ok else self.retry_interval)
+
+    async def refresh(self) -> bool:
+        """
+        Refresh lần lượt từng category, trả về True nếu mọi category thành công
+        """
+        ok = True
+        for category in CATEGORIES:
+            ok = await self.refresh_category(category) and ok
+        return ok
+
+    async def refresh_category(self, category: str) -> bool:
+        self.stats_counters["fetches"] += 1
+        try:
+            response = await self.http_client.get(f"{self.base_url}/{category}", timeout=self.fetch_timeout)
+            if response.status_code != 200:
+                raise RuntimeError(f"status {response.status_code}: {response.text[:200]}")
+            items = response.json().get("data", {}).get("items", {}).get(category, {}).get(CATEGORIES[category], [])
+        except Exception as e:
+            self.stats_counters["failures"] += 1
+            self.last_error = f"{category}: {e}"
+            logger.warning("Catalog refresh failed for %s, keeping current index: %s", category, e)
+            return False
+
+        seen = set()
+        added = updated = 0
+        for item in items:
+            doc = build_doc(category, item, self.snippet_chars)
+            if doc is None:
+                continue
+            seen.add(doc.key)
+            current = self.index.docs.get(doc.key)
+            if current is not None and current.digest == doc.digest:
+                continue
+            self.index.add(doc)
+            if current is None:
+                added += 1
+            else:
+                updated += 1
+        removed = [key for key, doc in self.index.docs.items() if doc.category == category and key not in seen]
+        for key in removed:
+            self.index.remove(key)
+
+        self.stats_counters["added"] += added
+        self.stats_counters["updated"] += updated
+        self.stats_counters["removed"] += len(removed)
+        self.loaded_at[category] = time.monotonic()
+        self.last_error = None
+        if added or updated or removed:
+            self.index.prepare()
+            logger.info("Catalog %s indexed: +%d ~%d -%d (%d documents total)",
+                        category, added, updated, len(removed), len(self.index))
+        return True
+
+    def parse_question(self, question: str) -> Optional[CatalogQuery]:
+        """
+        Câu hỏi tra cứu catalog: nhắc tới một loại dữ liệu public và có từ khóa nội dung.
+        Câu hỏi đếm, sắp xếp / top-N, có số hoặc so sánh giá trị, hay hỏi về dữ liệu của chính
+        người hỏi cần số liệu chính xác từ SQL nên không được trả lời từ catalog
+        """
+        text = fold_text(question)
+        text, entities = _consume(text, ENTITY_PHRASES)
+        categories = sorted({ENTITY_PHRASES[e] for e in entities} & set(CATEGORIES))
+        if not categories:
+            return None
+        if _NUMBER_RE.search(text):
+            return None
+        if consume_count(question, text)[1]:
+            return None
+        for phrases in (ORDER_PHRASES, RANKING_PHRASES, COMPARISON_PHRASES, PERSONAL_PHRASES):
+            if _consume(text, phrases)[1]:
+                return None
+        text, _ = _consume(text, LIST_PHRASES)
+        filters: Dict[str, str] = {}
+        for category in categories:
+            column = CATEGORY_FILTERS.get(category)
+            if column:
+                text, values = _consume(text, FILTER_PHRASES[column])
+                resolved = {FILTER_PHRASES[column][v] for v in values}
+                if len(resolved) == 1:
+                    filters[column] = resolved.pop()
+        terms = tokenize(text)
+        if not terms:
+            return None
+        return CatalogQuery(categories, terms, filters)
+
+    def search(self, question: str, limit: int = 5, min_score: float = 1.0) -> List[CatalogDoc]:
+        """
+        Các document liên quan tới câu hỏi tra cứu catalog (rỗng nếu không phải dạng câu hỏi này)
+        """
+        if not self.index:
+            return []
+        query = self.parse_question(question)
+        if query is None:
+            return []
+        started = time.perf_counter()
+        results = self.index.search(query.terms, limit, query.categories, query.filters)
+        self.stats_counters["searches"] += 1
+        self.stats_counters["search_ms_total"] += (time.perf_counter() - started) * 1000
+        docs = [doc for score, doc in results if score >= min_score]
+        if docs:
+            self.stats_counters["hits"] += 1
+        return docs
+
+    def stats(self) -> Dict[str, Any]:
+        counts = Counter(doc.category for doc in self.index.docs.values())
+        searches = self.stats_counters["searches"]
+        return {
+            **{key: value for key, value in self.stats_counters.items() if key != "search_ms_total"},
+            "documents": dict(counts),
+            "terms": self.index.term_count,
+            "avg_search_ms": round(self.stats_counters["search_ms_total"] / searches, 4) if searches else 0.0,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,148 @@
+"""
+Xây dựng messages gửi LLM từ conversation history theo ngân sách token:
+giữ nguyên các lượt mới nhất, nén các lượt cũ hơn thành một bản tóm tắt (có cache)
+"""
+
+import math
+import re
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from text_utils import hash_payload
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:  # tiktoken là optional, không có thì ước lượng
+    _ENCODING = None
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_RE = re.compile(r"(?<=[.!?。])\s+|\n+")
+
+# Token cố định cho mỗi message (role, phân cách) theo định dạng chat
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_HEADER = "Tóm tắt các lượt hội thoại trước đó (đã rút gọn):"
+
+
+def count_tokens(text: str) -> int:
+    """
+    Đếm token local (tiktoken nếu có, ngược lại ước lượng theo từ/dấu câu)
+    """
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return int(math.ceil(len(_TOKEN_RE.findall(text)) * 1.3))
+
+
+def _valid_messages(conversation_history: Optional[List[Dict[str, str]]]) -> List[Dict[str, str]]:
+    messages = []
+    for msg in conversation_history or []:
+        role = msg.get("role", "user")
+        content = (msg.get("content") or "").strip()
+        if role in ("user", "assistant") and content:
+            messages.append({"role": role, "content": content})
+    return messages
+
+
+class HistoryBuilder:
+    """
+    Ghép system prompt + history + câu hỏi trong giới hạn token
+    """
+
+    def __init__(self, summary_tokens: int = 400, line_chars: int = 160, cache_size: int = 2048):
+        self.summary_tokens = summary_tokens
+        self.line_chars = line_chars
+        self.cache_size = cache_size
+        self._line_cache: "OrderedDict[str, str]" = OrderedDict()
+
+    def _compress(self, msg: Dict[str, str]) -> str:
+        """
+        Nén một message cũ thành một dòng (câu đầu tiên, cắt ngắn), kết quả được cache
+        """
+        key = hash_payload((msg["role"], msg["content"]))
+        line = self._line_cache.get(key)
+        if line is not None:
+            self._line_cache.move_to_end(key)
+            return line
+
+        content = msg["content"]
+        if "```" in content:
+            content = re.sub(r"```.*?(```|$)", " [code] ", content, flags=re.DOTALL)
+        first = _SENTENCE_RE.split(content.strip(), maxsplit=1)[0].strip()
+        first = re.sub(r"\s+", " ", first)
+        if len(first) > self.line_chars:
+            first = first[:self.line_chars].rstrip() + "…"
+        line = f"- {'Người dùng' if msg['role'] == 'user' else 'Trợ lý'}: {first}"
+
+        self._line_cache[key] = line
+        if len(self._line_cache) > self.cache_size:
+            self._line_cache.popitem(last=False)
+        return line
+
+    def _summarize(self, older: List[Dict[str, str]]) -> Optional[str]:
+        """
+        Bản tóm tắt các lượt cũ, ưu tiên các lượt gần hơn khi vượt ngân sách tóm tắt
+        """
+        if not older or self.summary_tokens <= 0:
+            return None
+        lines: List[str] = []
+        used = count_tokens(SUMMARY_HEADER)
+        for msg in reversed(older):
+            line = self._compress(msg)
+            cost = count_tokens(line) + 1
+            if used + cost > self.summary_tokens:
+                break
+            lines.append(line)
+            used += cost
+        if not lines:
+            return None
+        return SUMMARY_HEADER + "\n" + "\n".join(reversed(lines))
+
+    def build(self, system_prompt: str, question: str, conversation_history: Optional[List[Dict[str, str]]],
+              budget_tokens: int) -> Tuple[List[Dict[str, str]], Dict[str, int]]:
+        """
+        Trả về (messages, thống kê); budget_tokens là ngân sách cho phần history
+        """
+        history, stats = self.history_messages(conversation_history, budget_tokens)
+        messages = [{"role": "system", "content": system_prompt}, *history, {"role": "user", "content": question}]
+        return messages, stats
+
+    def history_messages(self, conversation_history: Optional[List[Dict[str, str]]],
+                         budget_tokens: int) -> Tuple[List[Dict[str, str]], Dict[str, int]]:
+        """
+        Phần history của prompt (bản tóm tắt các lượt cũ + các lượt mới nhất nguyên văn) và thống kê
+        """
+        history = _valid_messages(conversation_history)
+
+        verbatim: List[Dict[str, str]] = []
+        used = 0
+        index = len(history)
+        reserve = self.summary_tokens if history else 0
+        while index > 0:
+            msg = history[index - 1]
+            cost = count_tokens(msg["content"]) + MESSAGE_OVERHEAD_TOKENS
+            # Luôn giữ ít nhất lượt mới nhất, trừ khi nó vượt toàn bộ ngân sách
+            limit = budget_tokens - (reserve if index > 1 else 0)
+            if used + cost > limit and (verbatim or cost > budget_tokens):
+                break
+            verbatim.append(msg)
+            used += cost
+            index -= 1
+        verbatim.reverse()
+        older = history[:index]
+
+        messages = []
+        summary = self._summarize(older)
+        if summary:
+            messages.append({"role": "system", "content": summary})
+            used += count_tokens(summary) + MESSAGE_OVERHEAD_TOKENS
+        messages.extend(verbatim)
+
+        stats = {
+            "verbatim": len(verbatim),
+            "summarized": len(older) if summary else 0,
+            "history_tokens": used,
+        }
+        return messages, stats
@@ -0,0 +1,224 @@
+"""
+Bộ phân loại intent chạy trong process: quyết định câu hỏi có cần query database không
+mà không phải gọi LLM (keyword matching không phân biệt dấu + mô hình n-gram Naive Bayes)
+"""
+
+import json
+import logging
+import math
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Tuple
+
+from text_utils import fold_text
+
+logger = logging.getLogger(__name__)
+
+# Từ khóa chắc chắn cần DB
+STRONG_DB_KEYWORDS = [
+    "có bao nhiêu", "thống kê", "danh sách", "liệt kê",
+    "hiển thị", "show", "list", "đếm", "count", "how many"
+]
+
+# Từ khóa về entities trong hệ thống
+ENTITY_KEYWORDS = [
+    "khóa học", "course", "bài tập", "problem", "tài liệu", "document",
+    "người dùng", "user", "cuộc thi", "contest", "hệ thống"
+]
+
+# Từ chỉ thị đi kèm entity
+INDICATOR_KEYWORDS = [
+    "có", "trong", "của", "nào", "gì", "hiện tại", "hiện có",
+    "mới nhất", "cũ nhất", "nhiều nhất", "ít nhất", "top"
+]
+
+# Câu hỏi kiến thức chung / chào hỏi (không nhắc tới entity của hệ thống) chắc chắn không cần DB,
+# kể cả khi có từ như "list" ("sự khác nhau giữa list và tuple")
+GENERAL_KEYWORDS = [
+    "là gì", "giải thích", "làm thế nào", "cách", "tại sao", "vì sao", "khác nhau",
+    "xin chào", "cảm ơn", "what is", "how to", "explain", "why", "difference between",
+    "hello", "thanks", "thank you",
+]
+
+# Dữ liệu khởi tạo cho mô hình n-gram (lấy từ các ví dụ trong decision prompt)
+SEED_EXAMPLES: List[Tuple[str, bool]] = [
+    ("có bao nhiêu khóa học", True),
+    ("thống kê người dùng", True),
+    ("danh sách khóa học", True),
+    ("hiển thị bài tập", True),
+    ("khóa học nào có rating cao nhất", True),
+    ("bài tập khó nhất", True),
+    ("cuộc thi nào đang diễn ra", True),
+    ("tài liệu mới nhất là gì", True),
+    ("top 5 khóa học được đánh giá cao", True),
+    ("bài tập dễ để luyện tập", True),
+    ("khóa học python cho người mới bắt đầu", True),
+    ("which courses are available", True),
+    ("how many problems are there", True),
+    ("most popular courses", True),
+    ("python là gì", False),
+    ("thuật toán quicksort là gì", False),
+    ("làm thế nào để học lập trình", False),
+    ("cách debug code", False),
+    ("giải thích đệ quy", False),
+    ("sự khác nhau giữa list và tuple", False),
+    ("viết hàm tính giai thừa", False),
+    ("độ phức tạp của thuật toán sắp xếp nhanh", False),
+    ("tại sao code của tôi bị lỗi", False),
+    ("what is dynamic programming", False),
+    ("how to reverse a linked list", False),
+    ("explain recursion", False),
+    ("xin chào", False),
+    ("cảm ơn bạn", False),
+]
+
+
+@dataclass
+class IntentDecision:
+    needs_database: bool
+    confidence: float
+    source: str  # "keyword" | "model"
+    has_entity: bool = False
+
+
+def _compile_keywords(keywords: Iterable[str]) -> "re.Pattern":
+    """
+    Biên dịch danh sách keyword thành một regex alternation trên text đã bỏ dấu
+    (cho phép hậu tố số nhiều tiếng Anh: "courses", "problems", "users")
+    """
+    folded = sorted({fold_text(k) for k in keywords}, key=len, reverse=True)
+    return re.compile(r"\b(?:" + "|".join(re.escape(k) for k in folded) + r")s?\b")
+
+
+def _features(folded: str) -> List[str]:
+    """
+    Unigram + bigram từ câu hỏi đã bỏ dấu
+    """
+    tokens = re.findall(r"\w+", folded)
+    return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+
+class IntentClassifier:
+    """
+    Phân loại câu hỏi cần DB hay không, trả về độ tin cậy đã hiệu chỉnh.
+    Độ tin cậy của mô hình n-gram được kéo về 0.5 khi câu hỏi có ít n-gram đã
+    gặp trong dữ liệu huấn luyện, nên câu hỏi lạ sẽ rơi xuống LLM fallback.
+    """
+
+    def __init__(self, log_path: Optional[str] = None, shrinkage: float = 3.0, log_max_bytes: int = 5_000_000):
+        self.log_path = log_path
+        self.log_max_bytes = log_max_bytes
+        self.shrinkage = shrinkage
+        self._strong_re = _compile_keywords(STRONG_DB_KEYWORDS)
+        self._entity_re = _compile_keywords(ENTITY_KEYWORDS)
+        self._indicator_re = _compile_keywords(INDICATOR_KEYWORDS)
+        self._general_re = _compile_keywords(GENERAL_KEYWORDS)
+        self._counts = {True: Counter(), False: Counter()}
+        self._totals = {True: 0, False: 0}
+        self._docs = {True: 0, False: 0}
+
+        for question, label in SEED_EXAMPLES:
+            self._learn(question, label)
+        self._load_log()
+
+    def _load_log(self) -> None:
+        """
+        Huấn luyện thêm từ các quyết định đã được log (JSONL: {"question", "needs_database"}),
+        gồm cả file đã xoay vòng (<log_path>.1)
+        """
+        if not self.log_path:
+            return
+        loaded = 0
+        for path in (self.log_path + ".1", self.log_path):
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                            self._learn(record["question"], bool(record["needs_database"]))
+                            loaded += 1
+                        except (ValueError, KeyError):
+                            continue
+            except OSError as e:
+                logger.warning("Could not read intent decision log %s: %s", path, e)
+        if loaded:
+            logger.info("Intent classifier trained on %d logged decisions", loaded)
+
+    def _learn(self, question: str, needs_database: bool) -> None:
+        features = _features(fold_text(question))
+        self._counts[needs_database].update(features)
+        self._totals[needs_database] += len(features)
+        self._docs[needs_database] += 1
+
+    def learn(self, question: str, needs_database: bool) -> None:
+        """
+        Cập nhật mô hình từ một quyết định (thường là kết quả LLM) và ghi log nếu được cấu hình
+        """
+        self._learn(question, needs_database)
+        if not self.log_path:
+            return
+        try:
+            # Giới hạn dung lượng: file đầy thì xoay vòng sang <log_path>.1 (ghi đè bản cũ hơn)
+            if self.log_max_bytes and os.path.exists(self.log_path) and os.path.getsize(self.log_path) >= self.log_max_bytes:
+                os.replace(self.log_path, self.log_path + ".1")
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"question": question, "needs_database": needs_database}, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.warning("Could not write intent decision log: %s", e)
+
+    def _model_probability(self, folded: str) -> Tuple[float, int]:
+        """
+        Xác suất cần DB theo Naive Bayes và số n-gram đã biết
+        """
+        features = _features(folded)
+        vocabulary = len(set(self._counts[True]) | set(self._counts[False])) or 1
+        total_docs = self._docs[True] + self._docs[False]
+        log_odds = math.log((self._docs[True] + 1) / (total_docs + 2)) - math.log((self._docs[False] + 1) / (total_docs + 2))
+        known = 0
+        for feature in features:
+            yes = self._counts[True][feature]
+            no = self._counts[False][feature]
+            if yes or no:
+                known += 1
+            log_odds += math.log((yes + 1) / (self._totals[True] + vocabulary))
+            log_odds -= math.log((no + 1) / (self._totals[False] + vocabulary))
+        probability = 1.0 / (1.0 + math.exp(-max(-50.0, min(50.0, log_odds))))
+        return probability, known
+
+    def classify(self, question: str) -> IntentDecision:
+        """
+        Phân loại câu hỏi: keyword matching trước, sau đó mô hình n-gram
+        """
+        folded = fold_text(question)
+        has_entity = bool(self._entity_re.search(folded))
+
+        if not has_entity and self._general_re.search(folded):
+            return IntentDecision(False, 0.9, "keyword")
+
+        if self._strong_re.search(folded):
+            return IntentDecision(True, 0.99, "keyword", has_entity=has_entity)
+
+        if has_entity and self._indicator_re.search(folded):
+            return IntentDecision(True, 0.95, "keyword", has_entity=True)
+
+        probability, known = self._model_probability(folded)
+        weight = known / (known + self.shrinkage)
+        calibrated = 0.5 + (probability - 0.5) * weight
+        needs_database = calibrated >= 0.5
+        confidence = calibrated if needs_database else 1.0 - calibrated
+        return IntentDecision(needs_database, round(confidence, 4), "model", has_entity=has_entity)
+
+    def misclassified_seeds(self, threshold: float) -> List[str]:
+        """
+        Ví dụ khởi tạo không được phân loại đúng với độ tin cậy >= threshold (lẽ ra phải xử lý local)
+        """
+        failed = []
+        for question, label in SEED_EXAMPLES:
+            decision = self.classify(question)
+            if decision.needs_database != label or decision.confidence < threshold:
+                failed.append(question)
+        return failed
@@ -0,0 +1,272 @@
+"""
+Metrics dạng Prometheus text format (counter, gauge, histogram) cho AI service,
+không phụ thuộc thư viện ngoài. Giá trị từ các thống kê có sẵn (cache, schema...)
+được đọc qua collector tại thời điểm scrape.
+"""
+
+import bisect
+import functools
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import tracing
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Collector trả về các dòng (tên, loại, mô tả, labels, giá trị)
+Sample = Tuple[str, str, str, Dict[str, str], float]
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, description: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, description, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self._labels(key))} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> (số lượng theo bucket, tổng, count)
+        self._values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            state[0][index] += 1
+        state[1] += value
+        state[2] += 1
+
+    @contextmanager
+    def time(self, **labels: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, (counts, total, count) in sorted(self._values.items()):
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Registry:
+    """
+    Tập metrics của process, render theo Prometheus text format (version 0.0.4)
+    """
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[Sample]]) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        described = set()
+        for collector in self._collectors:
+            for name, kind, description, labels, value in collector():
+                if value is None:
+                    continue
+                if name not in described:
+                    described.add(name)
+                    lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_DURATION = REGISTRY.register(Histogram(
+    "ai_stage_duration_seconds", "Latency of each ChatAIService pipeline stage", ["stage"]
+))
+LLM_DURATION = REGISTRY.register(Histogram(
+    "ai_llm_request_duration_seconds", "Latency of upstream LLM calls by stage", ["stage", "stream"]
+))
+STREAM_TTFT = REGISTRY.register(Histogram(
+    "ai_stream_time_to_first_token_seconds", "Time from request to first streamed chunk", ["endpoint"]
+))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "ai_llm_tokens_total", "LLM tokens by stage and kind (prompt/completion, cached = prompt tokens served from the upstream prompt cache)", ["stage", "kind"]
+))
+LLM_ROUTE_DURATION = REGISTRY.register(Histogram(
+    "ai_llm_route_duration_seconds", "Latency of upstream LLM calls by model route", ["route", "model"]
+))
+LLM_COST = REGISTRY.register(Counter(
+    "ai_llm_cost_usd_total", "Estimated LLM cost in USD by model route", ["route", "model"]
+))
+LLM_ERRORS = REGISTRY.register(Counter(
+    "ai_llm_errors_total", "Failed upstream LLM calls by stage", ["stage"]
+))
+DECISIONS = REGISTRY.register(Counter(
+    "ai_decisions_total", "Decision layer outcomes by path (keyword, model, llm, fallback, catalog)", ["path", "needs_database"]
+))
+BATCH_QUESTIONS = REGISTRY.register(Counter(
+    "ai_batch_questions_total", "Questions received by /ask-batch by outcome (ok, error, duplicate, empty)", ["outcome"]
+))
+REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "ai_http_requests_in_flight", "HTTP requests currently being served (including open streams)", ["endpoint"]
+))
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    "ai_http_request_duration_seconds", "HTTP request duration including streamed body", ["endpoint"]
+))
+
+
+def timed_stage(stage: str):
+    """
+    Decorator đo latency của một stage (coroutine) vào ai_stage_duration_seconds,
+    đồng thời ghi stage thành một span của trace hiện tại
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                with tracing.span(stage):
+                    return await func(*args, **kwargs)
+            finally:
+                STAGE_DURATION.observe(time.perf_counter() - started, stage=stage)
+        return wrapper
+    return decorator
+
+
+def cached_prompt_tokens(usage) -> int:
+    """
+    Số token prompt upstream lấy từ prompt cache (prompt_tokens_details.cached_tokens
+    theo định dạng OpenAI / OpenRouter), 0 nếu upstream không báo
+    """
+    if usage is None:
+        return 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    extra = getattr(usage, "model_extra", None)
+    if details is None and isinstance(extra, dict):
+        details = extra.get("prompt_tokens_details")
+    cached = details.get("cached_tokens") if isinstance(details, dict) else getattr(details, "cached_tokens", None)
+    return int(cached or 0)
+
+
+def observe_usage(stage: str, usage, prompt_estimate: Optional[int] = None,
+                  completion_estimate: Optional[int] = None) -> Tuple[int, int, int]:
+    """
+    Cộng token từ `usage` của upstream (thiếu usage thì dùng số ước lượng local),
+    trả về (prompt, completion, cached) đã ghi nhận
+    """
+    prompt = getattr(usage, "prompt_tokens", None) if usage is not None else None
+    completion = getattr(usage, "completion_tokens", None) if usage is not None else None
+    prompt = prompt if prompt is not None else prompt_estimate
+    completion = completion if completion is not None else completion_estimate
+    cached = cached_prompt_tokens(usage)
+    if prompt:
+        LLM_TOKENS.inc(prompt, stage=stage, kind="prompt")
+    if cached:
+        LLM_TOKENS.inc(cached, stage=stage, kind="cached")
+    if completion:
+        LLM_TOKENS.inc(completion, stage=stage, kind="completion")
+    return prompt or 0, completion or 0, cached
+
+
+class InFlightMiddleware:
+    """
+    ASGI middleware đếm request đang xử lý và thời gian xử lý (tính cả phần body được stream)
+    """
+
+    def __init__(self, app, endpoints: Iterable[str]):
+        self.app = app
+        self.endpoints = set(endpoints)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        endpoint = scope.get("path", "")
+        if endpoint not in self.endpoints:
+            endpoint = "other"
+        REQUESTS_IN_FLIGHT.inc(endpoint=endpoint)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            REQUESTS_IN_FLIGHT.dec(endpoint=endpoint)
+            REQUEST_DURATION.observe(time.perf_counter() - started, endpoint=endpoint)
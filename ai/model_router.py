@@ -0,0 +1,197 @@
+"""
+Chọn model, max_tokens và temperature cho từng stage theo độ phức tạp của câu hỏi (cấu hình
+bằng JSON, không cần sửa code), kèm thống kê latency và chi phí theo route
+"""
+
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from history import count_tokens
+from text_utils import fold_text
+
+logger = logging.getLogger(__name__)
+
+SIMPLE = "simple"
+COMPLEX = "complex"
+
+# Route mặc định: giữ nguyên hành vi trước đây (mọi stage dùng gpt-4o-mini)
+DEFAULT_ROUTES: Dict[str, Dict[str, Any]] = {
+    "default": {"model": "gpt-4o-mini", "max_tokens": 1000, "temperature": 0.7},
+    "decision": {"max_tokens": 10, "temperature": 0.1},
+    "sql_generation": {"max_tokens": 500, "temperature": 0.3},
+    "answer": {"max_tokens": 1000, "temperature": 0.7},
+    "catalog": {"max_tokens": 1000, "temperature": 0.5},
+    "format": {"max_tokens": 1000, "temperature": 0.7},
+}
+
+# Giá USD / 1M token (prompt, completion, prompt đã cache); ghi đè hoặc bổ sung bằng MODEL_PRICES,
+# thiếu giá token đã cache thì tính bằng CACHED_PRICE_RATIO * giá prompt
+DEFAULT_PRICES: Dict[str, Tuple[float, float, float]] = {
+    "gpt-4o-mini": (0.15, 0.60, 0.075),
+    "gpt-4o": (2.50, 10.00, 1.25),
+    "gpt-4.1-nano": (0.10, 0.40, 0.025),
+    "gpt-4.1-mini": (0.40, 1.60, 0.10),
+    "gpt-4.1": (2.00, 8.00, 0.50),
+}
+CACHED_PRICE_RATIO = 0.5
+
+# Dấu hiệu câu hỏi cần trả lời dài / lập luận (đã bỏ dấu)
+EXPLANATION_PHRASES = [
+    "giai thich", "so sanh", "phan tich", "tai sao", "vi sao", "chi tiet", "huong dan",
+    "tu van", "danh gia", "uu nhuoc diem", "lo trinh",
+    "explain", "compare", "why", "in detail", "step by step",
+]
+
+# Dấu hiệu SQL cần JOIN / GROUP BY / subquery (không còn là truy vấn dạng template)
+SQL_COMPLEX_PHRASES = [
+    "theo tung", "moi", "trung binh", "nhieu nhat", "it nhat", "cao nhat", "thap nhat",
+    "so sanh", "ty le", "xep hang", "top", "chua", "ca hai", "trong thang", "trong nam",
+]
+
+COMPLEX_PHRASES = {
+    "answer": EXPLANATION_PHRASES,
+    "catalog": EXPLANATION_PHRASES,
+    "format": EXPLANATION_PHRASES,
+    "sql_generation": SQL_COMPLEX_PHRASES,
+}
+
+
+@dataclass
+class ModelRoute:
+    name: str
+    model: str
+    max_tokens: int
+    temperature: float
+
+
+def _contains(folded: str, phrase: str) -> bool:
+    return f" {phrase} " in f" {folded} "
+
+
+def _load_json(value: str) -> Dict[str, Any]:
+    """
+    Cấu hình là chuỗi JSON hoặc đường dẫn tới file JSON
+    """
+    if not value:
+        return {}
+    value = value.strip()
+    if not value.startswith("{") and os.path.isfile(value):
+        with open(value, encoding="utf-8") as f:
+            return json.load(f)
+    return json.loads(value)
+
+
+class ModelRouter:
+    """
+    Route theo key "stage:complexity" -> "stage" -> "default"; các trường thiếu lấy từ cấp trên
+    """
+
+    def __init__(self, routes: Optional[Dict[str, Dict[str, Any]]] = None,
+                 prices: Optional[Dict[str, Any]] = None,
+                 complex_question_tokens: int = 40):
+        self.complex_question_tokens = complex_question_tokens
+        self.prices = dict(DEFAULT_PRICES)
+        for model, price in (prices or {}).items():
+            cached = float(price[2]) if len(price) > 2 else float(price[0]) * CACHED_PRICE_RATIO
+            self.prices[model] = (float(price[0]), float(price[1]), cached)
+
+        merged: Dict[str, Dict[str, Any]] = {key: dict(value) for key, value in DEFAULT_ROUTES.items()}
+        for key, value in (routes or {}).items():
+            merged.setdefault(key, {}).update(value)
+        self._config = merged
+        self._routes: Dict[str, ModelRoute] = {}
+        self.counters: Dict[Tuple[str, str], Dict[str, float]] = {}
+
+    @classmethod
+    def from_config(cls, routes_config: str = "", prices_config: str = "", complex_question_tokens: int = 40) -> "ModelRouter":
+        try:
+            routes = _load_json(routes_config)
+        except (OSError, ValueError) as e:
+            logger.error("Invalid MODEL_ROUTES, using default routes: %s", e)
+            routes = {}
+        try:
+            prices = _load_json(prices_config)
+        except (OSError, ValueError) as e:
+            logger.error("Invalid MODEL_PRICES, using default prices: %s", e)
+            prices = {}
+        return cls(routes, prices, complex_question_tokens)
+
+    def complexity(self, stage: str, question: str) -> str:
+        """
+        Câu hỏi dài hoặc có dấu hiệu cần lập luận / truy vấn phức tạp -> complex
+        """
+        if not question or stage == "decision":
+            return SIMPLE
+        if count_tokens(question) > self.complex_question_tokens:
+            return COMPLEX
+        folded = fold_text(question)
+        if any(_contains(folded, phrase) for phrase in COMPLEX_PHRASES.get(stage, ())):
+            return COMPLEX
+        return SIMPLE
+
+    def route(self, stage: str, question: str = "") -> ModelRoute:
+        name = f"{stage}:{self.complexity(stage, question)}"
+        route = self._routes.get(name)
+        if route is None:
+            settings: Dict[str, Any] = {}
+            for key in ("default", stage, name):
+                settings.update(self._config.get(key, {}))
+            route = ModelRoute(
+                name=name,
+                model=str(settings["model"]),
+                max_tokens=int(settings["max_tokens"]),
+                temperature=float(settings["temperature"]),
+            )
+            self._routes[name] = route
+        return route
+
+    def max_tokens(self, stage: str, question: str = "") -> int:
+        return self.route(stage, question).max_tokens
+
+    def cost(self, model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+        """
+        Chi phí USD ước tính; model dạng "provider/model" (OpenRouter) tra theo phần tên model.
+        cached_tokens là phần của prompt_tokens được upstream lấy từ prompt cache
+        """
+        price = self.prices.get(model) or self.prices.get(model.split("/")[-1])
+        if price is None:
+            return 0.0
+        cached_tokens = min(cached_tokens, prompt_tokens)
+        return (
+            (prompt_tokens - cached_tokens) * price[0] + cached_tokens * price[2] + completion_tokens * price[1]
+        ) / 1_000_000
+
+    def record(self, route: ModelRoute, duration: float, prompt_tokens: int = 0,
+               completion_tokens: int = 0, error: bool = False, cached_tokens: int = 0) -> float:
+        """
+        Cộng latency/token/chi phí cho route, trả về chi phí của lần gọi
+        """
+        cost = self.cost(route.model, prompt_tokens, completion_tokens, cached_tokens)
+        counters = self.counters.setdefault((route.name, route.model), {
+            "calls": 0, "errors": 0, "seconds": 0.0, "prompt_tokens": 0, "cached_tokens": 0,
+            "completion_tokens": 0, "cost_usd": 0.0,
+        })
+        counters["calls"] += 1
+        counters["errors"] += int(error)
+        counters["seconds"] += duration
+        counters["prompt_tokens"] += prompt_tokens
+        counters["cached_tokens"] += cached_tokens
+        counters["completion_tokens"] += completion_tokens
+        counters["cost_usd"] += cost
+        return cost
+
+    def stats(self) -> Dict[str, Any]:
+        routes = {}
+        for (name, model), counters in sorted(self.counters.items()):
+            calls = counters["calls"]
+            routes[f"{name} ({model})"] = {
+                **{key: round(value, 6) if isinstance(value, float) else value for key, value in counters.items()},
+                "avg_latency_ms": round(counters["seconds"] / calls * 1000, 1) if calls else None,
+            }
+        return {
+            "config": {key: dict(value) for key, value in self._config.items()},
+            "routes": routes,
+        }
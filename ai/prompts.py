@@ -0,0 +1,201 @@
+"""
+Prompt của các stage LLM, build một lần khi khởi động thay vì ghép f-string trên mỗi request.
+Nội dung luôn theo thứ tự: instruction tĩnh -> schema -> history -> câu hỏi (kèm dữ liệu riêng
+của request), để phần đầu prompt giống hệt nhau từng byte giữa các lần gọi và provider dùng lại
+được prompt cache (token đã cache được tính giá thấp hơn và xử lý nhanh hơn)
+"""
+
+import time
+from string import Formatter
+from typing import Any, Dict, List, Optional, Tuple
+
+from history import HistoryBuilder
+import tracing
+
+DECISION_INSTRUCTIONS = (
+    "Bạn là một hệ thống phân tích câu hỏi. Nhiệm vụ của bạn là quyết định xem câu hỏi có cần query database không.\n\n"
+    "Các loại câu hỏi CẦN query database:\n"
+    "- Hỏi về số lượng, thống kê (ví dụ: 'có bao nhiêu khóa học', 'thống kê người dùng')\n"
+    "- Hỏi về danh sách, liệt kê (ví dụ: 'danh sách khóa học', 'hiển thị bài tập')\n"
+    "- Hỏi về thông tin cụ thể từ hệ thống (ví dụ: 'khóa học nào có rating cao nhất', 'bài tập khó nhất')\n"
+    "- Hỏi về dữ liệu thực tế trong hệ thống\n\n"
+    "Các loại câu hỏi KHÔNG CẦN query database:\n"
+    "- Hỏi về khái niệm, định nghĩa (ví dụ: 'Python là gì', 'thuật toán quicksort là gì')\n"
+    "- Hỏi về cách làm, hướng dẫn (ví dụ: 'làm thế nào để học lập trình', 'cách debug code')\n"
+    "- Hỏi về lý thuyết, kiến thức chung\n\n"
+    "Trả lời CHỈ bằng 'YES' hoặc 'NO': 'YES' nếu cần query database, 'NO' nếu không cần."
+)
+
+SQL_INSTRUCTIONS = (
+    "Bạn là một chuyên gia SQL cho MySQL database. Nhiệm vụ của bạn là phân tích câu hỏi tiếng Việt "
+    "và sinh ra câu lệnh SQL SELECT phù hợp.\n\n"
+    "QUAN TRỌNG:\n"
+    "- CHỈ sinh ra câu lệnh SELECT, KHÔNG được có các lệnh khác (INSERT, UPDATE, DELETE, DROP, etc.)\n"
+    "- Phải sử dụng đúng tên bảng và cột từ DATABASE SCHEMA được cung cấp bên dưới\n"
+    "- Tên bảng trong database là: courses (khóa học), problems (bài tập), documents (tài liệu), users (người dùng)\n"
+    "- Luôn thêm LIMIT để giới hạn kết quả (tối đa 100 rows), trừ câu COUNT/SUM/AVG chỉ trả về một dòng\n"
+    "- Chỉ lấy các cột cần thiết, tránh SELECT * và cột văn bản dài (description, content) khi không cần\n"
+    "- Ưu tiên lọc trên cột có INDEXED / PRIMARY KEY / UNIQUE, không bọc cột trong hàm ở WHERE\n"
+    "- Đối với câu hỏi đếm số lượng, sử dụng COUNT(*)\n"
+    "- Đối với câu hỏi 'có bao nhiêu', trả về SELECT COUNT(*) as total FROM ...\n"
+    "- Trả về CHỈ SQL query, không có giải thích hay text khác\n"
+    "- Nếu không thể sinh SQL hợp lệ, trả về 'NO_SQL'\n\n"
+    "Ví dụ:\n"
+    "Câu hỏi: 'Có những khóa học nào?'\n"
+    "SQL: SELECT id, title, rating, students FROM courses WHERE is_deleted = false AND status = 'published' LIMIT 100\n\n"
+    "Câu hỏi: 'Hệ thống hiện tại có bao nhiêu khóa học?'\n"
+    "SQL: SELECT COUNT(*) as total FROM courses WHERE is_deleted = false\n\n"
+    "Câu hỏi: 'Có bao nhiêu bài tập khó?'\n"
+    "SQL: SELECT COUNT(*) as total FROM problems WHERE difficulty = 'Hard' AND is_deleted = false"
+)
+
+CHAT_INSTRUCTIONS = (
+    "Bạn là trợ lý AI hỗ trợ người học lập trình, nói tiếng Việt. "
+    "Bạn có thể trả lời các câu hỏi về lập trình, thuật toán, công nghệ, "
+    "và các chủ đề liên quan đến học lập trình. "
+    "Hãy trả lời một cách thân thiện, chi tiết và hữu ích. "
+    "Nếu không biết câu trả lời chính xác, hãy đưa ra gợi ý hoặc hướng dẫn tìm hiểu thêm. "
+    "Bạn có thể nhớ và tham khảo các câu hỏi và câu trả lời trước đó trong cuộc hội thoại."
+)
+
+FORMAT_INSTRUCTIONS = (
+    "Bạn là trợ lý AI hỗ trợ người học lập trình, nói tiếng Việt. "
+    "Bạn có thể nhớ và tham khảo các câu hỏi và câu trả lời trước đó trong cuộc hội thoại. "
+    "Tin nhắn cuối gồm kết quả từ database (dạng bảng, cột phân cách bởi '|') và câu hỏi của người dùng. "
+    "Hãy trả lời câu hỏi dựa trên dữ liệu đó một cách thân thiện, chi tiết và hữu ích bằng tiếng Việt. "
+    "Hãy trình bày thông tin một cách dễ hiểu và có cấu trúc."
+)
+
+CATALOG_INSTRUCTIONS = (
+    "Bạn là trợ lý AI hỗ trợ người học lập trình, nói tiếng Việt. "
+    "Trả lời câu hỏi về khóa học, tài liệu, bài tập và cuộc thi CHỈ dựa trên các mục dữ liệu được cung cấp "
+    "trong tin nhắn cuối, một cách thân thiện và có cấu trúc. "
+    "Nếu các mục không phù hợp với câu hỏi, hãy nói rõ là không tìm thấy trong hệ thống."
+)
+
+
+class TextTemplate:
+    """
+    Template dạng "{field}", tách sẵn thành các đoạn literal / field khi khởi tạo
+    """
+
+    def __init__(self, template: str):
+        self.parts: List[Tuple[str, Optional[str]]] = []
+        for literal, field, spec, conversion in Formatter().parse(template):
+            if spec or conversion or field == "":
+                raise ValueError(f"unsupported placeholder in prompt template: {template!r}")
+            self.parts.append((literal, field))
+        self.fields = {field for _, field in self.parts if field}
+
+    def render(self, values: Dict[str, str]) -> str:
+        return "".join(literal + values[field] if field else literal for literal, field in self.parts)
+
+
+class PromptTemplate:
+    """
+    Prompt của một stage: system message tĩnh (dùng lại cùng một object), khối context tùy chọn
+    (schema), history theo ngân sách token, rồi tin nhắn cuối gồm dữ liệu riêng của request và câu hỏi
+    """
+
+    def __init__(self, name: str, instructions: str, question_template: str = "{question}",
+                 context_template: Optional[str] = None, history_budget: int = 0):
+        self.name = name
+        self.system = {"role": "system", "content": instructions}
+        self.context = TextTemplate(context_template) if context_template else None
+        self.question = TextTemplate(question_template)
+        self.history_budget = history_budget
+        # Context giống lần trước (vd. cùng schema) dùng lại message đã render
+        self._last_context: Optional[Tuple[str, Dict[str, str]]] = None
+
+    def _context_message(self, context: str) -> Dict[str, str]:
+        last = self._last_context
+        if last is not None and last[0] == context:
+            return last[1]
+        message = {"role": "system", "content": self.context.render({"context": context})}
+        self._last_context = (context, message)
+        return message
+
+    def build(self, question: str, history_builder: Optional[HistoryBuilder] = None,
+              conversation_history: Optional[List[Dict[str, str]]] = None, context: Optional[str] = None,
+              **values: str) -> Tuple[List[Dict[str, str]], Dict[str, int]]:
+        messages = [self.system]
+        if self.context is not None and context:
+            messages.append(self._context_message(context))
+        stats: Dict[str, int] = {}
+        if self.history_budget and history_builder is not None and conversation_history:
+            history, stats = history_builder.history_messages(conversation_history, self.history_budget)
+            messages.extend(history)
+        values["question"] = question
+        messages.append({"role": "user", "content": self.question.render(values)})
+        return messages, stats
+
+
+class PromptLibrary:
+    """
+    Các prompt template theo stage (cùng tên stage với ModelRouter), kèm thống kê thời gian build
+    và số token prompt / token được upstream cache
+    """
+
+    def __init__(self, history_builder: HistoryBuilder, history_budget: int = 3000, format_history_budget: int = 1000):
+        self.history_builder = history_builder
+        self.templates: Dict[str, PromptTemplate] = {
+            "decision": PromptTemplate("decision", DECISION_INSTRUCTIONS, "Câu hỏi: {question}"),
+            "sql_generation": PromptTemplate(
+                "sql_generation", SQL_INSTRUCTIONS, "Câu hỏi: {question}\n\nSQL:",
+                context_template="DATABASE SCHEMA:\n{context}"
+            ),
+            "answer": PromptTemplate("answer", CHAT_INSTRUCTIONS, history_budget=history_budget),
+            "catalog": PromptTemplate(
+                "catalog", CATALOG_INSTRUCTIONS,
+                "Các mục liên quan trong hệ thống:\n{snippets}\n\nNgười dùng đã hỏi: {question}",
+                history_budget=format_history_budget
+            ),
+            "format": PromptTemplate(
+                "format", FORMAT_INSTRUCTIONS,
+                "Kết quả từ database (dạng bảng, cột phân cách bởi '|'):\n{result}\n\nNgười dùng đã hỏi: {question}",
+                history_budget=format_history_budget
+            ),
+        }
+        self.counters: Dict[str, Dict[str, Any]] = {
+            name: {"builds": 0, "build_seconds": 0.0, "calls": 0, "prompt_tokens": 0, "cached_tokens": 0}
+            for name in self.templates
+        }
+
+    def build(self, stage: str, question: str, conversation_history: Optional[List[Dict[str, str]]] = None,
+              context: Optional[str] = None, **values: str) -> List[Dict[str, str]]:
+        started = time.perf_counter()
+        messages, history_stats = self.templates[stage].build(
+            question, self.history_builder, conversation_history, context, **values
+        )
+        counters = self.counters[stage]
+        counters["builds"] += 1
+        counters["build_seconds"] += time.perf_counter() - started
+        if history_stats:
+            tracing.annotate(
+                messages=len(messages),
+                history_verbatim=history_stats["verbatim"],
+                history_summarized=history_stats["summarized"],
+                history_tokens=history_stats["history_tokens"]
+            )
+        return messages
+
+    def record_usage(self, stage: str, prompt_tokens: int, cached_tokens: int) -> None:
+        counters = self.counters.get(stage)
+        if counters is None:
+            return
+        counters["calls"] += 1
+        counters["prompt_tokens"] += prompt_tokens
+        counters["cached_tokens"] += cached_tokens
+
+    def stats(self) -> Dict[str, Any]:
+        result = {}
+        for name, counters in self.counters.items():
+            builds, prompt_tokens = counters["builds"], counters["prompt_tokens"]
+            result[name] = {
+                **counters,
+                "build_seconds": round(counters["build_seconds"], 6),
+                "avg_build_us": round(counters["build_seconds"] / builds * 1_000_000, 1) if builds else None,
+                "cached_ratio": round(counters["cached_tokens"] / prompt_tokens, 4) if prompt_tokens else 0.0,
+                "static_chars": len(self.templates[name].system["content"]),
+            }
+        return result
@@ -0,0 +1,289 @@
+"""
+Lưu bền kết quả LLM (decision, SQL sinh ra, câu trả lời) trên đĩa bằng SQLite, để sau mỗi lần
+deploy/restart không phải trả lại toàn bộ latency LLM cho các câu hỏi đã trả lời; khi khởi động
+nạp lại các entry dùng nhiều nhất vào cache trong bộ nhớ
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import Counter
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Số lần ghi giữa hai lần dọn entry hết hạn / vượt giới hạn
+TRIM_EVERY = 100
+# Thời gian chờ lock của việc dọn entry / ghi lượt dùng (chạy trong thread riêng, không chặn event loop)
+BACKGROUND_BUSY_TIMEOUT = 5.0
+
+
+@dataclass
+class StoredResponse:
+    key: str
+    stage: str
+    model: str
+    schema_hash: str
+    value: Any
+    hits: int
+    expires_at: float
+
+
+class ResponseStore:
+    """
+    Entry có khóa (cache key gồm stage + câu hỏi đã chuẩn hóa, model, schema hash), giới hạn theo
+    số entry và dung lượng; khi vượt giới hạn loại entry ít dùng nhất (hits, rồi lần dùng gần nhất).
+    Lượt dùng từ cache trong bộ nhớ được gom lại và ghi định kỳ (flush), không ghi đĩa trên mỗi request.
+    get/put chạy trên event loop nên chỉ chờ lock tối đa `busy_timeout` giây (worker khác đang ghi thì
+    coi như miss / bỏ qua lần ghi); dọn entry và flush chạy trong thread riêng với kết nối riêng
+    """
+
+    def __init__(self, path: str, max_entries: int = 50000, max_bytes: int = 256 * 1024 * 1024,
+                 flush_interval: float = 30.0, busy_timeout: float = 0.05):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.busy_timeout = busy_timeout
+        self._task: Optional[asyncio.Task] = None
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._writes = 0
+        self._trimming = False
+        self._pending_hits: "Counter[Tuple[str, str, str]]" = Counter()
+        self.counters = {"hits": 0, "misses": 0, "writes": 0, "errors": 0, "evicted": 0, "warmed": 0}
+
+    def _open(self, timeout: float) -> sqlite3.Connection:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT NOT NULL, model TEXT NOT NULL, schema_hash TEXT NOT NULL, stage TEXT NOT NULL, "
+            "value TEXT NOT NULL, size INTEGER NOT NULL, hits INTEGER NOT NULL DEFAULT 0, "
+            "created_at REAL NOT NULL, last_used REAL NOT NULL, expires_at REAL NOT NULL, "
+            "PRIMARY KEY (key, model, schema_hash))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS responses_usage ON responses (hits, last_used)")
+        return conn
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = self._open(self.busy_timeout)
+            self._pid = os.getpid()
+        return self._conn
+
+    def _in_background(self, operation: Callable[[sqlite3.Connection], int]) -> int:
+        """
+        Chạy operation(conn) trên một kết nối riêng chờ lock lâu hơn (gọi từ thread ngoài event loop)
+        """
+        try:
+            conn = self._open(BACKGROUND_BUSY_TIMEOUT)
+        except sqlite3.Error as e:
+            self.counters["errors"] += 1
+            logger.warning("Response store open failed: %s", e)
+            return 0
+        try:
+            return operation(conn)
+        finally:
+            conn.close()
+
+    def get(self, key: str, model: str, schema_hash: str = "") -> Optional[Any]:
+        """
+        Giá trị còn hạn, None nếu không có / hết hạn / lỗi đọc; lượt dùng được gom để flush sau
+        """
+        try:
+            row = self._connection().execute(
+                "SELECT value FROM responses WHERE key = ? AND model = ? AND schema_hash = ? AND expires_at > ?",
+                (key, model, schema_hash, time.time()),
+            ).fetchone()
+        except sqlite3.Error as e:
+            self.counters["errors"] += 1
+            logger.warning("Response store read failed: %s", e)
+            return None
+        if row is None:
+            self.counters["misses"] += 1
+            return None
+        self.counters["hits"] += 1
+        self.record_hit(key, model, schema_hash)
+        return json.loads(row[0])
+
+    def put(self, key: str, stage: str, model: str, value: Any, ttl_seconds: float, schema_hash: str = "") -> None:
+        try:
+            payload = json.dumps(value, ensure_ascii=False, default=str)
+            now = time.time()
+            # Ghi đè giữ lại số lượt dùng đã có của entry
+            self._connection().execute(
+                "INSERT INTO responses (key, model, schema_hash, stage, value, size, hits, created_at, last_used, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?, ?) "
+                "ON CONFLICT (key, model, schema_hash) DO UPDATE SET value = excluded.value, size = excluded.size, "
+                "last_used = excluded.last_used, expires_at = excluded.expires_at",
+                (key, model, schema_hash, stage, payload, len(payload.encode("utf-8")), now, now, now + ttl_seconds),
+            )
+            self.counters["writes"] += 1
+            self._writes += 1
+            if self._writes % TRIM_EVERY == 0:
+                self._trim_in_background()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            self.counters["errors"] += 1
+            logger.warning("Response store write failed: %s", e)
+
+    def _trim_in_background(self) -> None:
+        """
+        Dọn entry trong thread riêng thay vì trên request path (trim quét toàn bảng theo lượt dùng)
+        """
+        if self._trimming:
+            return
+        self._trimming = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._run_trim()
+            return
+        loop.run_in_executor(None, self._run_trim)
+
+    def _run_trim(self) -> None:
+        try:
+            self._in_background(self.trim)
+        finally:
+            self._trimming = False
+
+    async def start(self) -> None:
+        """
+        Dọn entry hết hạn / vượt giới hạn và chạy vòng flush lượt dùng nền
+        """
+        await asyncio.get_running_loop().run_in_executor(None, self._in_background, self.trim)
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._flush_in_background()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush_in_background()
+
+    async def _flush_in_background(self) -> int:
+        """
+        Lấy lượt dùng đã gom trên event loop, ghi xuống đĩa trong thread riêng
+        """
+        pending = self._take_pending()
+        if not pending:
+            return 0
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._in_background, partial(self._write_hits, pending))
+
+    def record_hit(self, key: str, model: str, schema_hash: str = "") -> None:
+        self._pending_hits[(key, model, schema_hash)] += 1
+
+    def _take_pending(self) -> "Counter[Tuple[str, str, str]]":
+        pending, self._pending_hits = self._pending_hits, Counter()
+        return pending
+
+    def flush(self) -> int:
+        """
+        Ghi các lượt dùng đã gom xuống đĩa trong một transaction, trả về số entry được cập nhật
+        """
+        pending = self._take_pending()
+        if not pending:
+            return 0
+        return self._in_background(partial(self._write_hits, pending))
+
+    def _write_hits(self, pending: "Counter[Tuple[str, str, str]]", conn: sqlite3.Connection) -> int:
+        now = time.time()
+        try:
+            with conn:
+                conn.execute("BEGIN")
+                conn.executemany(
+                    "UPDATE responses SET hits = hits + ?, last_used = ? WHERE key = ? AND model = ? AND schema_hash = ?",
+                    [(count, now, key, model, schema_hash) for (key, model, schema_hash), count in pending.items()],
+                )
+        except sqlite3.Error as e:
+            self.counters["errors"] += 1
+            logger.warning("Response store flush failed: %s", e)
+            return 0
+        return len(pending)
+
+    def trim(self, conn: Optional[sqlite3.Connection] = None) -> int:
+        """
+        Xóa entry hết hạn, rồi loại entry ít dùng nhất tới khi trong giới hạn số entry và dung lượng
+        """
+        try:
+            conn = conn or self._connection()
+            removed = conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),)).rowcount
+            count, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            if count > self.max_entries or size > self.max_bytes:
+                # Bỏ đi thêm 10% để không phải trim lại ngay ở lần ghi kế tiếp
+                target_entries = int(self.max_entries * 0.9)
+                target_bytes = int(self.max_bytes * 0.9)
+                victims: List[Tuple[str, str, str]] = []
+                rows = conn.execute(
+                    "SELECT key, model, schema_hash, size FROM responses ORDER BY hits, last_used"
+                )
+                for key, model, schema_hash, entry_size in rows:
+                    if count <= target_entries and size <= target_bytes:
+                        break
+                    victims.append((key, model, schema_hash))
+                    count -= 1
+                    size -= entry_size
+                rows.close()
+                conn.executemany("DELETE FROM responses WHERE key = ? AND model = ? AND schema_hash = ?", victims)
+                removed += len(victims)
+        except sqlite3.Error as e:
+            self.counters["errors"] += 1
+            logger.warning("Response store trim failed: %s", e)
+            return 0
+        self.counters["evicted"] += max(0, removed)
+        return removed
+
+    def most_used(self, limit: int) -> List[StoredResponse]:
+        """
+        Các entry còn hạn dùng nhiều nhất (để nạp lại vào cache trong bộ nhớ khi khởi động)
+        """
+        try:
+            rows = self._connection().execute(
+                "SELECT key, stage, model, schema_hash, value, hits, expires_at FROM responses "
+                "WHERE expires_at > ? ORDER BY hits DESC, last_used DESC LIMIT ?",
+                (time.time(), limit),
+            ).fetchall()
+        except sqlite3.Error as e:
+            self.counters["errors"] += 1
+            logger.warning("Response store read failed: %s", e)
+            return []
+        return [
+            StoredResponse(key, stage, model, schema_hash, json.loads(value), hits, expires_at)
+            for key, stage, model, schema_hash, value, hits, expires_at in rows
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            entries, size = self._connection().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        except sqlite3.Error:
+            entries, size = None, None
+        return {
+            **self.counters,
+            "path": self.path,
+            "entries": entries,
+            "bytes": size,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "pending_hits": len(self._pending_hits),
+        }
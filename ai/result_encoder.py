@@ -0,0 +1,141 @@
+"""
+Mã hóa kết quả query thành bảng gọn (header một lần, mỗi dòng một row) để đưa vào
+prompt format câu trả lời: bỏ cột không cần, cắt text dài, số dòng theo ngân sách token
+"""
+
+import json
+import re
+from typing import Any, Dict, List, Tuple
+
+from history import count_tokens
+from text_utils import fold_text
+import tracing
+
+
+# Cột nội bộ không bao giờ cần cho câu trả lời
+DROP_COLUMNS = {
+    "is_deleted", "password", "password_hash", "thumbnail", "image", "avatar_url", "slug",
+    "updated_at", "deleted_at",
+}
+
+# Cột chỉ giữ khi câu hỏi nhắc tới (cụm từ đã bỏ dấu)
+OPTIONAL_COLUMNS = {
+    "id": ["id", "ma so"],
+    "description": ["mo ta", "gioi thieu", "noi dung", "chi tiet", "description", "about"],
+    "content": ["noi dung", "chi tiet", "content"],
+    "email": ["email"],
+}
+
+# Số dòng mà baseline cũ (JSON indent=2) đưa vào prompt, dùng để tính token tiết kiệm
+BASELINE_ROWS = 20
+
+_CELL_WS_RE = re.compile(r"\s+")
+
+
+def _cell(value: Any, text_chars: int) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        text = f"{value:.2f}".rstrip("0").rstrip(".")
+    elif isinstance(value, (dict, list)):
+        text = json.dumps(value, ensure_ascii=False)
+    else:
+        text = str(value)
+    text = _CELL_WS_RE.sub(" ", text).replace("|", "/").strip()
+    if len(text) > text_chars:
+        text = text[:text_chars].rstrip() + "…"
+    return text
+
+
+class ResultEncoder:
+    """
+    Encoder kết quả query cho prompt, kèm thống kê token tiết kiệm so với JSON indent=2
+    """
+
+    def __init__(self, budget_tokens: int = 1500, text_chars: int = 120):
+        self.budget_tokens = budget_tokens
+        self.text_chars = text_chars
+        self.counters = {"requests": 0, "tokens": 0, "baseline_tokens": 0, "saved_tokens": 0}
+
+    def _select_columns(self, question: str, rows: List[Dict[str, Any]]) -> Tuple[List[str], Dict[str, Any]]:
+        """
+        Trả về (cột giữ lại, cột có cùng một giá trị ở mọi dòng)
+        """
+        folded = fold_text(question)
+        columns: List[str] = []
+        for row in rows:
+            for column in row:
+                if column not in columns:
+                    columns.append(column)
+
+        kept: List[str] = []
+        constants: Dict[str, Any] = {}
+        for column in columns:
+            if column.lower() in DROP_COLUMNS:
+                continue
+            phrases = OPTIONAL_COLUMNS.get(column.lower())
+            if phrases and not any(re.search(r"\b" + re.escape(p) + r"\b", folded) for p in phrases):
+                continue
+            values = [row.get(column) for row in rows]
+            if all(value in (None, "") for value in values):
+                continue
+            if len(rows) > 1 and all(value == values[0] for value in values):
+                constants[column] = values[0]
+                continue
+            kept.append(column)
+        return kept, constants
+
+    def encode(self, question: str, rows: List[Dict[str, Any]]) -> Tuple[str, Dict[str, int]]:
+        """
+        Trả về (text đưa vào prompt, thống kê token của request)
+        """
+        rows = [row for row in rows if isinstance(row, dict)]
+        kept, constants = self._select_columns(question, rows)
+
+        lines = [f"Tổng số dòng: {len(rows)}"]
+        if constants:
+            lines.append("Giống nhau ở mọi dòng: " + ", ".join(
+                f"{column}={_cell(value, self.text_chars)}" for column, value in constants.items()
+            ))
+        if kept:
+            lines.append(" | ".join(kept))
+        used = count_tokens("\n".join(lines))
+
+        included = 0
+        if kept:
+            for row in rows:
+                line = " | ".join(_cell(row.get(column), self.text_chars) for column in kept)
+                cost = count_tokens(line) + 1
+                # Luôn giữ ít nhất một dòng
+                if included and used + cost > self.budget_tokens:
+                    break
+                lines.append(line)
+                used += cost
+                included += 1
+        if included < len(rows) and kept:
+            lines.append(f"... (còn {len(rows) - included} dòng không hiển thị)")
+        text = "\n".join(lines)
+
+        tokens = count_tokens(text)
+        baseline = count_tokens(json.dumps(rows[:BASELINE_ROWS], ensure_ascii=False, indent=2))
+        stats = {
+            "rows": included,
+            "rows_total": len(rows),
+            "columns": len(kept),
+            "tokens": tokens,
+            "baseline_tokens": baseline,
+            "saved_tokens": baseline - tokens,
+        }
+        self.counters["requests"] += 1
+        self.counters["tokens"] += tokens
+        self.counters["baseline_tokens"] += baseline
+        self.counters["saved_tokens"] += baseline - tokens
+        tracing.annotate(encoded_rows=included, result_rows=len(rows), result_tokens=tokens, saved_tokens=baseline - tokens)
+        return text, stats
+
+    def stats(self) -> Dict[str, Any]:
+        baseline = self.counters["baseline_tokens"]
+        return {
+            **self.counters,
+            "saved_rate": round(self.counters["saved_tokens"] / baseline, 4) if baseline else 0.0,
+        }
@@ -0,0 +1,301 @@
+"""
+Index bảng/cột/foreign key của database schema, dùng để chọn phần schema liên quan
+tới câu hỏi thay vì gửi toàn bộ (hoặc cắt cụt) schema cho LLM
+"""
+
+import hashlib
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from text_utils import fold_text
+
+# Thuật ngữ tiếng Việt (đã bỏ dấu) -> token trong tên bảng
+TERM_ALIASES = {
+    "khoa hoc": ["course"], "bai tap": ["problem"], "tai lieu": ["document"],
+    "nguoi dung": ["user"], "hoc vien": ["user", "enrollment"], "cuoc thi": ["contest"],
+    "danh muc": ["category"], "the loai": ["category"], "danh gia": ["review"],
+    "bai hoc": ["lesson"], "chuong": ["module"], "huy hieu": ["badge"],
+    "thanh tich": ["achievement"], "cap do": ["level"], "bang xep hang": ["leaderboard"],
+    "xep hang": ["leaderboard"], "giang vien": ["instructor"], "dang ky": ["enrollment"],
+    "thanh toan": ["payment"], "bai nop": ["submission"], "nop bai": ["submission"],
+    "chu de": ["topic"], "tro choi": ["game"], "dien dan": ["forum"], "ban be": ["friendship"],
+    "tin nhan": ["message"], "thong bao": ["notification"], "goi y": ["hint"],
+    "ma giam gia": ["coupon"], "phan thuong": ["reward"], "diem thuong": ["reward"],
+    "bai kiem tra": ["quiz"], "vi du": ["example"], "rang buoc": ["constraint"],
+    "hoan thanh": ["completion"], "tien do": ["completion"], "ngon ngu": ["language"],
+}
+
+DEFAULT_TABLES = ["courses", "problems", "documents", "users"]
+
+_TABLE_RE = re.compile(r"^## Table:\s*(\S+)")
+_COLUMN_RE = re.compile(r"^\s+-\s+([A-Za-z0-9_]+)\s+\(")
+_FK_RE = re.compile(r"^\s+-\s+([A-Za-z0-9_]+)\s+->\s+([A-Za-z0-9_]+)\.([A-Za-z0-9_]+)")
+_COLUMN_DESC_RE = re.compile(r"^-\s+[A-Za-z0-9_]+\s+\(([a-z]+)(?:\((\d+)\))?([^)]*)\)", re.I)
+_ROWS_RE = re.compile(r"^Rows:\s*~?(\d+)")
+
+
+def _singular(token: str) -> str:
+    if token.endswith("ies") and len(token) > 4:
+        return token[:-3] + "y"
+    if token.endswith("s") and not token.endswith("ss") and len(token) > 3:
+        return token[:-1]
+    return token
+
+
+@dataclass
+class ColumnInfo:
+    name: str
+    type: str = ""
+    length: Optional[int] = None
+    primary: bool = False
+    unique: bool = False
+    indexed: bool = False
+
+    @property
+    def has_index(self) -> bool:
+        """
+        Cột có thể dùng index (là cột đầu của primary key, unique hoặc index thường)
+        """
+        return self.primary or self.unique or self.indexed
+
+    @classmethod
+    def from_line(cls, line: str) -> "ColumnInfo":
+        """
+        Parse dòng mô tả cột, ví dụ "- title (varchar(255), INDEXED, NOT NULL) - comment"
+        """
+        name = line.lstrip("- ").split(" ", 1)[0]
+        match = _COLUMN_DESC_RE.match(line)
+        if not match:
+            return cls(name)
+        flags = match.group(3).upper()
+        return cls(
+            name=name,
+            type=match.group(1).lower(),
+            length=int(match.group(2)) if match.group(2) else None,
+            primary="PRIMARY KEY" in flags,
+            unique="UNIQUE" in flags,
+            indexed="INDEXED" in flags,
+        )
+
+
+@dataclass
+class TableInfo:
+    name: str
+    columns: List[str] = field(default_factory=list)
+    column_lines: List[str] = field(default_factory=list)
+    foreign_keys: List[Tuple[str, str, str]] = field(default_factory=list)
+    comment: str = ""
+    block: str = ""
+    # Số dòng ước lượng (None nếu schema không có thông tin)
+    rows: Optional[int] = None
+    column_info: Dict[str, ColumnInfo] = field(default_factory=dict)
+
+    def add_column(self, info: ColumnInfo, line: str) -> None:
+        self.columns.append(info.name)
+        self.column_lines.append(line)
+        self.column_info[info.name.lower()] = info
+
+    def index_foreign_keys(self) -> None:
+        """
+        InnoDB luôn tạo index cho cột foreign key
+        """
+        for column, _, _ in self.foreign_keys:
+            info = self.column_info.get(column.lower())
+            if info is not None:
+                info.indexed = True
+
+    @property
+    def tokens(self) -> Set[str]:
+        return {_singular(part) for part in self.name.lower().split("_") if part}
+
+
+class SchemaIndex:
+    """
+    Index của schema: bảng -> cột, foreign key và đoạn text mô tả từng bảng
+    """
+
+    def __init__(self, tables: Dict[str, TableInfo], source: str = ""):
+        self.tables = tables
+        self.hash = hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def from_text(cls, schema: str) -> "SchemaIndex":
+        """
+        Parse schema dạng text (GET /api/v1/chat-ai/schema?format=text)
+        """
+        tables: Dict[str, TableInfo] = {}
+        current: Optional[TableInfo] = None
+        section = None
+        lines: List[str] = []
+
+        def close():
+            if current is not None:
+                current.block = "\n".join(lines).strip()
+
+        for line in (schema or "").splitlines():
+            table_match = _TABLE_RE.match(line)
+            if table_match:
+                close()
+                current = TableInfo(table_match.group(1))
+                tables[current.name] = current
+                section = None
+                lines = [line]
+                continue
+            if current is None:
+                continue
+            lines.append(line)
+            stripped = line.strip()
+            if stripped.startswith("Comment:"):
+                current.comment = stripped[len("Comment:"):].strip()
+            elif section is None and _ROWS_RE.match(stripped):
+                current.rows = int(_ROWS_RE.match(stripped).group(1))
+            elif stripped == "Columns:":
+                section = "columns"
+            elif stripped == "Foreign Keys:":
+                section = "fks"
+            elif section == "columns":
+                column_match = _COLUMN_RE.match(line)
+                if column_match:
+                    current.add_column(ColumnInfo.from_line(stripped), stripped)
+            elif section == "fks":
+                fk_match = _FK_RE.match(line)
+                if fk_match:
+                    current.foreign_keys.append(fk_match.groups())
+        close()
+        for table in tables.values():
+            table.index_foreign_keys()
+        return cls(tables, schema or "")
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "SchemaIndex":
+        """
+        Parse schema dạng JSON (GET /api/v1/chat-ai/schema?format=json)
+        """
+        tables: Dict[str, TableInfo] = {}
+        for raw in data.get("tables", []):
+            table = TableInfo(raw.get("name", ""), rows=raw.get("rows"))
+            # Số dòng không đưa vào block (prompt) vì thay đổi liên tục
+            block = [f"## Table: {table.name}", "", "Columns:"]
+            for col in raw.get("columns", []):
+                desc = col.get("type", "")
+                if col.get("maxLength"):
+                    desc += f"({col['maxLength']})"
+                if col.get("primaryKey"):
+                    desc += ", PRIMARY KEY"
+                if col.get("unique"):
+                    desc += ", UNIQUE"
+                elif col.get("indexed") and not col.get("primaryKey"):
+                    desc += ", INDEXED"
+                if col.get("nullable") is False:
+                    desc += ", NOT NULL"
+                if col.get("default") is not None:
+                    desc += f", DEFAULT: {col['default']}"
+                line = f"- {col['name']} ({desc})"
+                if col.get("comment"):
+                    line += f" - {col['comment']}"
+                table.add_column(ColumnInfo(
+                    name=col["name"],
+                    type=str(col.get("type", "")).lower(),
+                    length=col.get("maxLength"),
+                    primary=bool(col.get("primaryKey")),
+                    unique=bool(col.get("unique")),
+                    indexed=bool(col.get("indexed")),
+                ), line)
+                block.append("  " + line)
+            fks = raw.get("foreignKeys", [])
+            if fks:
+                block += ["", "Foreign Keys:"]
+            for fk in fks:
+                table.foreign_keys.append((fk["column"], fk["referencesTable"], fk["referencesColumn"]))
+                block.append(f"  - {fk['column']} -> {fk['referencesTable']}.{fk['referencesColumn']}")
+            table.block = "\n".join(block)
+            table.index_foreign_keys()
+            tables[table.name] = table
+        source = repr(sorted((t.name, tuple(t.column_lines), tuple(t.foreign_keys)) for t in tables.values()))
+        return cls(tables, source)
+
+    def apply_row_estimates(self, estimates: Dict[str, Any]) -> None:
+        """
+        Gán số dòng ước lượng (gửi tách khỏi schema text) cho các bảng, không đổi hash / block
+        """
+        for name, rows in (estimates or {}).items():
+            table = self.tables.get(name)
+            if table is not None and isinstance(rows, (int, float)) and rows >= 0:
+                table.rows = int(rows)
+
+    def __bool__(self) -> bool:
+        return bool(self.tables)
+
+    def columns(self, table: str) -> Set[str]:
+        info = self.tables.get(table)
+        return set(info.columns) if info else set()
+
+    def column(self, table: str, column: str) -> Optional[ColumnInfo]:
+        info = self.tables.get(table)
+        return info.column_info.get(column.lower()) if info else None
+
+    def _question_terms(self, question: str) -> Set[str]:
+        folded = fold_text(question)
+        terms = {_singular(token) for token in re.findall(r"[a-z0-9_]+", folded)}
+        for phrase, aliases in TERM_ALIASES.items():
+            if re.search(r"\b" + re.escape(phrase) + r"\b", folded):
+                terms.update(aliases)
+        return terms
+
+    def select_tables(self, question: str, max_tables: int = 12) -> List[str]:
+        """
+        Chọn các bảng liên quan tới câu hỏi cùng các bảng láng giềng qua foreign key
+        """
+        terms = self._question_terms(question)
+        scored = []
+        for table in self.tables.values():
+            tokens = table.tokens
+            matched = len(tokens & terms)
+            if matched:
+                scored.append((matched / len(tokens), matched, table.name))
+        scored.sort(key=lambda item: (-item[0], -item[1], item[2]))
+
+        primary = [name for ratio, _, name in scored if ratio >= 1.0]
+        if not primary:
+            primary = [name for _, _, name in scored[:3]]
+        if not primary:
+            primary = [name for name in DEFAULT_TABLES if name in self.tables]
+
+        selected: List[str] = []
+
+        def add(names: Iterable[str]):
+            for name in names:
+                if name in self.tables and name not in selected and len(selected) < max_tables:
+                    selected.append(name)
+
+        add(primary)
+        # Bảng được tham chiếu bởi bảng chính (để JOIN lấy tên, danh mục...)
+        add(sorted({ref for name in primary for _, ref, _ in self.tables[name].foreign_keys}))
+        # Bảng trung gian nối từ hai bảng đã chọn trở lên (ví dụ problem_tags)
+        chosen = set(selected)
+        add(sorted(
+            name for name, table in self.tables.items()
+            if len({ref for _, ref, _ in table.foreign_keys} & chosen) >= 2
+        ))
+        return selected
+
+    def render(self, question: str, max_tables: int = 12, max_chars: int = 8000) -> str:
+        """
+        Schema rút gọn cho câu hỏi: các bảng liên quan đầy đủ + danh sách tên các bảng còn lại
+        """
+        selected = self.select_tables(question, max_tables)
+        blocks: List[str] = []
+        used = 0
+        for name in selected:
+            block = self.tables[name].block
+            if blocks and used + len(block) > max_chars:
+                break
+            blocks.append(block)
+            used += len(block)
+        included = set(selected[:len(blocks)])
+        others = [name for name in sorted(self.tables) if name not in included]
+        text = "\n\n".join(blocks)
+        if others:
+            text += "\n\n## Other tables (columns omitted)\n" + ", ".join(others)
+        return text
@@ -0,0 +1,250 @@
+"""
+Quản lý database schema lấy từ Node.js API: preload khi khởi động, refresh nền trước khi
+hết hạn, gộp các lần fetch đồng thời và giữ schema tốt gần nhất khi Node tạm thời lỗi;
+khi chạy nhiều worker, schema được chia sẻ qua SharedCache để chỉ một worker fetch mỗi lần
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+
+from schema_index import SchemaIndex
+from shared_cache import SharedCache
+
+logger = logging.getLogger(__name__)
+
+SHARED_KEY = "schema"
+SHARED_LEASE_KEY = "schema:lease"
+# Chu kỳ kiểm tra kết quả fetch của worker đang giữ lease
+SHARED_POLL_INTERVAL = 0.1
+
+
+class SchemaManager:
+    """
+    Cache schema với stale-while-revalidate và single-flight fetch
+    """
+
+    def __init__(self, http_client: httpx.AsyncClient, node_api_url: str, ttl_seconds: float = 3600,
+                 refresh_margin: float = 300, retry_interval: float = 30, fetch_timeout: float = 10.0,
+                 shared: Optional[SharedCache] = None):
+        self.http_client = http_client
+        self.shared = shared
+        self.url = f"{node_api_url}/api/v1/chat-ai/schema?format=text"
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin = min(refresh_margin, ttl_seconds / 2)
+        self.retry_interval = retry_interval
+        self.fetch_timeout = fetch_timeout
+
+        self.schema = ""
+        self.index = SchemaIndex({})
+        self.content_hash: Optional[str] = None
+        # Số dòng ước lượng theo bảng (rowEstimates), không tính vào content_hash
+        self.row_estimates: Dict[str, int] = {}
+        self.etag: Optional[str] = None
+        self.loaded_at: Optional[float] = None
+        # Thời điểm (wall clock) của lần fetch tạo ra schema hiện tại, để so với bản dùng chung
+        self.fetched_at: Optional[float] = None
+
+        self._inflight: Optional[asyncio.Future] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.stats_counters = {
+            "fetches": 0, "changed": 0, "unchanged": 0, "not_modified": 0,
+            "failures": 0, "stale_served": 0, "shared_adopted": 0,
+        }
+        self.last_error: Optional[str] = None
+
+    def age(self) -> Optional[float]:
+        if self.loaded_at is None:
+            return None
+        return time.monotonic() - self.loaded_at
+
+    def is_stale(self) -> bool:
+        age = self.age()
+        return age is None or age >= self.ttl_seconds
+
+    def is_stale_for_refresh(self) -> bool:
+        """
+        Schema đã tới lúc cần refresh (trong khoảng refresh_margin trước khi hết hạn)
+        """
+        age = self.age()
+        return age is None or age >= self.ttl_seconds - self.refresh_margin
+
+    async def start(self) -> None:
+        """
+        Preload schema và chạy vòng refresh nền
+        """
+        await self.refresh()
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.ensure_future(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            age = self.age()
+            if age is None or self.last_error:
+                delay = self.retry_interval
+            else:
+                delay = max(1.0, self.ttl_seconds - self.refresh_margin - age)
+            await asyncio.sleep(delay)
+            await self.refresh()
+
+    async def get_schema(self) -> str:
+        """
+        Trả về schema hiện có ngay lập tức (kể cả khi đã cũ, refresh sẽ chạy nền);
+        chỉ chờ fetch khi chưa từng tải được schema
+        """
+        if self.schema:
+            if self.is_stale():
+                self.stats_counters["stale_served"] += 1
+                self._start_refresh()
+            return self.schema
+        await self.refresh()
+        return self.schema
+
+    def _start_refresh(self) -> asyncio.Future:
+        """
+        Single-flight: mọi caller dùng chung một lần fetch đang chạy
+        """
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._fetch())
+
+            def clear(_):
+                self._inflight = None
+
+            self._inflight.add_done_callback(clear)
+        return self._inflight
+
+    async def refresh(self) -> bool:
+        """
+        Fetch schema (gộp với lần fetch đang chạy nếu có), trả về True nếu thành công
+        """
+        return await asyncio.shield(self._start_refresh())
+
+    def _apply(self, schema: str, content_hash: str, row_estimates: Optional[Dict[str, int]] = None) -> bool:
+        """
+        Cập nhật schema và index nếu nội dung thay đổi, trả về True nếu có thay đổi;
+        số dòng ước lượng chỉ được cập nhật vào index hiện có (không parse lại, không đổi hash)
+        """
+        if row_estimates is not None:
+            self.row_estimates = dict(row_estimates)
+        if content_hash == self.content_hash:
+            self.index.apply_row_estimates(self.row_estimates)
+            return False
+        self.index = SchemaIndex.from_text(schema)
+        self.index.apply_row_estimates(self.row_estimates)
+        self.schema = schema
+        self.content_hash = content_hash
+        logger.info("Schema updated: %d characters, %d tables", len(schema), len(self.index.tables))
+        return True
+
+    def _adopt_shared(self) -> bool:
+        """
+        Dùng schema do worker khác fetch nếu mới hơn bản hiện có
+        """
+        entry = self.shared.get(SHARED_KEY) if self.shared is not None else None
+        if not entry or (self.fetched_at is not None and entry["fetched_at"] <= self.fetched_at):
+            return False
+        if self._apply(entry["schema"], entry["content_hash"], entry.get("row_estimates")):
+            self.stats_counters["changed"] += 1
+        self.etag = entry.get("etag")
+        self.fetched_at = entry["fetched_at"]
+        self.loaded_at = time.monotonic() - max(0.0, time.time() - entry["fetched_at"])
+        self.last_error = None
+        self.stats_counters["shared_adopted"] += 1
+        return True
+
+    async def _fetch(self) -> bool:
+        if self.shared is not None:
+            if self._adopt_shared() and not self.is_stale_for_refresh():
+                return True
+            # Một worker giữ lease và fetch, các worker khác chờ kết quả của nó
+            leased = self.shared.add(SHARED_LEASE_KEY, os.getpid(), self.fetch_timeout)
+            if not leased:
+                deadline = time.monotonic() + self.fetch_timeout
+                while time.monotonic() < deadline:
+                    await asyncio.sleep(SHARED_POLL_INTERVAL)
+                    if self._adopt_shared():
+                        return True
+                    if self.shared.get(SHARED_LEASE_KEY) is None:
+                        break
+            try:
+                return await self._fetch_from_node()
+            finally:
+                # Chỉ trả lease do chính worker này giữ (không xóa lease còn hiệu lực của worker khác
+                # khi đã hết thời gian chờ mà không lấy được lease)
+                if leased:
+                    self.shared.delete(SHARED_LEASE_KEY, os.getpid())
+        return await self._fetch_from_node()
+
+    async def _fetch_from_node(self) -> bool:
+        self.stats_counters["fetches"] += 1
+        headers = {"If-None-Match": self.etag} if self.etag and self.schema else {}
+        try:
+            logger.info("Fetching schema from: %s", self.url)
+            response = await self.http_client.get(self.url, headers=headers, timeout=self.fetch_timeout)
+
+            if response.status_code == 304:
+                self.stats_counters["not_modified"] += 1
+                self._loaded()
+                return True
+
+            if response.status_code != 200:
+                raise RuntimeError(f"status {response.status_code}: {response.text[:200]}")
+
+            data = response.json().get("data", {})
+            schema = data.get("schema", "")
+            if not schema:
+                raise RuntimeError("empty schema response")
+
+            content_hash = hashlib.sha1(schema.encode("utf-8")).hexdigest()
+            if self._apply(schema, content_hash, data.get("rowEstimates")):
+                self.stats_counters["changed"] += 1
+            else:
+                self.stats_counters["unchanged"] += 1
+
+            self.etag = response.headers.get("etag")
+            self._loaded()
+            return True
+
+        except Exception as e:
+            self.stats_counters["failures"] += 1
+            self.last_error = str(e)
+            if self.schema:
+                logger.warning("Schema refresh failed, keeping last good schema: %s", e)
+            else:
+                logger.error("Error getting schema: %s", e)
+            return False
+
+    def _loaded(self) -> None:
+        self.loaded_at = time.monotonic()
+        self.fetched_at = time.time()
+        self.last_error = None
+        if self.shared is not None:
+            self.shared.set(SHARED_KEY, {
+                "schema": self.schema, "content_hash": self.content_hash,
+                "row_estimates": self.row_estimates, "etag": self.etag, "fetched_at": self.fetched_at,
+            }, self.ttl_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        age = self.age()
+        return {
+            **self.stats_counters,
+            "loaded": bool(self.schema),
+            "age_seconds": round(age, 1) if age is not None else None,
+            "stale": self.is_stale(),
+            "tables": len(self.index.tables),
+            "last_error": self.last_error,
+        }
@@ -1,14 +1,39 @@
-from fastapi import FastAPI
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from openai import OpenAI
 import os
 import logging
 import json
+import asyncio
+import time
+import uuid
 import httpx
 from typing import Dict, Any, Optional, List
 
+from answer_cache import AnswerCache
+from catalog_index import CatalogIndex
+from answer_renderer import AnswerRenderer
+from result_encoder import ResultEncoder
+from single_flight import SingleFlight
+from speculation import SpeculationBudget
+from intent_classifier import IntentClassifier, IntentDecision
+from sql_templates import SQLTemplateCache
+from schema_index import SchemaIndex
+from sql_guard import SQLGuard
+from response_store import ResponseStore
+from schema_manager import SchemaManager
+from shared_cache import SharedCache
+from upstream_client import UpstreamPool, is_upstream_failure, parse_endpoints, parse_stage_timeouts
+from upstream_health import UpstreamHealth
+from history import HistoryBuilder, count_tokens
+from prompts import PromptLibrary
+from model_router import ModelRouter
+from text_utils import normalize_question, hash_history, hash_payload, split_stream_chunks
+import metrics
+import tracing
+from metrics import timed_stage
+
 app = FastAPI()
 
 # Cấu hình CORS
@@ -20,19 +45,180 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Đếm request đang xử lý / thời gian xử lý theo endpoint (tính cả phần body stream)
+app.add_middleware(
+    metrics.InFlightMiddleware,
+    endpoints=["/ask", "/ask-stream", "/ask-stream-unified", "/format-answer", "/format-answer-stream", "/ask-batch"],
+)
+
 # Cấu hình logging
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
 # Cấu hình Node.js API URL để lấy schema
 NODE_API_URL = os.getenv("NODE_API_URL", "http://localhost:3000")
 
-# 🔹 Dùng OpenRouter endpoint
-client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=os.getenv("OPENROUTER_API_KEY")
+# Endpoint OpenAI-compatible (OpenRouter; benchmark trỏ sang mock server local)
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+
+# Giới hạn số LLM call đồng thời và kích thước connection pool
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "32"))
+AI_HTTP_MAX_CONNECTIONS = int(os.getenv("AI_HTTP_MAX_CONNECTIONS", "100"))
+AI_HTTP_MAX_KEEPALIVE = int(os.getenv("AI_HTTP_MAX_KEEPALIVE", "20"))
+
+# Cấu hình cache câu trả lời (LRU + TTL)
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+
+# Ngưỡng tin cậy của bộ phân loại intent local; dưới ngưỡng thì hỏi LLM
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.75"))
+INTENT_LOG_PATH = os.getenv("INTENT_LOG_PATH", "")
+INTENT_LOG_MAX_BYTES = int(os.getenv("INTENT_LOG_MAX_BYTES", "5000000"))
+
+# Cache schema: TTL, refresh nền trước khi hết hạn, thời gian thử lại khi Node lỗi
+SCHEMA_CACHE_TTL = float(os.getenv("SCHEMA_CACHE_TTL", "3600"))
+SCHEMA_REFRESH_MARGIN = float(os.getenv("SCHEMA_REFRESH_MARGIN", "300"))
+SCHEMA_RETRY_INTERVAL = float(os.getenv("SCHEMA_RETRY_INTERVAL", "30"))
+
+# Ngân sách token cho conversation history (lượt cũ được nén thành tóm tắt)
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))
+FORMAT_HISTORY_TOKEN_BUDGET = int(os.getenv("FORMAT_HISTORY_TOKEN_BUDGET", "1000"))
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "400"))
+
+# Giới hạn phần schema đưa vào prompt sinh SQL (chỉ các bảng liên quan tới câu hỏi)
+SCHEMA_MAX_TABLES = int(os.getenv("SCHEMA_MAX_TABLES", "12"))
+SCHEMA_PROMPT_MAX_CHARS = int(os.getenv("SCHEMA_PROMPT_MAX_CHARS", "8000"))
+# Schema không dài hơn ngưỡng này được gửi nguyên văn thay vì lọc theo câu hỏi (prefix ổn định cho prompt cache)
+SCHEMA_STABLE_MAX_CHARS = int(os.getenv("SCHEMA_STABLE_MAX_CHARS", "6000"))
+
+# Render local kết quả query dạng phổ biến (đếm, tổng hợp, nhóm, danh sách) thay vì gọi LLM
+LOCAL_RENDER_ENABLED = os.getenv("LOCAL_RENDER_ENABLED", "true").lower() in ("1", "true", "yes")
+LOCAL_RENDER_MAX_ROWS = int(os.getenv("LOCAL_RENDER_MAX_ROWS", "20"))
+
+# Ngân sách token cho kết quả query trong prompt format câu trả lời
+FORMAT_RESULT_TOKEN_BUDGET = int(os.getenv("FORMAT_RESULT_TOKEN_BUDGET", "1500"))
+FORMAT_RESULT_TEXT_CHARS = int(os.getenv("FORMAT_RESULT_TEXT_CHARS", "120"))
+
+# Gộp các request giống hệt nhau đang chạy đồng thời (một lần gọi LLM, stream dùng chung)
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Thực thi suy đoán: với câu hỏi mơ hồ, chạy song song decision, sinh SQL và câu trả lời thường,
+# hủy nhánh thua khi có decision; ngân sách token/phút cho các nhánh suy đoán
+SPECULATIVE_EXECUTION = os.getenv("SPECULATIVE_EXECUTION", "false").lower() in ("1", "true", "yes")
+SPECULATIVE_TOKEN_BUDGET = int(os.getenv("SPECULATIVE_TOKEN_BUDGET", "20000"))
+
+# Tra cứu catalog (khóa học, tài liệu, bài tập, cuộc thi) bằng index BM25 từ Node.js RAG API
+CATALOG_RAG_ENABLED = os.getenv("CATALOG_RAG_ENABLED", "true").lower() in ("1", "true", "yes")
+CATALOG_REFRESH_INTERVAL = float(os.getenv("CATALOG_REFRESH_INTERVAL", "600"))
+CATALOG_TOP_K = int(os.getenv("CATALOG_TOP_K", "5"))
+CATALOG_MIN_SCORE = float(os.getenv("CATALOG_MIN_SCORE", "1.0"))
+
+# Readiness probe: kiểm tra upstream LLM nền (không tốn token), số lỗi liên tiếp trước khi báo not ready
+UPSTREAM_PROBE_INTERVAL = float(os.getenv("UPSTREAM_PROBE_INTERVAL", "30"))
+UPSTREAM_PROBE_TIMEOUT = float(os.getenv("UPSTREAM_PROBE_TIMEOUT", "5"))
+UPSTREAM_FAILURE_THRESHOLD = int(os.getenv("UPSTREAM_FAILURE_THRESHOLD", "3"))
+READINESS_REQUIRE_SCHEMA = os.getenv("READINESS_REQUIRE_SCHEMA", "true").lower() in ("1", "true", "yes")
+
+# Định tuyến model theo stage/độ phức tạp câu hỏi: JSON hoặc đường dẫn file JSON
+# (ví dụ {"decision": {"model": "gpt-4.1-nano"}, "answer:complex": {"model": "gpt-4o", "max_tokens": 1500}}),
+# giá USD/1M token (prompt, completion) để báo cáo chi phí theo route
+MODEL_ROUTES = os.getenv("MODEL_ROUTES", "")
+MODEL_PRICES = os.getenv("MODEL_PRICES", "")
+COMPLEX_QUESTION_TOKENS = int(os.getenv("COMPLEX_QUESTION_TOKENS", "40"))
+
+# Upstream LLM: pool endpoint "url|key,url|key" (mặc định OPENROUTER_BASE_URL), deadline theo stage,
+# hedged request sau percentile latency, circuit breaker theo endpoint
+UPSTREAM_ENDPOINTS = os.getenv("UPSTREAM_ENDPOINTS", "")
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "60"))
+UPSTREAM_STAGE_TIMEOUTS = os.getenv("UPSTREAM_STAGE_TIMEOUTS", "decision=5,sql_generation=20,answer=60,catalog=45,format=45")
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.5"))
+HEDGE_MAX_RATIO = float(os.getenv("HEDGE_MAX_RATIO", "0.1"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+# Khi circuit mở: vẫn trả câu trả lời trong cache đã hết hạn không quá số giây này
+ANSWER_CACHE_STALE_SECONDS = float(os.getenv("ANSWER_CACHE_STALE_SECONDS", "86400"))
+# Cache dùng chung giữa các worker (file SQLite); start.py tự đặt khi chạy nhiều worker, rỗng = tắt
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "")
+SHARED_CACHE_MAX_ENTRIES = int(os.getenv("SHARED_CACHE_MAX_ENTRIES", "20000"))
+SHARED_CACHE_BUSY_TIMEOUT = float(os.getenv("SHARED_CACHE_BUSY_TIMEOUT", "0.05"))
+# Lưu bền kết quả LLM (decision, SQL, câu trả lời) qua các lần restart, rỗng = tắt
+RESPONSE_STORE_PATH = os.getenv("RESPONSE_STORE_PATH", "data/response_store.sqlite3")
+RESPONSE_STORE_MAX_ENTRIES = int(os.getenv("RESPONSE_STORE_MAX_ENTRIES", "50000"))
+RESPONSE_STORE_MAX_MB = float(os.getenv("RESPONSE_STORE_MAX_MB", "256"))
+# TTL cho decision/SQL (không phụ thuộc dữ liệu); câu trả lời dùng ANSWER_CACHE_TTL
+RESPONSE_STORE_TTL = float(os.getenv("RESPONSE_STORE_TTL", "604800"))
+RESPONSE_STORE_WARMUP_ENTRIES = int(os.getenv("RESPONSE_STORE_WARMUP_ENTRIES", "2000"))
+RESPONSE_STORE_FLUSH_INTERVAL = float(os.getenv("RESPONSE_STORE_FLUSH_INTERVAL", "30"))
+RESPONSE_STORE_BUSY_TIMEOUT = float(os.getenv("RESPONSE_STORE_BUSY_TIMEOUT", "0.05"))
+# Tracing theo request: tỷ lệ trace được ghi log (0-1), ngưỡng request chậm (ghi đầy đủ chi tiết),
+# số trace chậm gần nhất giữ lại cho /traces/slow
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "5"))
+TRACE_SLOW_KEEP = int(os.getenv("TRACE_SLOW_KEEP", "50"))
+
+# /ask-batch: số câu hỏi tối đa mỗi batch, số câu hỏi xử lý đồng thời (mặc định / tối đa client được chọn)
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "1000"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+# Kiểm tra SQL sinh ra trước khi gửi sang Node: LIMIT tối đa (và khi chọn cột TEXT/BLOB/JSON),
+# ngưỡng số dòng MySQL phải đọc (ước lượng), số dòng mặc định của bảng không có thống kê
+SQL_GUARD_ENABLED = os.getenv("SQL_GUARD_ENABLED", "true").lower() in ("1", "true", "yes")
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", "100"))
+SQL_WIDE_MAX_ROWS = int(os.getenv("SQL_WIDE_MAX_ROWS", "20"))
+SQL_MAX_EXAMINED_ROWS = int(os.getenv("SQL_MAX_EXAMINED_ROWS", "1000000"))
+SQL_DEFAULT_TABLE_ROWS = int(os.getenv("SQL_DEFAULT_TABLE_ROWS", "10000"))
+
+# Stage của cache key -> stage LLM tạo ra giá trị (để lấy model trong khóa lưu bền)
+STORE_STAGES = {"decision": "decision", "sql": "sql_generation", "chat": "answer", "process": "answer", "format": "format"}
+# Stage có kết quả phụ thuộc schema database
+SCHEMA_STAGES = ("sql", "process")
+# Stage lưu bền với RESPONSE_STORE_TTL thay vì ANSWER_CACHE_TTL
+DURABLE_STAGES = ("decision", "sql")
+
+# Một trace cho mỗi request (trace ID từ Node qua header X-Trace-Id)
+tracer = tracing.Tracer(sample_rate=TRACE_SAMPLE_RATE, slow_threshold=TRACE_SLOW_SECONDS, keep_slow=TRACE_SLOW_KEEP)
+app.add_middleware(
+    tracing.TracingMiddleware,
+    tracer=tracer,
+    endpoints=["/ask", "/ask-stream", "/ask-stream-unified", "/format-answer", "/format-answer-stream"],
 )
 
+# HTTP client dùng chung (keep-alive) cho cả OpenRouter và Node.js API
+http_client = httpx.AsyncClient(
+    timeout=httpx.Timeout(60.0, connect=10.0),
+    limits=httpx.Limits(
+        max_connections=AI_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=AI_HTTP_MAX_KEEPALIVE
+    )
+)
+
+# 🔹 Dùng OpenRouter endpoint (hoặc pool endpoint OpenAI-compatible)
+upstream = UpstreamPool(
+    parse_endpoints(UPSTREAM_ENDPOINTS, OPENROUTER_BASE_URL, os.getenv("OPENROUTER_API_KEY")),
+    http_client,
+    stage_timeouts=parse_stage_timeouts(UPSTREAM_STAGE_TIMEOUTS),
+    default_timeout=UPSTREAM_TIMEOUT,
+    hedge_enabled=HEDGE_ENABLED,
+    hedge_percentile=HEDGE_PERCENTILE,
+    hedge_min_delay=HEDGE_MIN_DELAY,
+    hedge_max_ratio=HEDGE_MAX_RATIO,
+    failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+    reset_timeout=CIRCUIT_RESET_TIMEOUT
+)
+
+# Schema tối thiểu khi chưa lấy được schema từ Node.js API
+BASIC_SCHEMA = (
+    "Tables: courses (id, title, description, rating, students, status, is_deleted), "
+    "problems (id, title, difficulty, is_deleted), "
+    "documents (id, title, description, is_deleted), "
+    "users (id, name, email, role, is_active)"
+)
+
+# Câu trả lời khi gọi AI thất bại (không được đưa vào cache)
+AI_ERROR_MESSAGE = "Xin lỗi, tôi gặp lỗi khi tạo phản hồi. Vui lòng thử lại."
+
 class ChatMessage(BaseModel):
     role: str  # "user" or "assistant"
     content: str
@@ -47,188 +233,351 @@ class FormatAnswerRequest(BaseModel):
     query_info: Optional[Dict[str, Any]] = None
     conversation_history: Optional[List[ChatMessage]] = None
 
+class BatchRequest(BaseModel):
+    questions: List[str]
+    conversation_history: Optional[List[ChatMessage]] = None  # Dùng chung cho mọi câu hỏi trong batch
+    concurrency: Optional[int] = None  # Mặc định BATCH_CONCURRENCY, tối đa BATCH_MAX_CONCURRENCY
+
 class ChatAIService:
     """
     Service chính xử lý chat AI với khả năng query database
     """
     
     def __init__(self):
-        self.schema_cache = None
-        self.schema_cache_time = None
+        self.shared_cache = SharedCache(SHARED_CACHE_PATH, SHARED_CACHE_MAX_ENTRIES, SHARED_CACHE_BUSY_TIMEOUT) if SHARED_CACHE_PATH else None
+        self.schema_manager = SchemaManager(
+            http_client,
+            NODE_API_URL,
+            ttl_seconds=SCHEMA_CACHE_TTL,
+            refresh_margin=SCHEMA_REFRESH_MARGIN,
+            retry_interval=SCHEMA_RETRY_INTERVAL,
+            shared=self.shared_cache
+        )
+        self._llm_semaphore = None
+        self.answer_cache = AnswerCache(
+            ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL, ANSWER_CACHE_STALE_SECONDS, shared=self.shared_cache
+        )
+        self.response_store = ResponseStore(
+            RESPONSE_STORE_PATH,
+            max_entries=RESPONSE_STORE_MAX_ENTRIES,
+            max_bytes=int(RESPONSE_STORE_MAX_MB * 1024 * 1024),
+            flush_interval=RESPONSE_STORE_FLUSH_INTERVAL,
+            busy_timeout=RESPONSE_STORE_BUSY_TIMEOUT
+        ) if RESPONSE_STORE_PATH else None
+        self.history_builder = HistoryBuilder(summary_tokens=HISTORY_SUMMARY_TOKENS)
+        self.prompts = PromptLibrary(self.history_builder, HISTORY_TOKEN_BUDGET, FORMAT_HISTORY_TOKEN_BUDGET)
+        self.intent_classifier = IntentClassifier(log_path=INTENT_LOG_PATH or None, log_max_bytes=INTENT_LOG_MAX_BYTES)
+        misclassified = self.intent_classifier.misclassified_seeds(INTENT_CONFIDENCE_THRESHOLD)
+        if misclassified:
+            logger.warning("Intent classifier sends %d seed examples to the LLM: %s", len(misclassified), misclassified)
+        self.sql_templates = SQLTemplateCache()
+        self.sql_guard = SQLGuard(
+            max_rows=SQL_MAX_ROWS,
+            wide_max_rows=SQL_WIDE_MAX_ROWS,
+            max_examined_rows=SQL_MAX_EXAMINED_ROWS,
+            default_table_rows=SQL_DEFAULT_TABLE_ROWS
+        ) if SQL_GUARD_ENABLED else None
+        self.answer_renderer = AnswerRenderer(max_rows=LOCAL_RENDER_MAX_ROWS)
+        self.result_encoder = ResultEncoder(FORMAT_RESULT_TOKEN_BUDGET, FORMAT_RESULT_TEXT_CHARS)
+        self.single_flight = SingleFlight(SINGLE_FLIGHT_ENABLED)
+        self.speculative = SPECULATIVE_EXECUTION
+        self.speculation_budget = SpeculationBudget(SPECULATIVE_TOKEN_BUDGET)
+        self.catalog_index = CatalogIndex(http_client, NODE_API_URL, refresh_interval=CATALOG_REFRESH_INTERVAL)
+        self.model_router = ModelRouter.from_config(MODEL_ROUTES, MODEL_PRICES, COMPLEX_QUESTION_TOKENS)
+        self.upstream_health = UpstreamHealth(
+            http_client,
+            OPENROUTER_BASE_URL,
+            api_key=os.getenv("OPENROUTER_API_KEY"),
+            interval=UPSTREAM_PROBE_INTERVAL,
+            timeout=UPSTREAM_PROBE_TIMEOUT,
+            failure_threshold=UPSTREAM_FAILURE_THRESHOLD
+        )
     
-    def _get_database_schema(self) -> str:
+    def _cache_key(self, stage: str, question: str, conversation_history: Optional[List[Dict[str, str]]], extra: str = "") -> str:
         """
-        Lấy database schema từ Node.js API
+        Key cache: stage + câu hỏi đã chuẩn hóa + hash của history được đưa vào prompt
         """
-        try:
-            # Cache schema trong 1 giờ
-            import time
-            if self.schema_cache and self.schema_cache_time:
-                if time.time() - self.schema_cache_time < 3600:
-                    logger.info("Using cached schema")
-                    return self.schema_cache
-            
-            logger.info(f"Fetching schema from: {NODE_API_URL}/api/v1/chat-ai/schema")
-            with httpx.Client(timeout=10.0) as client:
-                response = client.get(f"{NODE_API_URL}/api/v1/chat-ai/schema?format=text")
-                logger.info(f"Schema API response status: {response.status_code}")
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    schema = data.get("data", {}).get("schema", "")
-                    if schema:
-                        self.schema_cache = schema
-                        self.schema_cache_time = time.time()
-                        logger.info(f"Schema fetched successfully, length: {len(schema)} characters")
-                        return schema
-                    else:
-                        logger.warning("Schema response is empty")
-                        return ""
-                else:
-                    logger.warning(f"Failed to get schema: {response.status_code}, response: {response.text[:200]}")
-                    return ""
-        except Exception as e:
-            logger.error(f"Error getting schema: {e}", exc_info=True)
-            return ""
+        return f"{stage}|{normalize_question(question)}|{hash_history(conversation_history)}|{extra}"
+    
+    def _get_llm_semaphore(self) -> asyncio.Semaphore:
+        """
+        Semaphore giới hạn số LLM call đồng thời (tạo lazily trong event loop đang chạy)
+        """
+        if self._llm_semaphore is None:
+            self._llm_semaphore = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+        return self._llm_semaphore
+    
+    async def _create_completion(self, stage: str, messages: List[Dict[str, str]], question: str = ""):
+        """
+        Gọi chat completion (non-streaming) theo route của stage với giới hạn concurrency,
+        ghi latency, token và chi phí theo stage/route
+        """
+        route = self.model_router.route(stage, question)
+        with tracing.span("llm", stage=stage, model=route.model) as llm_span:
+            async with self._get_llm_semaphore():
+                started = time.perf_counter()
+                try:
+                    completion = await upstream.create(
+                        stage,
+                        model=route.model,
+                        messages=messages,
+                        temperature=route.temperature,
+                        max_tokens=route.max_tokens
+                    )
+                except Exception as e:
+                    metrics.LLM_ERRORS.inc(stage=stage)
+                    self._record_upstream_error(e)
+                    self._record_route(route, time.perf_counter() - started, error=True)
+                    raise
+                finally:
+                    metrics.LLM_DURATION.observe(time.perf_counter() - started, stage=stage, stream="false")
+            self.upstream_health.record_success()
+            prompt_tokens, completion_tokens, cached_tokens = metrics.observe_usage(stage, getattr(completion, "usage", None))
+            self._record_route(route, time.perf_counter() - started, prompt_tokens, completion_tokens, cached_tokens)
+            self.prompts.record_usage(stage, prompt_tokens, cached_tokens)
+            if llm_span is not None:
+                llm_span.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, cached_tokens=cached_tokens)
+        return completion
+    
+    def _record_route(self, route, duration: float, prompt_tokens: int = 0, completion_tokens: int = 0,
+                      cached_tokens: int = 0, error: bool = False) -> None:
+        cost = self.model_router.record(route, duration, prompt_tokens, completion_tokens, error, cached_tokens)
+        metrics.LLM_ROUTE_DURATION.observe(duration, route=route.name, model=route.model)
+        if cost:
+            metrics.LLM_COST.inc(cost, route=route.name, model=route.model)
     
-    def _decide_if_needs_database(self, question: str) -> bool:
+    def _record_upstream_error(self, error: Exception) -> None:
+        """
+        Chỉ lỗi kết nối/timeout/5xx/429 mới tính là upstream không khả dụng (lỗi 4xx do request)
+        """
+        if is_upstream_failure(error):
+            self.upstream_health.record_failure(error)
+    
+    def _cached(self, cache_key: str) -> Optional[Any]:
+        """
+        Tra answer cache; khi circuit upstream đang mở (fail fast) thì dùng cả câu trả lời đã hết hạn
+        """
+        value = self.answer_cache.get(cache_key)
+        if self.response_store is not None:
+            stage, model, schema_hash = self._store_identity(cache_key)
+            if value is not None:
+                self.response_store.record_hit(cache_key, model, schema_hash)
+            else:
+                value = self.response_store.get(cache_key, model, schema_hash)
+                if value is not None:
+                    self.answer_cache.set(cache_key, value)
+        if value is None and not upstream.available:
+            value = self.answer_cache.get_stale(cache_key)
+            if value is not None:
+                logger.warning("Upstream unavailable, serving stale cached answer")
+                tracing.annotate(stale=True)
+        if value is not None:
+            tracing.event("Cache hit: %s", cache_key.split("|", 1)[0])
+        return value
+    
+    def _remember(self, cache_key: str, value: Any) -> None:
+        """
+        Lưu kết quả vào answer cache và (nếu bật) xuống ResponseStore để dùng lại sau khi restart
+        """
+        self.answer_cache.set(cache_key, value)
+        if self.response_store is not None:
+            stage, model, schema_hash = self._store_identity(cache_key)
+            ttl = RESPONSE_STORE_TTL if stage in DURABLE_STAGES else ANSWER_CACHE_TTL
+            self.response_store.put(cache_key, stage, model, value, ttl, schema_hash)
+    
+    def _store_identity(self, cache_key: str):
+        """
+        (stage, model, schema hash) của một cache key: kết quả lưu bền chỉ dùng lại khi
+        model của route và schema (với stage phụ thuộc schema) không đổi
+        """
+        stage, question = cache_key.split("|", 2)[:2]
+        model = self.model_router.route(STORE_STAGES.get(stage, "answer"), question).model
+        schema_hash = (self.schema_manager.content_hash or "") if stage in SCHEMA_STAGES else ""
+        return stage, model, schema_hash
+    
+    def warm_from_store(self) -> int:
+        """
+        Nạp các kết quả dùng nhiều nhất từ ResponseStore vào answer cache (gọi khi khởi động, sau khi có schema)
+        """
+        if self.response_store is None or RESPONSE_STORE_WARMUP_ENTRIES <= 0:
+            return 0
+        started = time.perf_counter()
+        warmed = 0
+        for entry in self.response_store.most_used(RESPONSE_STORE_WARMUP_ENTRIES):
+            _, model, schema_hash = self._store_identity(entry.key)
+            if entry.model != model or entry.schema_hash != schema_hash:
+                continue
+            self.answer_cache.warm(entry.key, entry.value, entry.expires_at - time.time())
+            warmed += 1
+        self.response_store.counters["warmed"] += warmed
+        logger.info("Warmed %d cached responses from %s in %.1fms", warmed, self.response_store.path, (time.perf_counter() - started) * 1000)
+        return warmed
+    
+    @timed_stage("schema")
+    async def _get_database_schema(self) -> str:
+        """
+        Lấy database schema từ Node.js API (qua SchemaManager, không chặn khi schema đã cũ)
+        """
+        return await self.schema_manager.get_schema()
+    
+    def _get_schema_index(self, schema: str) -> SchemaIndex:
+        """
+        Index bảng/cột/foreign key của schema (SchemaManager chỉ parse lại khi nội dung thay đổi)
+        """
+        if schema == self.schema_manager.schema:
+            return self.schema_manager.index
+        return SchemaIndex.from_text(schema)
+    
+    @timed_stage("decision")
+    async def _decide_if_needs_database(self, question: str, intent: Optional[IntentDecision] = None) -> bool:
         """
         Decision layer: Quyết định xem câu hỏi có cần query database không
-        Sử dụng keyword matching trước (nhanh hơn), sau đó mới dùng AI nếu cần
+        Sử dụng bộ phân loại local trước (keyword + n-gram), chỉ dùng AI khi độ tin cậy dưới ngưỡng
         """
-        question_lower = question.lower()
-        
-        # Keyword matching - nhanh và chính xác cho các trường hợp phổ biến
-        strong_db_keywords = [
-            "có bao nhiêu", "thống kê", "danh sách", "liệt kê",
-            "hiển thị", "show", "list", "đếm", "count"
-        ]
-        
-        # Nếu có strong keywords, chắc chắn cần DB
-        if any(keyword in question_lower for keyword in strong_db_keywords):
-            logger.info(f"Strong DB keyword detected in: '{question}'")
-            return True
-        
-        # Kiểm tra có từ khóa về entities (khóa học, bài tập, etc.)
-        entity_keywords = [
-            "khóa học", "course", "bài tập", "problem", "tài liệu", "document",
-            "người dùng", "user", "cuộc thi", "contest", "hệ thống"
-        ]
-        
-        has_entity = any(keyword in question_lower for keyword in entity_keywords)
-        
-        # Nếu có entity keywords + các từ chỉ thị, cần DB
-        if has_entity:
-            indicator_keywords = [
-                "có", "trong", "của", "nào", "gì", "hiện tại", "hiện có",
-                "mới nhất", "cũ nhất", "nhiều nhất", "ít nhất", "top"
-            ]
-            if any(keyword in question_lower for keyword in indicator_keywords):
-                logger.info(f"Entity + indicator detected in: '{question}'")
-                return True
-        
-        # Nếu không match keyword, dùng AI để quyết định (cho các trường hợp phức tạp)
+        # Phân loại local (keyword + n-gram), chỉ gọi LLM khi độ tin cậy thấp
+        if intent is None:
+            intent = self.intent_classifier.classify(question)
+        if intent.confidence >= INTENT_CONFIDENCE_THRESHOLD:
+            tracing.annotate(source=intent.source, confidence=intent.confidence, needs_database=intent.needs_database)
+            metrics.DECISIONS.inc(path=intent.source, needs_database=str(intent.needs_database).lower())
+            return intent.needs_database
+        return await self._decide_with_llm(question, intent.has_entity)
+    
+    async def _decide_with_llm(self, question: str, has_entity: bool) -> bool:
+        """
+        Độ tin cậy của bộ phân loại local thấp: dùng AI để quyết định (cho các trường hợp phức tạp)
+        """
+        cache_key = self._cache_key("decision", question, None)
+        cached_decision = self._cached(cache_key)
+        if cached_decision is not None:
+            metrics.DECISIONS.inc(path="cache", needs_database=str(cached_decision).lower())
+            tracing.annotate(source="cache", needs_database=cached_decision)
+            return cached_decision
         try:
-            decision_prompt = (
-                f"Phân tích câu hỏi sau và quyết định xem có cần query database không:\n\n"
-                f"Câu hỏi: {question}\n\n"
-                f"Các loại câu hỏi CẦN query database:\n"
-                f"- Hỏi về số lượng, thống kê (ví dụ: 'có bao nhiêu khóa học', 'thống kê người dùng')\n"
-                f"- Hỏi về danh sách, liệt kê (ví dụ: 'danh sách khóa học', 'hiển thị bài tập')\n"
-                f"- Hỏi về thông tin cụ thể từ hệ thống (ví dụ: 'khóa học nào có rating cao nhất', 'bài tập khó nhất')\n"
-                f"- Hỏi về dữ liệu thực tế trong hệ thống\n\n"
-                f"Các loại câu hỏi KHÔNG CẦN query database:\n"
-                f"- Hỏi về khái niệm, định nghĩa (ví dụ: 'Python là gì', 'thuật toán quicksort là gì')\n"
-                f"- Hỏi về cách làm, hướng dẫn (ví dụ: 'làm thế nào để học lập trình', 'cách debug code')\n"
-                f"- Hỏi về lý thuyết, kiến thức chung\n\n"
-                f"Trả lời CHỈ bằng 'YES' nếu cần query database, hoặc 'NO' nếu không cần."
-            )
-            
-            completion = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "Bạn là một hệ thống phân tích câu hỏi. Nhiệm vụ của bạn là quyết định xem câu hỏi có cần query database không. Trả lời CHỈ bằng 'YES' hoặc 'NO'."
-                    },
-                    {"role": "user", "content": decision_prompt}
-                ],
-                temperature=0.1,
-                max_tokens=10
+            completion = await self._create_completion(
+                "decision",
+                messages=self.prompts.build("decision", question),
+                question=question
             )
             
             decision = completion.choices[0].message.content.strip().upper()
             needs_db = decision == "YES" or "YES" in decision
             
-            logger.info(f"AI decision for question '{question}': {'NEEDS_DB' if needs_db else 'NO_DB'} (response: {decision})")
+            tracing.annotate(source="llm", needs_database=needs_db)
+            tracing.event("LLM decision response: %s", decision)
+            self.intent_classifier.learn(question, needs_db)
+            self._remember(cache_key, needs_db)
+            metrics.DECISIONS.inc(path="llm", needs_database=str(needs_db).lower())
             return needs_db
             
         except Exception as e:
             logger.error(f"Error in AI decision layer: {e}")
             # Fallback: nếu có entity keywords thì cần DB
+            metrics.DECISIONS.inc(path="fallback", needs_database=str(has_entity).lower())
             return has_entity
     
-    def process_question(self, question: str, conversation_history: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
+    async def process_question(self, question: str, conversation_history: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
         """
         Xử lý câu hỏi với decision layer: quyết định có cần query DB không
         conversation_history: List of messages với format [{"role": "user|assistant", "content": "..."}]
+        Các request giống hệt nhau đang chạy đồng thời dùng chung một lần xử lý
+        """
+        key = self._cache_key("process", question, conversation_history)
+        result = await self.single_flight.do(key, lambda: self._process_question(question, conversation_history))
+        return dict(result)
+    
+    async def process_batch(self, questions: List[str], conversation_history: Optional[List[Dict[str, str]]] = None,
+                            concurrency: int = BATCH_CONCURRENCY, batch_id: str = ""):
+        """
+        Xử lý nhiều câu hỏi qua process_question, tối đa `concurrency` câu cùng lúc; câu hỏi trùng
+        (sau chuẩn hóa) chỉ xử lý một lần. Yield kết quả theo thứ tự hoàn thành, mỗi kết quả kèm
+        `indices` (vị trí các câu hỏi tương ứng trong batch); chỉ giữ tối đa `concurrency` kết quả
+        trong bộ nhớ. Mỗi câu hỏi là một trace riêng với ID "<batch_id>-<vị trí đầu tiên>"
         """
+        unique: Dict[str, tuple] = {}
+        for index, question in enumerate(questions):
+            question = question.strip()
+            if not question:
+                metrics.BATCH_QUESTIONS.inc(outcome="empty")
+                yield {"indices": [index], "question": "", "error": "Câu hỏi không được để trống"}
+                continue
+            key = normalize_question(question)
+            if key in unique:
+                metrics.BATCH_QUESTIONS.inc(outcome="duplicate")
+                unique[key][1].append(index)
+            else:
+                unique[key] = (question, [index])
+        
+        async def run(question: str, indices: List[int]) -> Dict[str, Any]:
+            trace, tokens = tracer.begin("/ask-batch", f"{batch_id}-{indices[0]}" if batch_id else None)
+            started = time.perf_counter()
+            try:
+                result = await self.process_question(question, conversation_history)
+                metrics.BATCH_QUESTIONS.inc(outcome="ok")
+                return {"indices": indices, "question": question, **result,
+                        "duration_ms": round((time.perf_counter() - started) * 1000, 1)}
+            except Exception as e:
+                logger.error(f"Error in batch question: {e}")
+                trace.attrs["error"] = type(e).__name__
+                metrics.BATCH_QUESTIONS.inc(outcome="error")
+                return {"indices": indices, "question": question, "error": str(e)}
+            finally:
+                tracer.finish(trace, tokens)
+        
+        pending = iter(unique.values())
+        running = set()
+        try:
+            while True:
+                for question, indices in pending:
+                    running.add(asyncio.ensure_future(run(question, indices)))
+                    if len(running) >= concurrency:
+                        break
+                if not running:
+                    break
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            # Client ngắt kết nối giữa chừng: hủy các câu hỏi đang chạy
+            for task in running:
+                task.cancel()
+    
+    @timed_stage("process")
+    async def _process_question(self, question: str, conversation_history: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
         try:
-            logger.info(f"Processing question: {question}")
-            if conversation_history:
-                logger.info(f"Conversation history: {len(conversation_history)} messages")
+            tracing.event("Question: %s", question)
+            
+            cache_key = self._cache_key("process", question, conversation_history)
+            cached_result = self._cached(cache_key)
+            if cached_result is not None:
+                return dict(cached_result)
+            
+            # Câu hỏi tra cứu catalog: trả lời từ các mục tìm được trong index, một lần gọi LLM
+            catalog_docs = self._search_catalog(question)
+            if catalog_docs:
+                answer = await self._answer_from_catalog(question, conversation_history, catalog_docs)
+                if answer == AI_ERROR_MESSAGE:
+                    # Upstream lỗi: liệt kê các mục tìm được thay cho câu trả lời của LLM (không cache)
+                    return {"answer": self._catalog_fallback(catalog_docs), "data_source": "catalog", "requires_sql": False}
+                return self._ai_result(cache_key, answer, data_source="catalog")
             
             # Decision layer: Kiểm tra xem có cần query database không
-            needs_database = self._decide_if_needs_database(question)
-            logger.info(f"Decision result: needs_database={needs_database} for question: '{question}'")
+            intent = self.intent_classifier.classify(question)
+            if self._should_speculate(question, conversation_history, intent, self._branch_tokens(question)):
+                return await self._process_question_speculative(question, conversation_history, intent, cache_key)
+            needs_database = await self._decide_if_needs_database(question, intent)
             
             if needs_database:
-                # Lấy schema và sinh SQL
-                logger.info("Fetching database schema...")
-                schema = self._get_database_schema()
-                
-                if not schema:
-                    logger.warning("Could not fetch schema, trying to generate SQL without schema...")
-                    # Thử sinh SQL với basic schema info
-                    basic_schema = (
-                        "Tables: courses (id, title, description, rating, students, status, is_deleted), "
-                        "problems (id, title, difficulty, is_deleted), "
-                        "documents (id, title, description, is_deleted), "
-                        "users (id, name, email, role, is_active)"
-                    )
-                    schema = basic_schema
-                
-                logger.info(f"Using schema, length: {len(schema)} characters")
-                sql_result = self._generate_sql(question, schema, conversation_history)
-                
-                if sql_result.get("sql"):
-                    logger.info(f"SQL generated successfully: {sql_result['sql']}")
-                    return {
-                        "answer": sql_result.get("fallback_answer", ""),
-                        "data_source": "ai",
-                        "requires_sql": True,
-                        "sql": sql_result["sql"],
-                        "query_info": sql_result.get("query_info", {})
-                    }
-                else:
-                    logger.warning("Could not generate SQL, using fallback answer")
-                    # Trả về fallback answer nếu có
-                    if sql_result.get("fallback_answer"):
-                        return {
-                            "answer": sql_result["fallback_answer"],
-                            "data_source": "ai",
-                            "requires_sql": False
-                        }
+                db_result = await self._answer_from_database(question, conversation_history)
+                if db_result is not None:
+                    # Chỉ cache kết quả có SQL (fallback answer có thể là lỗi tạm thời)
+                    if db_result.get("requires_sql"):
+                        self._remember(cache_key, db_result)
+                    return db_result
             
             # Không cần query DB hoặc không sinh được SQL, trả lời bằng AI thông thường
-            logger.info("Using standard AI response")
-            ai_response = self._call_ai_with_history(question, conversation_history)
-            
-            return {
-                "answer": ai_response,
-                "data_source": "ai",
-                "requires_sql": False
-            }
+            ai_response = await self._call_ai_with_history(question, conversation_history)
+            return self._ai_result(cache_key, ai_response)
             
         except Exception as e:
             logger.error(f"Error processing question: {e}", exc_info=True)
@@ -238,51 +587,294 @@ class ChatAIService:
                 "requires_sql": False
             }
     
-    def _generate_sql(self, question: str, schema: str, conversation_history: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
+    def _ai_result(self, cache_key: str, ai_response: str, data_source: str = "ai") -> Dict[str, Any]:
+        result = {
+            "answer": ai_response,
+            "data_source": data_source,
+            "requires_sql": False
+        }
+        if ai_response != AI_ERROR_MESSAGE:
+            self._remember(cache_key, result)
+        return result
+    
+    def _search_catalog(self, question: str) -> list:
+        """
+        Các mục catalog liên quan (rỗng nếu không phải câu hỏi tra cứu catalog hoặc index chưa sẵn sàng)
+        """
+        if not CATALOG_RAG_ENABLED:
+            return []
+        docs = self.catalog_index.search(question, CATALOG_TOP_K, CATALOG_MIN_SCORE)
+        if docs:
+            tracing.annotate(catalog_documents=len(docs))
+            metrics.DECISIONS.inc(path="catalog", needs_database="false")
+        return docs
+    
+    def _catalog_fallback(self, catalog_docs: list) -> str:
+        """
+        Câu trả lời rút gọn khi không gọi được LLM: danh sách các mục catalog tìm được
+        """
+        lines = [f"{position}. {doc.snippet}" for position, doc in enumerate(catalog_docs, 1)]
+        return "Một số mục liên quan trong hệ thống:\n\n" + "\n".join(lines)
+    
+    def _catalog_messages(self, question: str, conversation_history: Optional[List[Dict[str, str]]], catalog_docs: list) -> List[Dict[str, str]]:
+        snippets = "\n".join(f"{position}. {doc.snippet}" for position, doc in enumerate(catalog_docs, 1))
+        return self.prompts.build("catalog", question, conversation_history, snippets=snippets)
+    
+    @timed_stage("catalog")
+    async def _answer_from_catalog(self, question: str, conversation_history: Optional[List[Dict[str, str]]], catalog_docs: list) -> str:
+        """
+        Trả lời câu hỏi tra cứu catalog từ các mục tìm được (thay cho sinh SQL + format kết quả)
+        """
+        try:
+            completion = await self._create_completion(
+                "catalog",
+                messages=self._catalog_messages(question, conversation_history, catalog_docs),
+                question=question
+            )
+            return completion.choices[0].message.content or AI_ERROR_MESSAGE
+        except Exception as e:
+            logger.error(f"Error answering from catalog: {e}")
+            return AI_ERROR_MESSAGE
+    
+    def _branch_tokens(self, question: str) -> int:
+        """
+        Số token tối đa của hai nhánh suy đoán (sinh SQL + câu trả lời thường) theo route hiện tại
+        """
+        return self.model_router.max_tokens("sql_generation", question) + self.model_router.max_tokens("answer", question)
+    
+    def _should_speculate(self, question: str, conversation_history: Optional[List[Dict[str, str]]], intent: IntentDecision, branch_tokens: int) -> bool:
+        """
+        Chỉ suy đoán khi bộ phân loại local không chắc chắn (sẽ phải gọi LLM decision)
+        và còn ngân sách token cho các nhánh có thể bị hủy
+        """
+        if not self.speculative or intent.confidence >= INTENT_CONFIDENCE_THRESHOLD:
+            return False
+        history_tokens = sum(count_tokens(msg.get("content", "")) for msg in conversation_history or [])
+        estimate = 2 * count_tokens(question) + min(history_tokens, HISTORY_TOKEN_BUDGET) + branch_tokens
+        return self.speculation_budget.try_acquire(estimate)
+    
+    async def _process_question_speculative(self, question: str, conversation_history: Optional[List[Dict[str, str]]], intent: IntentDecision, cache_key: str) -> Dict[str, Any]:
+        """
+        Chạy song song LLM decision, sinh SQL và câu trả lời thường; giữ nhánh đúng theo decision,
+        hủy nhánh còn lại (câu trả lời thường vẫn được giữ nếu không sinh được SQL)
+        """
+        tracing.annotate(speculative=True, confidence=intent.confidence)
+        # Đi qua _decide_if_needs_database để decision có span và mẫu ai_stage_duration_seconds như luồng thường
+        # (độ tin cậy dưới ngưỡng nên luôn gọi LLM decision)
+        decision_task = asyncio.ensure_future(self._decide_if_needs_database(question, intent))
+        sql_task = asyncio.ensure_future(self._answer_from_database(question, conversation_history, with_fallback=False))
+        answer_task = asyncio.ensure_future(self._call_ai_with_history(question, conversation_history))
+        try:
+            needs_database = await decision_task
+            
+            if needs_database:
+                db_result = await sql_task
+                if db_result is not None:
+                    self._cancel_speculative(answer_task, self.model_router.max_tokens("answer", question), needs_database)
+                    self._remember(cache_key, db_result)
+                    return db_result
+            else:
+                self._cancel_speculative(sql_task, self.model_router.max_tokens("sql_generation", question), needs_database)
+            
+            return self._ai_result(cache_key, await answer_task)
+        finally:
+            for task in (decision_task, sql_task, answer_task):
+                if not task.done():
+                    task.cancel()
+    
+    def _cancel_speculative(self, task: asyncio.Future, max_tokens: int, needs_database: bool) -> None:
+        """
+        Hủy nhánh thua; nhánh đã chạy xong được tính là token lãng phí
+        """
+        if task.done():
+            self.speculation_budget.record(needs_database, cancelled_tokens=max_tokens)
+        else:
+            task.cancel()
+            self.speculation_budget.record(needs_database, cancelled_branches=1)
+    
+    async def _answer_from_database(self, question: str, conversation_history: Optional[List[Dict[str, str]]] = None, with_fallback: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Nhánh cần query DB: lấy schema và sinh SQL
+        Trả về None nếu cần trả lời bằng AI thông thường
+        """
+        # Lấy schema và sinh SQL
+        schema = await self._get_database_schema()
+        
+        if not schema:
+            logger.warning("Could not fetch schema, trying to generate SQL without schema...")
+            # Thử sinh SQL với basic schema info
+            schema = BASIC_SCHEMA
+        
+        sql_result = await self._generate_sql(question, schema, conversation_history, with_fallback)
+        
+        if sql_result.get("sql"):
+            return {
+                "answer": sql_result.get("fallback_answer", ""),
+                "data_source": "ai",
+                "requires_sql": True,
+                "sql": sql_result["sql"],
+                "query_info": sql_result.get("query_info", {})
+            }
+        
+        logger.warning("Could not generate SQL, using fallback answer")
+        # Trả về fallback answer nếu có
+        if sql_result.get("fallback_answer"):
+            return {
+                "answer": sql_result["fallback_answer"],
+                "data_source": "ai",
+                "requires_sql": False
+            }
+        return None
+    
+    async def process_question_stream(self, question: str, conversation_history: Optional[List[Dict[str, str]]] = None):
+        """
+        Toàn bộ pipeline của process_question dưới dạng stream event trong một kết nối:
+        decision -> sql (nếu cần query DB) hoặc các chunk câu trả lời -> done
+        Các request giống hệt nhau đang chạy đồng thời cùng nhận một stream
+        """
+        key = self._cache_key("process", question, conversation_history)
+        async for event in self.single_flight.stream(
+            key, lambda: self._process_question_stream(question, conversation_history)
+        ):
+            yield event
+    
+    async def _process_question_stream(self, question: str, conversation_history: Optional[List[Dict[str, str]]] = None):
+        cache_key = self._cache_key("process", question, conversation_history)
+        tracing.event("Question: %s", question)
+        cached_result = self._cached(cache_key)
+        if cached_result is not None:
+            yield {"type": "decision", "needs_database": cached_result["requires_sql"], "cached": True}
+            if cached_result["requires_sql"]:
+                yield {"type": "sql", "sql": cached_result["sql"], "query_info": cached_result.get("query_info", {})}
+            else:
+                for chunk in split_stream_chunks(cached_result["answer"]):
+                    yield {"type": "chunk", "content": chunk}
+            yield {"type": "done"}
+            return
+        
+        catalog_docs = self._search_catalog(question)
+        if catalog_docs:
+            yield {"type": "decision", "needs_database": False, "source": "catalog"}
+            streamed_parts = []
+            async for chunk in self._stream_completion(
+                "catalog", self._catalog_messages(question, conversation_history, catalog_docs), question
+            ):
+                if chunk == AI_ERROR_MESSAGE and not streamed_parts:
+                    # Upstream lỗi trước chunk đầu tiên: liệt kê các mục tìm được (không cache)
+                    yield {"type": "chunk", "content": self._catalog_fallback(catalog_docs)}
+                    yield {"type": "done"}
+                    return
+                streamed_parts.append(chunk)
+                yield {"type": "chunk", "content": chunk}
+            answer = "".join(streamed_parts)
+            if answer and AI_ERROR_MESSAGE not in answer:
+                self._remember(cache_key, {"answer": answer, "data_source": "catalog", "requires_sql": False})
+            yield {"type": "done"}
+            return
+        
+        # Stream không thể chạy trước câu trả lời thường (chunk phải gửi sau decision),
+        # nên chế độ suy đoán chỉ sinh SQL song song với LLM decision
+        intent = self.intent_classifier.classify(question)
+        sql_task = None
+        if self._should_speculate(question, conversation_history, intent, self.model_router.max_tokens("sql_generation", question)):
+            tracing.annotate(speculative=True, confidence=intent.confidence)
+            sql_task = asyncio.ensure_future(self._answer_from_database(question, conversation_history, with_fallback=False))
+        try:
+            needs_database = await self._decide_if_needs_database(question, intent)
+            if sql_task is not None and not needs_database:
+                self._cancel_speculative(sql_task, self.model_router.max_tokens("sql_generation", question), needs_database)
+            elif sql_task is not None:
+                self.speculation_budget.record(needs_database)
+        except BaseException:
+            if sql_task is not None:
+                sql_task.cancel()
+            raise
+        yield {"type": "decision", "needs_database": needs_database}
+        
+        if needs_database:
+            if sql_task is not None:
+                db_result = await sql_task
+            else:
+                db_result = await self._answer_from_database(question, conversation_history, with_fallback=False)
+            if db_result is not None:
+                self._remember(cache_key, db_result)
+                yield {"type": "sql", "sql": db_result["sql"], "query_info": db_result.get("query_info", {})}
+                yield {"type": "done"}
+                return
+        
+        # Không cần query DB hoặc không sinh được SQL: stream câu trả lời AI thông thường
+        streamed_parts = []
+        async for chunk in self._stream_ai_with_history(question, conversation_history):
+            streamed_parts.append(chunk)
+            yield {"type": "chunk", "content": chunk}
+        
+        answer = "".join(streamed_parts)
+        if answer and AI_ERROR_MESSAGE not in answer:
+            self._remember(cache_key, {"answer": answer, "data_source": "ai", "requires_sql": False})
+        yield {"type": "done"}
+    
+    async def _fallback_answer(self, question: str, conversation_history: Optional[List[Dict[str, str]]] = None) -> str:
+        """
+        Câu trả lời AI thông thường khi không sinh được SQL
+        """
+        return await self._call_ai_with_history(question, conversation_history)
+    
+    @timed_stage("sql_generation")
+    async def _generate_sql(self, question: str, schema: str, conversation_history: Optional[List[Dict[str, str]]] = None, with_fallback: bool = True) -> Dict[str, Any]:
         """
         Sinh SQL query từ câu hỏi người dùng với schema context
+        with_fallback=False: không tự sinh câu trả lời fallback (caller sẽ stream câu trả lời)
         """
         try:
-            # Rút ngắn schema nếu quá dài (giới hạn 8000 tokens)
-            if len(schema) > 8000:
-                schema = schema[:8000] + "\n... (schema truncated)"
+            # Thử template SQL đã cache trước (template tự xóa khi schema thay đổi)
+            schema_index = self._get_schema_index(schema)
+            self.sql_templates.sync_schema(schema_index)
+            template_sql = self.sql_templates.lookup(question)
+            if template_sql:
+                tracing.annotate(sql_source="template")
+                tracing.event("SQL from template: %s", template_sql)
+                return {
+                    "sql": template_sql,
+                    "query_info": {
+                        "type": "select",
+                        "generated": True,
+                        "template": True
+                    }
+                }
             
-            system_prompt = (
-                "Bạn là một chuyên gia SQL cho MySQL database. Nhiệm vụ của bạn là phân tích câu hỏi tiếng Việt "
-                "và sinh ra câu lệnh SQL SELECT phù hợp.\n\n"
-                "QUAN TRỌNG:\n"
-                "- CHỈ sinh ra câu lệnh SELECT, KHÔNG được có các lệnh khác (INSERT, UPDATE, DELETE, DROP, etc.)\n"
-                "- Phải sử dụng đúng tên bảng và cột từ schema được cung cấp\n"
-                "- Tên bảng trong database là: courses (khóa học), problems (bài tập), documents (tài liệu), users (người dùng)\n"
-                "- Luôn thêm LIMIT để giới hạn kết quả (tối đa 100 rows)\n"
-                "- Đối với câu hỏi đếm số lượng, sử dụng COUNT(*)\n"
-                "- Đối với câu hỏi 'có bao nhiêu', trả về SELECT COUNT(*) as total FROM ...\n"
-                "- Trả về CHỈ SQL query, không có giải thích hay text khác\n"
-                "- Nếu không thể sinh SQL hợp lệ, trả về 'NO_SQL'\n\n"
-                f"DATABASE SCHEMA:\n{schema}\n\n"
-                "Ví dụ:\n"
-                "Câu hỏi: 'Có những khóa học nào?'\n"
-                "SQL: SELECT id, title, description, rating, students FROM courses WHERE is_deleted = false AND status = 'published' LIMIT 100\n\n"
-                "Câu hỏi: 'Hệ thống hiện tại có bao nhiêu khóa học?'\n"
-                "SQL: SELECT COUNT(*) as total FROM courses WHERE is_deleted = false LIMIT 100\n\n"
-                "Câu hỏi: 'Có bao nhiêu bài tập khó?'\n"
-                "SQL: SELECT COUNT(*) as total FROM problems WHERE difficulty = 'Hard' AND is_deleted = false LIMIT 100\n\n"
-            )
+            # SQL đã sinh trước đó cho cùng câu hỏi và schema (kể cả từ ResponseStore sau restart)
+            sql_cache_key = self._cache_key("sql", question, None, self.schema_manager.content_hash or "")
+            cached_sql = self._cached(sql_cache_key)
+            if cached_sql:
+                tracing.annotate(sql_source="cache")
+                tracing.event("SQL from cache: %s", cached_sql)
+                return {
+                    "sql": cached_sql,
+                    "query_info": {
+                        "type": "select",
+                        "generated": True,
+                        "cached": True
+                    }
+                }
             
-            user_prompt = f"Câu hỏi: {question}\n\nSQL:"
+            # Schema đủ nhỏ được gửi nguyên văn (giống hệt nhau giữa các câu hỏi nên nằm trong
+            # prompt cache của provider), schema lớn mới chỉ đưa các bảng liên quan (và bảng JOIN được)
+            full_length = len(schema)
+            if schema_index and full_length > SCHEMA_STABLE_MAX_CHARS:
+                schema = schema_index.render(question, SCHEMA_MAX_TABLES, SCHEMA_PROMPT_MAX_CHARS)
+            elif full_length > SCHEMA_PROMPT_MAX_CHARS:
+                schema = schema[:SCHEMA_PROMPT_MAX_CHARS] + "\n... (schema truncated)"
+            tracing.annotate(schema_chars=len(schema), schema_full_chars=full_length)
             
-            completion = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.3,  # Lower temperature cho SQL generation
-                max_tokens=500
+            completion = await self._create_completion(
+                "sql_generation",
+                messages=self.prompts.build("sql_generation", question, context=schema),
+                question=question
             )
             
             sql_response = completion.choices[0].message.content.strip()
-            logger.info(f"Raw SQL response from GPT: {sql_response[:200]}")
+            tracing.annotate(sql_source="llm")
+            tracing.event("Raw SQL response: %s", sql_response)
             
             # Làm sạch SQL response
             sql_response = sql_response.replace("```sql", "").replace("```", "").strip()
@@ -291,34 +883,46 @@ class ChatAIService:
             sql_lines = [line for line in lines if not line.strip().startswith('--') and line.strip()]
             sql_response = ' '.join(sql_lines).strip()
             
-            logger.info(f"Cleaned SQL: {sql_response}")
-            
             # Kiểm tra xem có phải SQL hợp lệ không
             if sql_response.upper().startswith("SELECT") and "NO_SQL" not in sql_response.upper():
-                logger.info(f"Valid SQL generated: {sql_response}")
+                query_info = {
+                    "type": "select",
+                    "generated": True
+                }
+                if self.sql_guard:
+                    # Kiểm tra trên toàn bộ schema (không phải bản đã rút gọn cho prompt)
+                    guarded = self.sql_guard.check(sql_response, schema_index)
+                    if not guarded.allowed:
+                        logger.warning("Generated SQL rejected by guard (%s), trace %s", guarded.reason, tracing.current_trace_id())
+                        tracing.event("Rejected SQL: %s", sql_response)
+                        return {
+                            "sql": None,
+                            "fallback_answer": await self._fallback_answer(question, conversation_history) if with_fallback else None,
+                            "query_info": {
+                                "type": "fallback",
+                                "reason": f"Generated SQL rejected: {guarded.reason}"
+                            }
+                        }
+                    tracing.annotate(
+                        estimated_rows=guarded.estimated_rows,
+                        guard_rewrites=guarded.rewrites,
+                        guard_warnings=guarded.warnings
+                    )
+                    sql_response = guarded.sql
+                    query_info["guard"] = guarded.to_info()
+                tracing.event("Generated SQL: %s", sql_response)
+                self.sql_templates.learn(question, sql_response)
+                self._remember(sql_cache_key, sql_response)
                 return {
                     "sql": sql_response,
-                    "query_info": {
-                        "type": "select",
-                        "generated": True
-                    }
+                    "query_info": query_info
                 }
             else:
-                logger.warning(f"Invalid SQL response: {sql_response}")
+                logger.warning("Invalid SQL response, trace %s", tracing.current_trace_id())
                 # Fallback: trả lời bằng AI thông thường với conversation history
-                if conversation_history:
-                    fallback_answer = self._call_ai_with_history(question, conversation_history)
-                else:
-                    fallback_prompt = (
-                        f"Người dùng hỏi: {question}\n\n"
-                        f"Hãy trả lời câu hỏi một cách thân thiện, chi tiết và hữu ích bằng tiếng Việt. "
-                        f"Bạn là trợ lý AI hỗ trợ người học lập trình."
-                    )
-                    fallback_answer = self._call_ai(fallback_prompt)
-                
                 return {
                     "sql": None,
-                    "fallback_answer": fallback_answer,
+                    "fallback_answer": await self._fallback_answer(question, conversation_history) if with_fallback else None,
                     "query_info": {
                         "type": "fallback",
                         "reason": "Could not generate valid SQL"
@@ -328,94 +932,44 @@ class ChatAIService:
         except Exception as e:
             logger.error(f"Error generating SQL: {e}")
             # Fallback với conversation history
-            if conversation_history:
-                fallback_answer = self._call_ai_with_history(question, conversation_history)
-            else:
-                fallback_prompt = (
-                    f"Người dùng hỏi: {question}\n\n"
-                    f"Hãy trả lời câu hỏi một cách thân thiện, chi tiết và hữu ích bằng tiếng Việt. "
-                    f"Bạn là trợ lý AI hỗ trợ người học lập trình."
-                )
-                fallback_answer = self._call_ai(fallback_prompt)
-            
             return {
                 "sql": None,
-                "fallback_answer": fallback_answer,
+                "fallback_answer": await self._fallback_answer(question, conversation_history) if with_fallback else None,
                 "query_info": {
                     "type": "fallback",
                     "error": str(e)
                 }
             }
     
-    def _call_ai(self, prompt: str) -> str:
+    async def _call_ai(self, prompt: str) -> str:
         """
         Gọi AI để trả lời câu hỏi (non-streaming) - backward compatible
         """
-        return self._call_ai_with_history(prompt, None)
+        return await self._call_ai_with_history(prompt, None)
     
-    def _call_ai_with_history(self, question: str, conversation_history: Optional[List[Dict[str, str]]] = None) -> str:
+    @timed_stage("answer")
+    async def _call_ai_with_history(self, question: str, conversation_history: Optional[List[Dict[str, str]]] = None) -> str:
         """
         Gọi AI với conversation history
         """
+        cache_key = self._cache_key("chat", question, conversation_history)
+        cached_answer = self._cached(cache_key)
+        if cached_answer is not None:
+            return cached_answer
+        
         try:
-            # Build messages array
-            messages = [
-                {
-                    "role": "system", 
-                    "content": (
-                        "Bạn là trợ lý AI hỗ trợ người học lập trình, nói tiếng Việt. "
-                        "Bạn có thể trả lời các câu hỏi về lập trình, thuật toán, công nghệ, "
-                        "và các chủ đề liên quan đến học lập trình. "
-                        "Hãy trả lời một cách thân thiện, chi tiết và hữu ích. "
-                        "Nếu không biết câu trả lời chính xác, hãy đưa ra gợi ý hoặc hướng dẫn tìm hiểu thêm. "
-                        "Bạn có thể nhớ và tham khảo các câu hỏi và câu trả lời trước đó trong cuộc hội thoại."
-                    )
-                }
-            ]
-            
-            # Thêm conversation history nếu có (giới hạn 20 messages gần nhất để tránh quá dài)
-            if conversation_history and len(conversation_history) > 0:
-                logger.info(f"[_call_ai_with_history] Adding {len(conversation_history)} messages to conversation history")
-                # Chỉ lấy 20 messages gần nhất
-                recent_history = conversation_history[-20:] if len(conversation_history) > 20 else conversation_history
-                added_count = 0
-                for msg in recent_history:
-                    role = msg.get("role", "user")
-                    content = msg.get("content", "")
-                    if role in ["user", "assistant"] and content and content.strip():
-                        messages.append({
-                            "role": role,
-                            "content": content.strip()
-                        })
-                        added_count += 1
-                        logger.info(f"[_call_ai_with_history] Added message #{added_count}: {role} - {content[:100]}...")
-                logger.info(f"[_call_ai_with_history] Total messages added: {added_count}")
-            else:
-                logger.info("[_call_ai_with_history] No conversation history provided")
+            messages = self.prompts.build("answer", question, conversation_history)
             
-            # Thêm câu hỏi hiện tại
-            messages.append({
-                "role": "user",
-                "content": question
-            })
+            completion = await self._create_completion("answer", messages=messages, question=question)
             
-            logger.info(f"[_call_ai_with_history] Total messages sent to GPT: {len(messages)}")
-            logger.info(f"[_call_ai_with_history] Messages structure: {[{'role': m['role'], 'content_length': len(m['content'])} for m in messages]}")
-            
-            completion = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                temperature=0.7,
-                max_tokens=1000
-            )
-            
-            logger.info(f"[_call_ai_with_history] GPT response received successfully")
-            
-            return completion.choices[0].message.content
+            answer = completion.choices[0].message.content
+            if answer:
+                self._remember(cache_key, answer)
+            return answer
             
         except Exception as e:
             logger.error(f"Error calling AI: {e}")
-            return "Xin lỗi, tôi gặp lỗi khi tạo phản hồi. Vui lòng thử lại."
+            return AI_ERROR_MESSAGE
     
     def _stream_ai(self, prompt: str):
         """
@@ -423,144 +977,162 @@ class ChatAIService:
         """
         return self._stream_ai_with_history(prompt, None)
     
-    def _stream_ai_with_history(self, question: str, conversation_history: Optional[List[Dict[str, str]]] = None):
+    async def _stream_ai_with_history(self, question: str, conversation_history: Optional[List[Dict[str, str]]] = None):
         """
         Gọi AI với streaming response và conversation history
+        Nếu câu trả lời đã có trong cache thì phát lại từng chunk thay vì gọi LLM;
+        các request giống hệt nhau đang chạy đồng thời dùng chung một stream upstream
         """
+        key = self._cache_key("chat", question, conversation_history)
+        async for chunk in self.single_flight.stream(
+            key, lambda: self._stream_chat(question, conversation_history)
+        ):
+            yield chunk
+    
+    async def _stream_chat(self, question: str, conversation_history: Optional[List[Dict[str, str]]] = None):
+        cache_key = self._cache_key("chat", question, conversation_history)
+        cached_answer = self._cached(cache_key)
+        if cached_answer is not None:
+            for chunk in split_stream_chunks(cached_answer):
+                yield chunk
+            return
+        
+        messages = self.prompts.build("answer", question, conversation_history)
+        streamed_parts = []
+        async for chunk in self._stream_completion("answer", messages, question):
+            streamed_parts.append(chunk)
+            yield chunk
+        
+        answer = "".join(streamed_parts)
+        if answer and AI_ERROR_MESSAGE not in answer:
+            self._remember(cache_key, answer)
+    
+    async def _stream_completion(self, stage: str, messages: List[Dict[str, str]], question: str = ""):
+        """
+        Stream chat completion theo route của stage (giữ slot concurrency trong suốt thời gian stream);
+        lỗi upstream được trả về dưới dạng AI_ERROR_MESSAGE
+        """
+        route = self.model_router.route(stage, question)
+        started = time.perf_counter()
+        usage = None
+        streamed_parts = []
+        failed = False
+        llm_span = tracing.start_span("llm", stage=stage, model=route.model, stream=True)
         try:
-            # Build messages array
-            messages = [
-                {
-                    "role": "system", 
-                    "content": (
-                        "Bạn là trợ lý AI hỗ trợ người học lập trình, nói tiếng Việt. "
-                        "Bạn có thể trả lời các câu hỏi về lập trình, thuật toán, công nghệ, "
-                        "và các chủ đề liên quan đến học lập trình. "
-                        "Hãy trả lời một cách thân thiện, chi tiết và hữu ích. "
-                        "Nếu không biết câu trả lời chính xác, hãy đưa ra gợi ý hoặc hướng dẫn tìm hiểu thêm. "
-                        "Bạn có thể nhớ và tham khảo các câu hỏi và câu trả lời trước đó trong cuộc hội thoại."
-                    )
-                }
-            ]
-            
-            # Thêm conversation history nếu có (giới hạn 20 messages gần nhất)
-            if conversation_history and len(conversation_history) > 0:
-                logger.info(f"[_stream_ai_with_history] Adding {len(conversation_history)} messages to conversation history")
-                recent_history = conversation_history[-20:] if len(conversation_history) > 20 else conversation_history
-                added_count = 0
-                for msg in recent_history:
-                    role = msg.get("role", "user")
-                    content = msg.get("content", "")
-                    if role in ["user", "assistant"] and content and content.strip():
-                        messages.append({
-                            "role": role,
-                            "content": content.strip()
-                        })
-                        added_count += 1
-                        logger.info(f"[_stream_ai_with_history] Added message #{added_count}: {role} - {content[:100]}...")
-                logger.info(f"[_stream_ai_with_history] Total messages added: {added_count}")
-            else:
-                logger.info("[_stream_ai_with_history] No conversation history provided")
-            
-            # Thêm câu hỏi hiện tại
-            messages.append({
-                "role": "user",
-                "content": question
-            })
-            
-            logger.info(f"[_stream_ai_with_history] Total messages sent to GPT: {len(messages)}")
-            logger.info(f"[_stream_ai_with_history] Messages structure: {[{'role': m['role'], 'content_length': len(m['content'])} for m in messages]}")
-            
-            stream = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                temperature=0.7,
-                max_tokens=1000,
-                stream=True
-            )
-            
-            for chunk in stream:
-                if chunk.choices[0].delta.content is not None:
-                    yield chunk.choices[0].delta.content
+            async with self._get_llm_semaphore():
+                stream = upstream.stream(
+                    stage,
+                    model=route.model,
+                    messages=messages,
+                    temperature=route.temperature,
+                    max_tokens=route.max_tokens,
+                    # Chunk cuối chứa usage (nếu upstream hỗ trợ)
+                    extra_body={"stream_options": {"include_usage": True}}
+                )
+                
+                try:
+                    async for chunk in stream:
+                        if getattr(chunk, "usage", None) is not None:
+                            usage = chunk.usage
+                        if chunk.choices and chunk.choices[0].delta.content is not None:
+                            if not streamed_parts and llm_span is not None:
+                                llm_span.set(ttft_ms=round((time.perf_counter() - started) * 1000, 1))
+                            streamed_parts.append(chunk.choices[0].delta.content)
+                            yield chunk.choices[0].delta.content
+                finally:
+                    # Client ngắt kết nối giữa chừng: đóng stream upstream ngay
+                    await stream.aclose()
             
-            logger.info(f"[_stream_ai_with_history] Streaming completed successfully")
+            self.upstream_health.record_success()
                     
         except Exception as e:
-            logger.error(f"Error streaming AI with history: {e}", exc_info=True)
-            yield "Xin lỗi, tôi gặp lỗi khi tạo phản hồi. Vui lòng thử lại."
+            logger.error(f"Error streaming AI ({stage}): {e}", exc_info=True)
+            metrics.LLM_ERRORS.inc(stage=stage)
+            self._record_upstream_error(e)
+            failed = True
+            yield AI_ERROR_MESSAGE
+        finally:
+            duration = time.perf_counter() - started
+            metrics.LLM_DURATION.observe(duration, stage=stage, stream="true")
+            prompt_tokens, completion_tokens, cached_tokens = metrics.observe_usage(
+                stage, usage,
+                prompt_estimate=sum(count_tokens(msg["content"]) for msg in messages),
+                completion_estimate=count_tokens("".join(streamed_parts))
+            )
+            self._record_route(route, duration, prompt_tokens, completion_tokens, cached_tokens, error=failed)
+            self.prompts.record_usage(stage, prompt_tokens, cached_tokens)
+            if llm_span is not None:
+                llm_span.set(
+                    prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                    cached_tokens=cached_tokens, error=failed
+                )
+                llm_span.finish()
     
-    def format_answer_from_query(self, question: str, query_result: list, query_info: Optional[Dict[str, Any]] = None, conversation_history: Optional[List[Dict[str, str]]] = None) -> str:
+    def _format_fast_path(self, question: str, query_result: list) -> Optional[str]:
         """
-        Format câu trả lời từ kết quả query database
+        Câu trả lời không cần LLM: kết quả rỗng hoặc dạng kết quả render local được
         """
-        try:
-            if not query_result or len(query_result) == 0:
-                return "Không tìm thấy dữ liệu phù hợp với câu hỏi của bạn."
-            
-            # Xử lý đặc biệt cho COUNT(*) queries
+        if not query_result or len(query_result) == 0:
+            return "Không tìm thấy dữ liệu phù hợp với câu hỏi của bạn."
+        
+        # Đếm, tổng hợp, đếm theo nhóm, danh sách entity: render local
+        if LOCAL_RENDER_ENABLED:
+            return self.answer_renderer.render(question, query_result)
+        return None
+    
+    def _format_prompt(self, question: str, query_result: list, conversation_history: Optional[List[Dict[str, str]]] = None):
+        """
+        Messages gửi LLM để format kết quả query, kèm bản tóm tắt kết quả và cache key
+        """
+        # Bảng gọn: chỉ các cột cần thiết, text dài bị cắt, số dòng theo ngân sách token
+        result_summary, _ = self.result_encoder.encode(question, query_result)
+        cache_key = self._cache_key("format", question, conversation_history, hash_payload(result_summary))
+        
+        # Build messages với conversation history (theo ngân sách token)
+        messages = self.prompts.build("format", question, conversation_history, result=result_summary)
+        return messages, result_summary, cache_key
+    
+    def _format_error_fallback(self, query_result: list) -> str:
+        """
+        Fallback: format đơn giản khi có lỗi
+        """
+        if query_result and len(query_result) > 0:
             first_result = query_result[0]
             if isinstance(first_result, dict) and 'total' in first_result:
-                # Đây là kết quả COUNT(*)
                 total = first_result.get('total', 0)
-                logger.info(f"Formatting COUNT result: total={total}")
-                
-                # Format trực tiếp cho COUNT queries
-                if 'khóa học' in question.lower() or 'course' in question.lower():
-                    return f"Hiện tại hệ thống có **{total}** khóa học."
-                elif 'bài tập' in question.lower() or 'problem' in question.lower():
-                    return f"Hiện tại hệ thống có **{total}** bài tập."
-                elif 'tài liệu' in question.lower() or 'document' in question.lower():
-                    return f"Hiện tại hệ thống có **{total}** tài liệu."
-                elif 'người dùng' in question.lower() or 'user' in question.lower():
-                    return f"Hiện tại hệ thống có **{total}** người dùng."
-                else:
-                    return f"Dựa trên dữ liệu từ hệ thống, có **{total}** kết quả."
-            
-            # Xử lý cho các queries khác (danh sách, etc.)
-            result_summary = json.dumps(query_result[:20], ensure_ascii=False, indent=2)  # Chỉ lấy 20 rows đầu
-            
-            # Build messages với conversation history
-            messages = [
-                {
-                    "role": "system",
-                    "content": (
-                        "Bạn là trợ lý AI hỗ trợ người học lập trình, nói tiếng Việt. "
-                        "Bạn có thể nhớ và tham khảo các câu hỏi và câu trả lời trước đó trong cuộc hội thoại."
-                    )
-                }
-            ]
-            
-            # Thêm conversation history nếu có
-            if conversation_history:
-                recent_history = conversation_history[-5:] if len(conversation_history) > 5 else conversation_history
-                for msg in recent_history:
-                    role = msg.get("role", "user")
-                    content = msg.get("content", "")
-                    if role in ["user", "assistant"] and content:
-                        messages.append({
-                            "role": role,
-                            "content": content
-                        })
+                return f"Hiện tại hệ thống có {total} kết quả."
+            else:
+                return f"Dựa trên dữ liệu từ hệ thống, tìm thấy {len(query_result)} kết quả."
+        else:
+            return "Không tìm thấy dữ liệu phù hợp với câu hỏi của bạn."
+    
+    async def format_answer_from_query(self, question: str, query_result: list, query_info: Optional[Dict[str, Any]] = None, conversation_history: Optional[List[Dict[str, str]]] = None) -> str:
+        """
+        Format câu trả lời từ kết quả query database
+        Các request giống hệt nhau (cùng câu hỏi, history và kết quả) đang chạy đồng thời dùng chung một lần format
+        """
+        key = self._cache_key("format", question, conversation_history, hash_payload(query_result))
+        return await self.single_flight.do(
+            key, lambda: self._format_answer_from_query(question, query_result, conversation_history)
+        )
+    
+    @timed_stage("format")
+    async def _format_answer_from_query(self, question: str, query_result: list, conversation_history: Optional[List[Dict[str, str]]] = None) -> str:
+        try:
+            fast_answer = self._format_fast_path(question, query_result)
+            if fast_answer is not None:
+                return fast_answer
             
-            # Thêm câu hỏi và kết quả query
-            messages.append({
-                "role": "user",
-                "content": (
-                    f"Người dùng đã hỏi: {question}\n\n"
-                    f"Kết quả từ database:\n{result_summary}\n\n"
-                    f"Hãy trả lời câu hỏi dựa trên dữ liệu trên một cách thân thiện, chi tiết và hữu ích bằng tiếng Việt. "
-                    f"Hãy trình bày thông tin một cách dễ hiểu và có cấu trúc."
-                )
-            })
+            messages, result_summary, cache_key = self._format_prompt(question, query_result, conversation_history)
+            cached_answer = self._cached(cache_key)
+            if cached_answer is not None:
+                return cached_answer
             
             try:
-                completion = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=messages,
-                    temperature=0.7,
-                    max_tokens=1000
-                )
+                completion = await self._create_completion("format", messages=messages, question=question)
                 formatted_answer = completion.choices[0].message.content
+                if formatted_answer:
+                    self._remember(cache_key, formatted_answer)
             except Exception as e:
                 logger.error(f"Error calling AI for formatting: {e}")
                 # Fallback
@@ -569,20 +1141,137 @@ class ChatAIService:
             
         except Exception as e:
             logger.error(f"Error formatting answer: {e}", exc_info=True)
-            # Fallback: format đơn giản
-            if query_result and len(query_result) > 0:
-                first_result = query_result[0]
-                if isinstance(first_result, dict) and 'total' in first_result:
-                    total = first_result.get('total', 0)
-                    return f"Hiện tại hệ thống có {total} kết quả."
-                else:
-                    return f"Dựa trên dữ liệu từ hệ thống, tìm thấy {len(query_result)} kết quả."
-            else:
-                return "Không tìm thấy dữ liệu phù hợp với câu hỏi của bạn."
+            return self._format_error_fallback(query_result)
+    
+    async def format_answer_from_query_stream(self, question: str, query_result: list, query_info: Optional[Dict[str, Any]] = None, conversation_history: Optional[List[Dict[str, str]]] = None):
+        """
+        Format câu trả lời từ kết quả query database dưới dạng stream từng chunk
+        Câu trả lời không cần LLM (rỗng, render local) được trả về ngay trong một chunk
+        """
+        key = self._cache_key("format", question, conversation_history, hash_payload(query_result))
+        async for chunk in self.single_flight.stream(
+            key, lambda: self._format_answer_from_query_stream(question, query_result, conversation_history)
+        ):
+            yield chunk
+    
+    async def _format_answer_from_query_stream(self, question: str, query_result: list, conversation_history: Optional[List[Dict[str, str]]] = None):
+        try:
+            fast_answer = self._format_fast_path(question, query_result)
+            if fast_answer is not None:
+                yield fast_answer
+                return
+            
+            messages, result_summary, cache_key = self._format_prompt(question, query_result, conversation_history)
+            cached_answer = self._cached(cache_key)
+            if cached_answer is not None:
+                for chunk in split_stream_chunks(cached_answer):
+                    yield chunk
+                return
+        except Exception as e:
+            logger.error(f"Error formatting answer: {e}", exc_info=True)
+            yield self._format_error_fallback(query_result)
+            return
+        
+        streamed_parts = []
+        async for chunk in self._stream_completion("format", messages, question):
+            if chunk == AI_ERROR_MESSAGE:
+                # Fallback (chỉ khi chưa gửi chunk nào)
+                if not streamed_parts:
+                    yield f"Dựa trên dữ liệu từ hệ thống:\n\n{result_summary}"
+                return
+            streamed_parts.append(chunk)
+            yield chunk
+        
+        if streamed_parts:
+            self._remember(cache_key, "".join(streamed_parts))
 
 # Khởi tạo service
 chat_ai_service = ChatAIService()
 
+def collect_service_metrics():
+    """
+    Metrics đọc từ thống kê có sẵn của các thành phần (cache, schema, single-flight...)
+    """
+    cache = chat_ai_service.answer_cache.stats()
+    yield ("ai_answer_cache_requests_total", "counter", "Answer cache lookups by result", {"result": "hit"}, cache["hits"])
+    yield ("ai_answer_cache_requests_total", "counter", "Answer cache lookups by result", {"result": "miss"}, cache["misses"])
+    yield ("ai_answer_cache_hit_ratio", "gauge", "Answer cache hit ratio since start", {}, cache["hit_rate"])
+    yield ("ai_answer_cache_entries", "gauge", "Entries in the answer cache", {}, cache["entries"])
+    
+    store = chat_ai_service.response_store
+    if store is not None:
+        for key in ("hits", "misses", "writes", "evicted", "warmed", "errors"):
+            yield ("ai_response_store_events_total", "counter", "Persistent response store events (lookups, writes, evictions, startup warmup)", {"event": key}, store.counters[key])
+    
+    guard = chat_ai_service.sql_guard
+    if guard is not None:
+        for key in ("allowed", "rewritten", "rejected", "flagged"):
+            yield ("ai_sql_guard_total", "counter", "Generated SQL checked by the guard, by outcome", {"outcome": key}, guard.counters[key])
+    
+    schema = chat_ai_service.schema_manager.stats()
+    for key in ("fetches", "changed", "unchanged", "not_modified", "failures", "stale_served"):
+        yield ("ai_schema_cache_events_total", "counter", "Schema cache events (fetches, refresh results, stale serves)", {"event": key}, schema[key])
+    yield ("ai_schema_age_seconds", "gauge", "Age of the cached database schema", {}, schema["age_seconds"])
+    yield ("ai_schema_loaded", "gauge", "Whether a database schema has been loaded (1/0)", {}, int(schema["loaded"]))
+    
+    health = chat_ai_service.upstream_health
+    yield ("ai_upstream_up", "gauge", "Cached upstream LLM health from probes and live calls (1/0)", {}, int(health.healthy))
+    yield ("ai_upstream_probes_total", "counter", "Background upstream probes by result", {"result": "ok"}, health.counters["probes"] - health.counters["probe_failures"])
+    yield ("ai_upstream_probes_total", "counter", "Background upstream probes by result", {"result": "error"}, health.counters["probe_failures"])
+    
+    pool = upstream.stats()
+    for key in ("hedges", "hedge_wins", "failovers", "timeouts", "circuit_rejected", "cancelled_attempts"):
+        yield ("ai_upstream_events_total", "counter", "Upstream client events (hedges, failovers, deadlines, circuit rejections)", {"event": key}, pool[key])
+    for endpoint in pool["endpoints"]:
+        yield ("ai_upstream_circuit_open", "gauge", "Whether the endpoint circuit breaker is open (1/0)", {"endpoint": endpoint["name"]}, int(endpoint["circuit"] != "closed"))
+    
+    templates = chat_ai_service.sql_templates.stats()
+    yield ("ai_sql_template_requests_total", "counter", "SQL template cache lookups by result", {"result": "hit"}, templates["hits"])
+    yield ("ai_sql_template_requests_total", "counter", "SQL template cache lookups by result", {"result": "miss"}, templates["misses"])
+    
+    flights = chat_ai_service.single_flight.stats()
+    yield ("ai_coalesced_requests_total", "counter", "Requests served by an identical in-flight call or stream", {"kind": "call"}, flights["coalesced"])
+    yield ("ai_coalesced_requests_total", "counter", "Requests served by an identical in-flight call or stream", {"kind": "stream"}, flights["stream_coalesced"])
+    
+    renderer = chat_ai_service.answer_renderer.stats()
+    yield ("ai_format_render_total", "counter", "Query result formatting by path (local renderer or LLM)", {"path": "local"}, renderer["local"])
+    yield ("ai_format_render_total", "counter", "Query result formatting by path (local renderer or LLM)", {"path": "llm"}, renderer["llm"])
+
+
+metrics.REGISTRY.add_collector(collect_service_metrics)
+
+def sse_event(event: Dict[str, Any]) -> str:
+    """
+    Đóng gói một event thành frame SSE (cùng định dạng với /ask-stream)
+    """
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+@app.on_event("startup")
+async def preload_schema():
+    """
+    Tải schema trước khi nhận request, bật refresh nền cho schema, index catalog và probe upstream,
+    nạp lại các kết quả dùng nhiều nhất từ ResponseStore
+    """
+    await chat_ai_service.schema_manager.start()
+    await chat_ai_service.catalog_index.start()
+    await chat_ai_service.upstream_health.start()
+    if chat_ai_service.response_store is not None:
+        await chat_ai_service.response_store.start()
+        chat_ai_service.warm_from_store()
+
+@app.on_event("shutdown")
+async def close_http_client():
+    """
+    Dừng refresh schema/catalog, probe upstream, ghi lượt dùng còn lại của ResponseStore
+    và đóng connection pool dùng chung khi tắt server
+    """
+    await chat_ai_service.schema_manager.stop()
+    await chat_ai_service.catalog_index.stop()
+    await chat_ai_service.upstream_health.stop()
+    if chat_ai_service.response_store is not None:
+        await chat_ai_service.response_store.stop()
+    await http_client.aclose()
+
 @app.post("/ask")
 async def ask(request: ChatRequest):
     """
@@ -604,15 +1293,10 @@ async def ask(request: ChatRequest):
                 {"role": msg.role, "content": msg.content}
                 for msg in request.conversation_history
             ]
-            logger.info(f"[/ask] Received conversation_history: {len(conversation_history)} messages")
-            if len(conversation_history) > 0:
-                logger.info(f"[/ask] First message: {conversation_history[0]}")
-                logger.info(f"[/ask] Last message: {conversation_history[-1]}")
-        else:
-            logger.info(f"[/ask] No conversation_history in request")
+            tracing.annotate(history_messages=len(conversation_history))
         
         # Xử lý câu hỏi thông qua ChatAI service
-        result = chat_ai_service.process_question(question, conversation_history)
+        result = await chat_ai_service.process_question(question, conversation_history)
         
         return result
         
@@ -623,6 +1307,46 @@ async def ask(request: ChatRequest):
             "error": str(e)
         }
 
+@app.post("/ask-batch")
+async def ask_batch(request: BatchRequest, http_request: Request):
+    """
+    Xử lý nhiều câu hỏi (tái tạo FAQ, kiểm tra hồi quy sau khi đổi prompt, tính trước câu trả lời),
+    câu hỏi trùng chỉ xử lý một lần. Kết quả stream dạng NDJSON theo thứ tự hoàn thành:
+    mỗi dòng {"type": "result", "indices": [...], "question": ..., "answer": ...}, dòng cuối {"type": "done", ...}
+    """
+    if len(request.questions) > BATCH_MAX_QUESTIONS:
+        return JSONResponse(
+            {"error": f"Batch quá lớn: tối đa {BATCH_MAX_QUESTIONS} câu hỏi"},
+            status_code=413
+        )
+    
+    conversation_history = None
+    if request.conversation_history:
+        conversation_history = [
+            {"role": msg.role, "content": msg.content}
+            for msg in request.conversation_history
+        ]
+    concurrency = max(1, min(request.concurrency or BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY))
+    batch_id = tracer.trace_id_from_headers(http_request.scope.get("headers", [])) or uuid.uuid4().hex[:16]
+    started = time.perf_counter()
+    
+    async def generate():
+        results = errors = 0
+        async for item in chat_ai_service.process_batch(request.questions, conversation_history, concurrency, batch_id):
+            results += 1
+            errors += "error" in item
+            yield json.dumps({"type": "result", **item}, ensure_ascii=False) + "\n"
+        yield json.dumps({
+            "type": "done",
+            "questions": len(request.questions),
+            "results": results,
+            "errors": errors,
+            "concurrency": concurrency,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1)
+        }) + "\n"
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson", headers={"X-Batch-Id": batch_id})
+
 @app.post("/ask-stream")
 async def ask_stream(request: ChatRequest):
     """
@@ -643,16 +1367,19 @@ async def ask_stream(request: ChatRequest):
                 {"role": msg.role, "content": msg.content}
                 for msg in request.conversation_history
             ]
-            logger.info(f"[/ask-stream] Received conversation_history: {len(conversation_history)} messages")
-            if len(conversation_history) > 0:
-                logger.info(f"[/ask-stream] First message: {conversation_history[0]}")
-                logger.info(f"[/ask-stream] Last message: {conversation_history[-1]}")
-        else:
-            logger.info(f"[/ask-stream] No conversation_history in request")
+            tracing.annotate(history_messages=len(conversation_history))
         
-        def generate():
+        started = time.perf_counter()
+        
+        async def generate():
+            first_chunk = True
+            stream_span = tracing.start_span("stream")
             try:
-                for chunk in chat_ai_service._stream_ai_with_history(question, conversation_history):
+                async for chunk in chat_ai_service._stream_ai_with_history(question, conversation_history):
+                    if first_chunk:
+                        first_chunk = False
+                        metrics.STREAM_TTFT.observe(time.perf_counter() - started, endpoint="/ask-stream")
+                        tracing.annotate(ttft_ms=round((time.perf_counter() - started) * 1000, 1))
                     # Gửi từng chunk dưới dạng JSON
                     data = json.dumps({"type": "chunk", "content": chunk}, ensure_ascii=False)
                     yield f"data: {data}\n\n"
@@ -664,6 +1391,9 @@ async def ask_stream(request: ChatRequest):
                 logger.error(f"Error in stream generation: {e}")
                 error_data = json.dumps({"type": "error", "content": "Có lỗi xảy ra khi tạo phản hồi"}, ensure_ascii=False)
                 yield f"data: {error_data}\n\n"
+            finally:
+                if stream_span is not None:
+                    stream_span.finish()
         
         return StreamingResponse(generate(), media_type="text/event-stream")
         
@@ -673,6 +1403,57 @@ async def ask_stream(request: ChatRequest):
             yield json.dumps({"type": "error", "content": "Có lỗi xảy ra. Vui lòng thử lại sau."}, ensure_ascii=False) + "\n"
         return StreamingResponse(error_response(), media_type="text/event-stream")
 
+@app.post("/ask-stream-unified")
+async def ask_stream_unified(request: ChatRequest):
+    """
+    API endpoint streaming chạy toàn bộ pipeline (decision, sinh SQL, trả lời) trong một kết nối
+    Event SSE: decision -> sql (Node.js thực thi SQL rồi gọi /format-answer) hoặc chunk... -> done
+    """
+    try:
+        question = request.question.strip()
+        
+        if not question:
+            def empty_response():
+                yield sse_event({"type": "error", "content": "Câu hỏi không được để trống"})
+            return StreamingResponse(empty_response(), media_type="text/event-stream")
+        
+        # Lấy conversation history từ request
+        conversation_history = None
+        if request.conversation_history:
+            conversation_history = [
+                {"role": msg.role, "content": msg.content}
+                for msg in request.conversation_history
+            ]
+            tracing.annotate(history_messages=len(conversation_history))
+        
+        started = time.perf_counter()
+        
+        async def generate():
+            first_content = True
+            stream_span = tracing.start_span("stream")
+            try:
+                async for event in chat_ai_service.process_question_stream(question, conversation_history):
+                    # Nội dung đầu tiên: chunk câu trả lời hoặc SQL để Node.js thực thi
+                    if first_content and event["type"] in ("chunk", "sql"):
+                        first_content = False
+                        metrics.STREAM_TTFT.observe(time.perf_counter() - started, endpoint="/ask-stream-unified")
+                        tracing.annotate(ttft_ms=round((time.perf_counter() - started) * 1000, 1))
+                    yield sse_event(event)
+            except Exception as e:
+                logger.error(f"Error in unified stream generation: {e}", exc_info=True)
+                yield sse_event({"type": "error", "content": "Có lỗi xảy ra khi tạo phản hồi"})
+            finally:
+                if stream_span is not None:
+                    stream_span.finish()
+        
+        return StreamingResponse(generate(), media_type="text/event-stream")
+        
+    except Exception as e:
+        logger.error(f"Error in ask_stream_unified endpoint: {e}")
+        def error_response():
+            yield sse_event({"type": "error", "content": "Có lỗi xảy ra. Vui lòng thử lại sau."})
+        return StreamingResponse(error_response(), media_type="text/event-stream")
+
 @app.post("/format-answer")
 async def format_answer(request: FormatAnswerRequest):
     """
@@ -686,14 +1467,9 @@ async def format_answer(request: FormatAnswerRequest):
                 {"role": msg.role, "content": msg.content}
                 for msg in request.conversation_history
             ]
-            logger.info(f"[/format-answer] Received conversation_history: {len(conversation_history)} messages")
-            if len(conversation_history) > 0:
-                logger.info(f"[/format-answer] First message: {conversation_history[0]}")
-                logger.info(f"[/format-answer] Last message: {conversation_history[-1]}")
-        else:
-            logger.info(f"[/format-answer] No conversation_history in request")
+            tracing.annotate(history_messages=len(conversation_history))
         
-        formatted = chat_ai_service.format_answer_from_query(
+        formatted = await chat_ai_service.format_answer_from_query(
             request.question,
             request.query_result,
             request.query_info,
@@ -712,23 +1488,135 @@ async def format_answer(request: FormatAnswerRequest):
             "error": str(e)
         }
 
+@app.post("/format-answer-stream")
+async def format_answer_stream(request: FormatAnswerRequest):
+    """
+    Format câu trả lời từ kết quả query database, stream từng chunk (cùng định dạng SSE với /ask-stream)
+    """
+    # Lấy conversation history từ request
+    conversation_history = None
+    if request.conversation_history:
+        conversation_history = [
+            {"role": msg.role, "content": msg.content}
+            for msg in request.conversation_history
+        ]
+        tracing.annotate(history_messages=len(conversation_history))
+    
+    started = time.perf_counter()
+    
+    async def generate():
+        first_chunk = True
+        stream_span = tracing.start_span("stream")
+        try:
+            async for chunk in chat_ai_service.format_answer_from_query_stream(
+                request.question,
+                request.query_result,
+                request.query_info,
+                conversation_history
+            ):
+                if first_chunk:
+                    first_chunk = False
+                    metrics.STREAM_TTFT.observe(time.perf_counter() - started, endpoint="/format-answer-stream")
+                    tracing.annotate(ttft_ms=round((time.perf_counter() - started) * 1000, 1))
+                yield sse_event({"type": "chunk", "content": chunk})
+            yield sse_event({"type": "done"})
+        except Exception as e:
+            logger.error(f"Error in format answer stream generation: {e}")
+            yield sse_event({"type": "error", "content": "Xin lỗi, có lỗi xảy ra khi format câu trả lời."})
+        finally:
+            if stream_span is not None:
+                stream_span.finish()
+    
+    return StreamingResponse(generate(), media_type="text/event-stream")
+
+def readiness() -> Dict[str, Any]:
+    """
+    Trạng thái sẵn sàng từ dữ liệu đã cache (probe upstream nền, circuit breaker, schema cache), không gọi ra ngoài
+    """
+    health = chat_ai_service.upstream_health
+    schema_manager = chat_ai_service.schema_manager
+    schema_loaded = bool(schema_manager.schema)
+    ready = health.healthy and upstream.available and (schema_loaded or not READINESS_REQUIRE_SCHEMA)
+    return {
+        "status": "ready" if ready else "not_ready",
+        "checks": {
+            "upstream": "ok" if health.healthy else ("unknown" if not health.checked else "failing"),
+            "circuit": "closed" if upstream.available else "open",
+            "schema": ("stale" if schema_manager.is_stale() else "ok") if schema_loaded else "missing",
+        },
+        "upstream_error": health.last_error,
+        "schema_error": schema_manager.last_error,
+    }
+
+@app.get("/health/live")
+async def liveness_check():
+    """
+    Liveness probe: process và event loop còn phục vụ được request
+    """
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness_check():
+    """
+    Readiness probe: 200 khi upstream LLM và schema sẵn sàng, 503 nếu chưa
+    """
+    state = readiness()
+    return JSONResponse(state, status_code=200 if state["status"] == "ready" else 503)
+
 @app.get("/health")
 async def health_check():
     """
-    Health check endpoint
+    Health check endpoint (tương thích với Node.js /api/v1/chat-ai/health), dùng trạng thái readiness đã cache
     """
-    try:
-        # Kiểm tra kết nối AI
-        test_response = chat_ai_service._call_ai("Test")
-        
-        return {
-            "status": "healthy",
-            "ai_client": "active",
-            "message": "AI service is running"
-        }
-    except Exception as e:
-        return {
-            "status": "unhealthy",
-            "error": str(e),
-            "message": "AI service is not available"
-        }
+    state = readiness()
+    healthy = state["status"] == "ready"
+    return JSONResponse(
+        {
+            "status": "healthy" if healthy else "unhealthy",
+            "ai_client": "active" if state["checks"]["upstream"] == "ok" else state["checks"]["upstream"],
+            "checks": state["checks"],
+            "message": "AI service is running" if healthy else "AI service is not available"
+        },
+        status_code=200 if healthy else 503
+    )
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Metrics theo Prometheus text format (latency theo stage, TTFT, token, decision, cache, in-flight)
+    """
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/stats")
+async def stats():
+    """
+    Thống kê cache câu trả lời (hit/miss/eviction)
+    """
+    return {
+        "answer_cache": chat_ai_service.answer_cache.stats(),
+        "sql_templates": chat_ai_service.sql_templates.stats(),
+        "sql_guard": chat_ai_service.sql_guard.stats() if chat_ai_service.sql_guard else None,
+        "schema": chat_ai_service.schema_manager.stats(),
+        "answer_renderer": chat_ai_service.answer_renderer.stats(),
+        "result_encoder": chat_ai_service.result_encoder.stats(),
+        "single_flight": chat_ai_service.single_flight.stats(),
+        "speculation": chat_ai_service.speculation_budget.stats(),
+        "catalog": chat_ai_service.catalog_index.stats(),
+        "upstream": chat_ai_service.upstream_health.stats(),
+        "model_routes": chat_ai_service.model_router.stats(),
+        "prompts": chat_ai_service.prompts.stats(),
+        "upstream_pool": upstream.stats(),
+        "shared_cache": chat_ai_service.shared_cache.stats() if chat_ai_service.shared_cache else None,
+        "response_store": chat_ai_service.response_store.stats() if chat_ai_service.response_store else None,
+        "tracing": tracer.stats(),
+        "worker_pid": os.getpid()
+    }
+
+@app.get("/traces/slow")
+async def slow_traces(limit: int = 20):
+    """
+    Các request chậm gần nhất của worker này, mới nhất trước: chỉ thời gian các span
+    (không có event / thuộc tính chứa nội dung câu hỏi hay SQL)
+    """
+    traces = list(tracer.recent_slow)[-max(1, limit):]
+    return {"threshold_seconds": tracer.slow_threshold, "traces": traces[::-1]}
@@ -0,0 +1,171 @@
+"""
+Cache dùng chung giữa các worker process (file SQLite, WAL): tầng thứ hai phía sau cache trong bộ nhớ
+của từng worker, để thêm worker không nhân số lần cache miss (câu trả lời, schema)
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Số lần ghi giữa hai lần dọn entry hết hạn / vượt giới hạn
+TRIM_EVERY = 200
+# Thời gian chờ lock khi dọn entry (chạy trong thread riêng, không chặn event loop)
+TRIM_BUSY_TIMEOUT = 5.0
+
+
+class SharedCache:
+    """
+    Key-value có TTL trên SQLite; mỗi process mở kết nối riêng (an toàn khi fork worker sau preload).
+    Các lệnh chạy đồng bộ trên event loop nên chỉ chờ lock tối đa `busy_timeout` giây: worker khác
+    đang ghi thì bỏ qua lần đọc/ghi đó (cache chỉ là tầng tối ưu), việc dọn entry chạy trong thread riêng
+    """
+
+    def __init__(self, path: str, max_entries: int = 20000, busy_timeout: float = 0.05):
+        self.path = path
+        self.max_entries = max_entries
+        self.busy_timeout = busy_timeout
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._writes = 0
+        self._trimming = False
+        self.counters = {"hits": 0, "misses": 0, "writes": 0, "errors": 0, "trimmed": 0}
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at)")
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Giá trị còn hạn theo key, None nếu không có / hết hạn / lỗi đọc
+        """
+        entry = self.get_entry(key)
+        return entry[0] if entry is not None else None
+
+    def get_entry(self, key: str) -> Optional[Tuple[Any, float]]:
+        """
+        (giá trị, thời điểm hết hạn theo wall clock) nếu entry còn hạn
+        """
+        try:
+            row = self._connection().execute(
+                "SELECT value, expires_at FROM cache WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        except sqlite3.Error as e:
+            self.counters["errors"] += 1
+            logger.warning("Shared cache read failed: %s", e)
+            return None
+        if row is None:
+            self.counters["misses"] += 1
+            return None
+        self.counters["hits"] += 1
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, value: Any, ttl_seconds: float) -> None:
+        try:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False, default=str), time.time() + ttl_seconds),
+            )
+            self.counters["writes"] += 1
+            self._writes += 1
+            if self._writes % TRIM_EVERY == 0:
+                self._trim_in_background()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            self.counters["errors"] += 1
+            logger.warning("Shared cache write failed: %s", e)
+
+    def add(self, key: str, value: Any, ttl_seconds: float) -> bool:
+        """
+        Chỉ ghi khi key chưa có hoặc đã hết hạn (dùng làm lease giữa các worker), True nếu ghi được
+        """
+        try:
+            conn = self._connection()
+            conn.execute("DELETE FROM cache WHERE key = ? AND expires_at <= ?", (key, time.time()))
+            return conn.execute(
+                "INSERT OR IGNORE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False, default=str), time.time() + ttl_seconds),
+            ).rowcount == 1
+        except sqlite3.Error as e:
+            self.counters["errors"] += 1
+            logger.warning("Shared cache write failed: %s", e)
+            # Không lấy được lease thì tự fetch như khi không có cache dùng chung
+            return True
+
+    def delete(self, key: str, value: Any = None) -> None:
+        """
+        Xóa key; có `value` thì chỉ xóa khi giá trị đang lưu đúng bằng value (trả lease của chính mình)
+        """
+        try:
+            if value is None:
+                self._connection().execute("DELETE FROM cache WHERE key = ?", (key,))
+            else:
+                self._connection().execute(
+                    "DELETE FROM cache WHERE key = ? AND value = ?",
+                    (key, json.dumps(value, ensure_ascii=False, default=str)),
+                )
+        except sqlite3.Error as e:
+            self.counters["errors"] += 1
+            logger.warning("Shared cache write failed: %s", e)
+
+    def _trim_in_background(self) -> None:
+        """
+        Dọn entry trong thread riêng (kết nối riêng, chờ lock lâu hơn) thay vì trên request path
+        """
+        if self._trimming:
+            return
+        self._trimming = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._run_trim()
+            return
+        loop.run_in_executor(None, self._run_trim)
+
+    def _run_trim(self) -> None:
+        try:
+            conn = sqlite3.connect(self.path, timeout=TRIM_BUSY_TIMEOUT, isolation_level=None)
+            try:
+                self.trim(conn)
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            self.counters["errors"] += 1
+            logger.warning("Shared cache trim failed: %s", e)
+        finally:
+            self._trimming = False
+
+    def trim(self, conn: Optional[sqlite3.Connection] = None) -> None:
+        """
+        Xóa entry hết hạn, rồi các entry sắp hết hạn nhất khi vượt max_entries
+        """
+        conn = conn or self._connection()
+        removed = conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),)).rowcount
+        overflow = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            removed += conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires_at LIMIT ?)", (overflow,)
+            ).rowcount
+        self.counters["trimmed"] += max(0, removed)
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            entries = self._connection().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        return {**self.counters, "path": self.path, "entries": entries, "max_entries": self.max_entries}
@@ -0,0 +1,134 @@
+"""
+Gộp các request giống hệt nhau đang chạy đồng thời: chỉ một lần gọi upstream,
+các caller còn lại chờ chung kết quả (hoặc cùng nhận một stream)
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+import tracing
+
+
+class _Broadcast:
+    """
+    Một stream upstream đang chạy, phát lại cho mọi subscriber (kể cả subscriber đến sau)
+    """
+
+    def __init__(self):
+        self.items: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Condition()
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+
+
+class SingleFlight:
+    """
+    Single-flight theo key cho coroutine (do) và async generator (stream)
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._streams: Dict[str, _Broadcast] = {}
+        self.counters = {"leaders": 0, "coalesced": 0, "stream_leaders": 0, "stream_coalesced": 0,
+                         "stream_abandoned": 0}
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Chạy factory() một lần cho mỗi key đang in-flight, các caller trùng key chờ chung kết quả
+        """
+        if not self.enabled:
+            return await factory()
+        future = self._calls.get(key)
+        if future is not None:
+            self.counters["coalesced"] += 1
+            tracing.annotate(coalesced=True)
+        else:
+            self.counters["leaders"] += 1
+            future = asyncio.ensure_future(factory())
+            self._calls[key] = future
+
+            def clear(done_future):
+                if self._calls.get(key) is done_future:
+                    del self._calls[key]
+                # Tránh cảnh báo "exception was never retrieved" khi mọi caller đã hủy
+                if not done_future.cancelled():
+                    done_future.exception()
+
+            future.add_done_callback(clear)
+        # Caller bị hủy (client ngắt kết nối) không hủy lần gọi dùng chung
+        return await asyncio.shield(future)
+
+    async def stream(self, key: str, factory: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """
+        Fan-out một async generator upstream cho mọi subscriber cùng key
+        """
+        if not self.enabled:
+            async for item in factory():
+                yield item
+            return
+
+        broadcast = self._streams.get(key)
+        if broadcast is not None:
+            self.counters["stream_coalesced"] += 1
+            tracing.annotate(coalesced=True)
+        else:
+            self.counters["stream_leaders"] += 1
+            broadcast = _Broadcast()
+            self._streams[key] = broadcast
+            broadcast.task = asyncio.ensure_future(self._produce(key, broadcast, factory))
+
+        broadcast.subscribers += 1
+        try:
+            index = 0
+            while True:
+                while index < len(broadcast.items):
+                    yield broadcast.items[index]
+                    index += 1
+                if broadcast.done:
+                    if broadcast.error is not None:
+                        raise broadcast.error
+                    return
+                async with broadcast.changed:
+                    await broadcast.changed.wait_for(
+                        lambda: len(broadcast.items) > index or broadcast.done
+                    )
+        finally:
+            broadcast.subscribers -= 1
+            if broadcast.subscribers == 0 and not broadcast.done and broadcast.task is not None:
+                # Subscriber cuối cùng đã ngắt kết nối: dừng đọc và đóng stream upstream ngay
+                self.counters["stream_abandoned"] += 1
+                if self._streams.get(key) is broadcast:
+                    del self._streams[key]
+                broadcast.task.cancel()
+
+    async def _produce(self, key: str, broadcast: _Broadcast, factory: Callable[[], AsyncIterator[Any]]) -> None:
+        """
+        Đọc stream upstream trong task riêng để một subscriber ngắt kết nối không làm dừng stream chung
+        (task bị hủy khi không còn subscriber nào)
+        """
+        source = factory()
+        try:
+            async for item in source:
+                broadcast.items.append(item)
+                async with broadcast.changed:
+                    broadcast.changed.notify_all()
+        except Exception as e:
+            broadcast.error = e
+        finally:
+            await source.aclose()
+            broadcast.done = True
+            if self._streams.get(key) is broadcast:
+                del self._streams[key]
+            async with broadcast.changed:
+                broadcast.changed.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "in_flight_calls": len(self._calls),
+            "in_flight_streams": len(self._streams),
+            "stream_subscribers": sum(b.subscribers for b in self._streams.values()),
+        }
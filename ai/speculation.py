@@ -0,0 +1,56 @@
+"""
+Giới hạn chi phí cho chế độ thực thi suy đoán (speculative): các nhánh chạy song song
+bị hủy vẫn tốn token, nên chỉ cho phép suy đoán trong ngân sách token theo cửa sổ thời gian
+"""
+
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+
+
+class SpeculationBudget:
+    """
+    Ngân sách token cho các nhánh suy đoán trong cửa sổ trượt, kèm thống kê thắng/thua
+    """
+
+    def __init__(self, tokens_per_window: int = 20000, window_seconds: float = 60.0):
+        self.tokens_per_window = tokens_per_window
+        self.window_seconds = window_seconds
+        self._reserved: Deque[Tuple[float, int]] = deque()
+        self._reserved_total = 0
+        self.counters = {
+            "launched": 0, "skipped_budget": 0, "database_wins": 0, "answer_wins": 0,
+            "cancelled_branches": 0, "wasted_tokens_estimate": 0,
+        }
+
+    def _expire(self, now: float) -> None:
+        while self._reserved and now - self._reserved[0][0] >= self.window_seconds:
+            _, tokens = self._reserved.popleft()
+            self._reserved_total -= tokens
+
+    def try_acquire(self, tokens: int) -> bool:
+        """
+        Giữ chỗ `tokens` trong ngân sách, trả về False nếu vượt (khi đó chạy tuần tự)
+        """
+        now = time.monotonic()
+        self._expire(now)
+        if self._reserved_total + tokens > self.tokens_per_window:
+            self.counters["skipped_budget"] += 1
+            return False
+        self._reserved.append((now, tokens))
+        self._reserved_total += tokens
+        self.counters["launched"] += 1
+        return True
+
+    def record(self, needs_database: bool, cancelled_tokens: int = 0, cancelled_branches: int = 0) -> None:
+        self.counters["database_wins" if needs_database else "answer_wins"] += 1
+        self.counters["cancelled_branches"] += cancelled_branches
+        self.counters["wasted_tokens_estimate"] += cancelled_tokens
+
+    def stats(self) -> Dict[str, Any]:
+        self._expire(time.monotonic())
+        return {
+            **self.counters,
+            "window_tokens_reserved": self._reserved_total,
+            "window_tokens_limit": self.tokens_per_window,
+        }
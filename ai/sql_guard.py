@@ -0,0 +1,794 @@
+"""
+Phân tích tĩnh SQL do LLM sinh trước khi gửi sang Node: chỉ cho phép một câu SELECT chỉ đọc,
+chèn / siết LIMIT, bỏ cột rộng (TEXT/BLOB/JSON) khỏi SELECT *, đánh dấu điều kiện trên cột
+không có index (theo thông tin index trong schema) và ước lượng số dòng MySQL phải đọc để
+từ chối truy vấn vượt ngưỡng chi phí
+"""
+
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from schema_index import ColumnInfo, SchemaIndex
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"""
+      (?P<ws>\s+)
+    | (?P<comment>--[^\n]*|\#[^\n]*|/\*.*?\*/)
+    | (?P<string>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+    | (?P<ident>`(?:[^`]|``)+`)
+    | (?P<number>\d+(?:\.\d+)?)
+    | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+    | (?P<op><=>|<=|>=|<>|!=|\|\||&&|[=<>(),.;*+\-/%])
+    | (?P<other>.)
+""", re.S | re.X)
+
+# Từ khóa ghi dữ liệu / khóa bảng / điều khiển server, không được xuất hiện trong query
+FORBIDDEN_WORDS = {
+    "INSERT", "UPDATE", "DELETE", "DROP", "ALTER", "CREATE", "TRUNCATE", "RENAME", "GRANT", "REVOKE",
+    "CALL", "EXEC", "EXECUTE", "HANDLER", "LOAD", "LOCK", "UNLOCK", "INTO", "OUTFILE", "DUMPFILE",
+    "PREPARE", "DEALLOCATE", "SHUTDOWN", "KILL", "PROCEDURE", "SHARE",
+}
+# Hàm chặn / gây tải hoặc đọc file
+FORBIDDEN_FUNCTIONS = {"SLEEP", "BENCHMARK", "GET_LOCK", "RELEASE_LOCK", "LOAD_FILE"}
+FORBIDDEN_SCHEMAS = {"information_schema", "mysql", "performance_schema", "sys"}
+
+CLAUSE_WORDS = ("FROM", "WHERE", "GROUP", "HAVING", "ORDER", "LIMIT")
+JOIN_WORDS = {"JOIN", "INNER", "LEFT", "RIGHT", "OUTER", "CROSS", "NATURAL", "STRAIGHT_JOIN"}
+INDEX_HINT_WORDS = {"USE", "FORCE", "IGNORE"}
+AGGREGATE_FUNCTIONS = {"COUNT", "SUM", "AVG", "MIN", "MAX", "GROUP_CONCAT"}
+COMPARISON_OPS = {"=", "<", ">", "<=", ">=", "<>", "!=", "<=>"}
+COMPARISON_WORDS = {"LIKE", "IN", "BETWEEN", "IS", "REGEXP", "RLIKE"}
+# Từ khóa không phải tên cột
+KEYWORDS = {
+    "SELECT", "DISTINCT", "ALL", "AS", "ON", "USING", "AND", "OR", "NOT", "XOR", "NULL", "TRUE", "FALSE",
+    "ASC", "DESC", "BY", "CASE", "WHEN", "THEN", "ELSE", "END", "INTERVAL", "EXISTS", "ANY", "SOME",
+    "CURRENT_DATE", "CURRENT_TIME", "CURRENT_TIMESTAMP", "UNION", "WITH", "ROLLUP", "OFFSET",
+    *CLAUSE_WORDS, *JOIN_WORDS, *COMPARISON_WORDS,
+}
+
+# Kiểu cột rộng: không lấy khi mở rộng SELECT *, siết LIMIT khi được chọn tường minh
+WIDE_TYPES = {"text", "mediumtext", "longtext", "blob", "mediumblob", "longblob", "json"}
+WIDE_VARCHAR_LENGTH = 1024
+
+# Độ chọn lọc ước lượng khi dùng index: so sánh bằng / IN, và điều kiện khoảng / LIKE 'abc%'
+EQ_SELECTIVITY = 0.05
+RANGE_SELECTIVITY = 0.25
+# Query một bảng không sắp xếp / gom nhóm dừng sớm khi đủ LIMIT dòng: đọc tối đa LIMIT x hệ số này
+EARLY_STOP_FACTOR = 10
+# Bảng lớn hơn số dòng này mà bị quét toàn bộ thì cảnh báo
+FULL_SCAN_WARN_ROWS = 10000
+
+
+class SQLRejected(Exception):
+    """
+    Query bị từ chối; code dùng để thống kê theo lý do
+    """
+
+    def __init__(self, code: str, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+@dataclass
+class Token:
+    kind: str
+    text: str
+    space: bool
+    depth: int = 0
+
+    @property
+    def upper(self) -> str:
+        return self.text.upper() if self.kind == "word" else ""
+
+    @property
+    def name(self) -> str:
+        """
+        Tên định danh (bỏ backtick)
+        """
+        return self.text[1:-1].replace("``", "`") if self.kind == "ident" else self.text
+
+
+@dataclass(eq=False)
+class TableRef:
+    table: Optional[str]
+    alias: str
+    rows: int
+    # Chi phí (số dòng đọc) của derived table
+    derived_cost: int = 0
+    local: List[Tuple[str, str, bool]] = field(default_factory=list)
+
+
+@dataclass
+class QueryAnalysis:
+    tables: List[TableRef]
+    examined: int
+    result_rows: int
+    correlated: bool = False
+
+
+@dataclass
+class SQLCheck:
+    """
+    Kết quả kiểm tra: sql là câu đã rewrite (None nếu bị từ chối)
+    """
+    sql: Optional[str]
+    reason: Optional[str] = None
+    estimated_rows: int = 0
+    rewrites: List[str] = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)
+
+    @property
+    def allowed(self) -> bool:
+        return self.sql is not None
+
+    def to_info(self) -> Dict[str, Any]:
+        return {
+            "estimated_rows": self.estimated_rows,
+            "rewrites": self.rewrites,
+            "warnings": self.warnings,
+        }
+
+
+def tokenize(sql: str) -> List[Token]:
+    tokens: List[Token] = []
+    space = False
+    depth = 0
+    for match in _TOKEN_RE.finditer(sql):
+        kind = match.lastgroup
+        if kind in ("ws", "comment"):
+            space = True
+            continue
+        if kind == "other":
+            raise SQLRejected("syntax", f"unsupported character {match.group()!r}")
+        text = match.group()
+        if text == ")":
+            depth -= 1
+            if depth < 0:
+                raise SQLRejected("syntax", "unbalanced parentheses")
+        tokens.append(Token(kind, text, space and bool(tokens), depth))
+        if text == "(":
+            depth += 1
+        space = False
+    if depth != 0:
+        raise SQLRejected("syntax", "unbalanced parentheses")
+    return tokens
+
+
+def render(tokens: List[Token]) -> str:
+    return "".join((" " if token.space else "") + token.text for token in tokens)
+
+
+def is_wide(info: Optional[ColumnInfo]) -> bool:
+    if info is None:
+        return False
+    if info.type in WIDE_TYPES:
+        return True
+    return info.type in ("varchar", "varbinary", "char") and (info.length or 0) > WIDE_VARCHAR_LENGTH
+
+
+class _Analyzer:
+    """
+    Phân tích một câu SELECT (và các subquery) trên danh sách token
+    """
+
+    def __init__(self, tokens: List[Token], index: SchemaIndex, default_rows: int, check: SQLCheck):
+        self.tokens = tokens
+        self.index = index
+        self.default_rows = default_rows
+        self.check = check
+        self.matching = self._match_parens()
+        self.closing = {close: open_index for open_index, close in self.matching.items()}
+
+    def _match_parens(self) -> Dict[int, int]:
+        stack: List[int] = []
+        matching: Dict[int, int] = {}
+        for i, token in enumerate(self.tokens):
+            if token.text == "(":
+                stack.append(i)
+            elif token.text == ")":
+                matching[stack.pop()] = i
+        return matching
+
+    def _is_subquery(self, i: int) -> bool:
+        return self.tokens[i].text == "(" and i + 1 < len(self.tokens) and self.tokens[i + 1].upper == "SELECT"
+
+    def clauses(self, start: int, end: int) -> Dict[str, int]:
+        """
+        Vị trí các mệnh đề của câu SELECT ở cùng mức ngoặc với từ khóa SELECT
+        """
+        depth = self.tokens[start].depth
+        found: Dict[str, int] = {}
+        for i in range(start + 1, end):
+            token = self.tokens[i]
+            if token.depth == depth and token.upper in CLAUSE_WORDS and token.upper not in found:
+                found[token.upper] = i
+        return found
+
+    def clause_end(self, clauses: Dict[str, int], name: str, end: int) -> int:
+        start = clauses[name]
+        following = [i for i in clauses.values() if i > start]
+        return min(following) if following else end
+
+    def union_parts(self, start: int, end: int) -> List[Tuple[int, int]]:
+        depth = self.tokens[start].depth
+        parts = []
+        part_start = start
+        for i in range(start, end):
+            if self.tokens[i].depth == depth and self.tokens[i].upper == "UNION":
+                parts.append((part_start, i))
+                part_start = i + 2 if i + 1 < end and self.tokens[i + 1].upper in ("ALL", "DISTINCT") else i + 1
+        parts.append((part_start, end))
+        return parts
+
+    # --- FROM ---
+
+    def _table_rows(self, table: str) -> int:
+        info = self.index.tables.get(table)
+        if info is not None and info.rows is not None:
+            return max(1, info.rows)
+        return self.default_rows
+
+    def parse_from(self, start: int, end: int, outer: Dict[str, TableRef]) -> Tuple[List[TableRef], List[Tuple[int, int, TableRef]]]:
+        """
+        Danh sách bảng (theo thứ tự join) và các đoạn điều kiện ON / USING
+        """
+        tokens = self.tokens
+        depth = tokens[start].depth if start < end else 0
+        refs: List[TableRef] = []
+        conditions: List[Tuple[int, int, TableRef]] = []
+        i = start
+        while i < end:
+            token = tokens[i]
+            if token.upper in JOIN_WORDS or token.text == ",":
+                i += 1
+                continue
+            if token.text == "(":
+                if not self._is_subquery(i):
+                    raise SQLRejected("syntax", "unsupported FROM clause")
+                close = self.matching[i]
+                sub = self.analyze(i + 1, close, outer)
+                ref = TableRef(None, "", max(1, sub.result_rows), derived_cost=sub.examined)
+                i = close + 1
+            elif token.kind in ("word", "ident"):
+                name = token.name
+                i += 1
+                if i + 1 < end and tokens[i].text == ".":
+                    if name.lower() in FORBIDDEN_SCHEMAS:
+                        raise SQLRejected("forbidden", f"access to schema {name} is not allowed")
+                    name = tokens[i + 1].name
+                    i += 2
+                if self.index and name not in self.index.tables:
+                    raise SQLRejected("unknown_table", f"unknown table {name}")
+                ref = TableRef(name, name, self._table_rows(name))
+            else:
+                raise SQLRejected("syntax", f"unexpected token {token.text!r} in FROM clause")
+
+            if i < end and tokens[i].upper == "AS":
+                i += 1
+            if i < end and tokens[i].kind in ("word", "ident") and tokens[i].upper not in KEYWORDS | INDEX_HINT_WORDS:
+                ref.alias = tokens[i].name
+                i += 1
+            refs.append(ref)
+
+            # Index hint: USE/FORCE/IGNORE INDEX (...)
+            while i < end and tokens[i].upper in INDEX_HINT_WORDS:
+                while i < end and tokens[i].text != "(":
+                    i += 1
+                i = self.matching.get(i, end - 1) + 1
+            if i < end and tokens[i].upper in ("ON", "USING"):
+                cond_start = i
+                i += 1
+                while i < end and not (tokens[i].depth == depth and (tokens[i].upper in JOIN_WORDS or tokens[i].text == ",")):
+                    i += 1
+                conditions.append((cond_start, i, ref))
+        return refs, conditions
+
+    # --- điều kiện ---
+
+    def _column_before(self, i: int) -> Optional[Tuple[Optional[str], str, int]]:
+        """
+        Tham chiếu cột kết thúc ở token i: (qualifier, cột, vị trí bắt đầu)
+        """
+        token = self.tokens[i] if i >= 0 else None
+        if token is not None and token.text == ")":
+            # Vế trái là lời gọi hàm trên một cột, vd. YEAR(created_at): trả về cột bên trong
+            open_index = self.closing.get(i, 0)
+            if i - open_index in (2, 4) and self._wrapped(open_index + 1):
+                return self._column_before(i - 1)
+            return None
+        if token is None or token.kind not in ("word", "ident") or token.upper in KEYWORDS:
+            return None
+        if i >= 2 and self.tokens[i - 1].text == "." and self.tokens[i - 2].kind in ("word", "ident"):
+            return self.tokens[i - 2].name, token.name, i - 2
+        return None, token.name, i
+
+    def _column_after(self, i: int) -> Optional[Tuple[Optional[str], str, int]]:
+        tokens = self.tokens
+        if i >= len(tokens) or tokens[i].kind not in ("word", "ident") or tokens[i].upper in KEYWORDS:
+            return None
+        if i + 1 < len(tokens) and tokens[i + 1].text == "(":
+            return None
+        if i + 2 < len(tokens) and tokens[i + 1].text == "." and tokens[i + 2].kind in ("word", "ident"):
+            return tokens[i].name, tokens[i + 2].name, i + 2
+        return None, tokens[i].name, i
+
+    def _wrapped(self, start: int) -> bool:
+        """
+        Cột nằm trong lời gọi hàm (vd. YEAR(created_at)) thì không dùng được index
+        """
+        if start < 2 or self.tokens[start - 1].text != "(":
+            return False
+        before = self.tokens[start - 2]
+        return before.kind in ("word", "ident") and before.upper not in KEYWORDS
+
+    def resolve(self, ref: Tuple[Optional[str], str, int], scope: Dict[str, TableRef],
+                tables: List[TableRef]) -> Optional[Tuple[TableRef, Optional[ColumnInfo]]]:
+        qualifier, column, _ = ref
+        if qualifier is not None:
+            table_ref = scope.get(qualifier)
+            if table_ref is None:
+                return None
+            return table_ref, self.index.column(table_ref.table, column) if table_ref.table else None
+        for table_ref in tables:
+            if table_ref.table and self.index.column(table_ref.table, column) is not None:
+                return table_ref, self.index.column(table_ref.table, column)
+        return None
+
+    def conditions(self, start: int, end: int, scope: Dict[str, TableRef], tables: List[TableRef],
+                   local_aliases: Set[str], predicates: bool = True) -> Tuple[List[Tuple[TableRef, ColumnInfo, TableRef, ColumnInfo]], int, bool, bool]:
+        """
+        Thu thập điều kiện: điều kiện trên một bảng lưu vào TableRef.local, trả về điều kiện join
+        (cột = cột giữa hai bảng), chi phí subquery, có subquery tương quan không và bản thân đoạn
+        này có tham chiếu cột của query ngoài không. predicates=False (danh sách SELECT): chỉ tính subquery
+        """
+        tokens = self.tokens
+        joins = []
+        sub_cost = 0
+        sub_correlated = False
+        correlated = False
+        i = start
+        while i < end:
+            token = tokens[i]
+            if self._is_subquery(i):
+                close = self.matching[i]
+                sub = self.analyze(i + 1, close, scope)
+                sub_cost += sub.examined
+                sub_correlated = sub_correlated or sub.correlated
+                i = close + 1
+                continue
+            op = token.text if token.kind == "op" and token.text in COMPARISON_OPS else token.upper
+            if not predicates or (op not in COMPARISON_OPS and op not in COMPARISON_WORDS):
+                i += 1
+                continue
+            negated = i > 0 and tokens[i - 1].upper == "NOT"
+            left = self._column_before(i - 2 if negated else i - 1)
+            right_start = i + 1
+            if right_start < end and tokens[right_start].upper == "NOT":
+                negated = True
+                right_start += 1
+            right = self._column_after(right_start) if op in COMPARISON_OPS else None
+
+            for ref in (left, right):
+                if ref is not None and ref[0] is not None and ref[0] not in local_aliases and ref[0] in scope:
+                    correlated = True
+            left_col = self.resolve(left, scope, tables) if left else None
+            right_col = self.resolve(right, scope, tables) if right else None
+            if left_col and right_col and left_col[0] is not right_col[0]:
+                inner = [col for col in (left_col, right_col) if col[0] in tables]
+                if len(inner) == 1 and inner[0][1] is not None:
+                    # So sánh với cột của query ngoài (subquery tương quan): như điều kiện hằng trên bảng trong
+                    correlated = True
+                    kind = "eq" if op in ("=", "<=>") else "range"
+                    inner[0][0].local.append((inner[0][1].name, kind, op not in ("<>", "!=")))
+                elif left_col[1] is not None and right_col[1] is not None and op == "=":
+                    joins.append((left_col[0], left_col[1], right_col[0], right_col[1]))
+            else:
+                for ref, resolved in ((left, left_col), (right, right_col)):
+                    if resolved is None or resolved[1] is None or resolved[0] not in tables:
+                        continue
+                    sargable = not negated and op not in ("<>", "!=", "REGEXP", "RLIKE") and not self._wrapped(ref[2])
+                    if op == "LIKE" and right_start < end and tokens[right_start].kind == "string":
+                        sargable = sargable and not tokens[right_start].text[1:].startswith("%")
+                    kind = "eq" if op in ("=", "<=>", "IN", "IS") else "range"
+                    resolved[0].local.append((resolved[1].name, kind, sargable))
+            i = right_start
+        return joins, sub_cost, sub_correlated, correlated
+
+    def using_joins(self, start: int, end: int, ref: TableRef, tables: List[TableRef]):
+        """
+        JOIN ... USING (col, ...): điều kiện join với bảng phía trước có cùng tên cột
+        """
+        joins = []
+        position = tables.index(ref)
+        for token in self.tokens[start:end]:
+            if token.kind not in ("word", "ident") or not ref.table:
+                continue
+            info = self.index.column(ref.table, token.name)
+            for other in tables[:position]:
+                other_info = self.index.column(other.table, token.name) if other.table else None
+                if info is not None and other_info is not None:
+                    joins.append((other, other_info, ref, info))
+                    break
+        return joins
+
+    def access_rows(self, ref: TableRef) -> Tuple[int, bool]:
+        """
+        Số dòng đọc từ một bảng theo điều kiện dùng được index tốt nhất, và có dùng index không
+        """
+        if ref.table is None:
+            return ref.rows, True
+        best = ref.rows
+        indexed = False
+        for column, kind, sargable in ref.local:
+            info = self.index.column(ref.table, column)
+            if info is None:
+                continue
+            if not info.has_index:
+                self.check.warnings.append(f"predicate on unindexed column {ref.table}.{info.name}")
+                continue
+            if not sargable:
+                self.check.warnings.append(f"predicate on {ref.table}.{info.name} cannot use its index")
+                continue
+            indexed = True
+            if kind == "eq" and (info.primary or info.unique):
+                estimate = 1
+            else:
+                estimate = int(ref.rows * (EQ_SELECTIVITY if kind == "eq" else RANGE_SELECTIVITY))
+            best = min(best, max(1, estimate))
+        return best, indexed
+
+    def scan(self, ref: TableRef, rows: int, indexed: bool) -> int:
+        """
+        Đọc một bảng theo điều kiện của riêng nó (không qua index của điều kiện join)
+        """
+        if not indexed and ref.rows > FULL_SCAN_WARN_ROWS:
+            self.check.warnings.append(f"full scan of {ref.table} (~{ref.rows} rows)")
+        return rows + ref.derived_cost
+
+    def analyze(self, start: int, end: int, outer: Optional[Dict[str, TableRef]] = None) -> QueryAnalysis:
+        """
+        Ước lượng số dòng phải đọc (examined) và số dòng kết quả của câu SELECT trong [start, end)
+        """
+        outer = outer or {}
+        parts = self.union_parts(start, end)
+        if len(parts) > 1:
+            analyses = [self.analyze(part_start, part_end, outer) for part_start, part_end in parts]
+            return QueryAnalysis(
+                tables=[ref for analysis in analyses for ref in analysis.tables],
+                examined=sum(analysis.examined for analysis in analyses),
+                result_rows=sum(analysis.result_rows for analysis in analyses),
+                correlated=any(analysis.correlated for analysis in analyses),
+            )
+
+        if self.tokens[start].upper != "SELECT":
+            raise SQLRejected("not_select", "only SELECT statements are allowed")
+        clauses = self.clauses(start, end)
+        tables: List[TableRef] = []
+        ons: List[Tuple[int, int, TableRef]] = []
+        if "FROM" in clauses:
+            tables, ons = self.parse_from(clauses["FROM"] + 1, self.clause_end(clauses, "FROM", end), outer)
+        scope = dict(outer)
+        for ref in tables:
+            if ref.alias:
+                scope[ref.alias] = ref
+        local_aliases = {ref.alias for ref in tables if ref.alias}
+
+        joins = []
+        spans = []
+        for cond_start, cond_end, ref in ons:
+            if self.tokens[cond_start].upper == "USING":
+                joins += self.using_joins(cond_start + 1, cond_end, ref, tables)
+            else:
+                spans.append((cond_start + 1, cond_end, True))
+        if "WHERE" in clauses:
+            spans.append((clauses["WHERE"] + 1, self.clause_end(clauses, "WHERE", end), True))
+        select_end = min(clauses.values()) if clauses else end
+        spans.append((start + 1, select_end, False))
+        if "HAVING" in clauses:
+            spans.append((clauses["HAVING"] + 1, self.clause_end(clauses, "HAVING", end), False))
+
+        sub_cost = 0
+        correlated_sub = False
+        correlated = False
+        for span_start, span_end, predicates in spans:
+            span_joins, cost, sub_correlated, references_outer = self.conditions(
+                span_start, span_end, scope, tables, local_aliases, predicates)
+            joins += span_joins
+            sub_cost += cost
+            correlated_sub = correlated_sub or sub_correlated
+            correlated = correlated or references_outer
+        # Query này tham chiếu bảng của query ngoài
+        for ref_a, _, ref_b, _ in joins:
+            if ref_a not in tables or ref_b not in tables:
+                correlated = True
+
+        if not tables:
+            return QueryAnalysis([], sub_cost, 1, correlated)
+
+        # Thứ tự join như optimizer: bắt đầu từ bảng đọc ít dòng nhất, rồi lần lượt nối bảng có điều kiện
+        # join với các bảng đã chọn (ưu tiên bảng tra được qua index của cột join)
+        access = {ref: self.access_rows(ref) for ref in tables}
+        remaining = list(tables)
+        first = min(remaining, key=lambda ref: access[ref][0] + ref.derived_cost)
+        remaining.remove(first)
+        chosen = [first]
+        examined = self.scan(first, *access[first])
+        result = access[first][0]
+        while remaining:
+            candidates = []
+            for ref in remaining:
+                edges = [
+                    (a, a_info, b, b_info) if b is ref else (b, b_info, a, a_info)
+                    for a, a_info, b, b_info in joins
+                    if (a is ref and b in chosen) or (b is ref and a in chosen)
+                ]
+                lookup = [edge for edge in edges if edge[3].has_index]
+                if lookup:
+                    other, _, _, info = lookup[0]
+                    fanout = 1 if info.primary or info.unique else max(1, ref.rows // max(1, other.rows))
+                    # Tra theo index chỉ tốt khi không đọc nhiều hơn quét bảng một lần
+                    if result * fanout <= access[ref][0]:
+                        candidates.append((result * fanout, ref, edges, fanout))
+                        continue
+                candidates.append((None, ref, edges, None))
+            connected = [candidate for candidate in candidates if candidate[2]]
+            pool = connected or candidates
+            lookups = [candidate for candidate in pool if candidate[0] is not None]
+            if lookups:
+                cost, ref, _, fanout = min(lookups, key=lambda candidate: candidate[0])
+                examined += cost + ref.derived_cost
+                result *= fanout
+            else:
+                _, ref, edges, _ = min(pool, key=lambda candidate: access[candidate[1]][0])
+                rows = access[ref][0]
+                examined += self.scan(ref, *access[ref])
+                if not edges:
+                    self.check.warnings.append(f"join without condition on {ref.table or 'derived table'}")
+                    examined += result * rows
+                    result *= rows
+                else:
+                    # Hash join / join buffer: đọc mỗi bảng một lần
+                    if not any(edge[1].has_index or edge[3].has_index for edge in edges):
+                        names = ", ".join(f"{ref.table}.{edge[3].name}" for edge in edges)
+                        self.check.warnings.append(f"join on unindexed columns ({names})")
+                    result = max(result, rows)
+            remaining.remove(ref)
+            chosen.append(ref)
+
+        sorted_or_grouped = any(name in clauses for name in ("ORDER", "GROUP", "HAVING")) or self.is_distinct(start)
+        if sorted_or_grouped:
+            examined += result
+        elif len(tables) == 1 and "LIMIT" in clauses and not self.single_row(start, select_end, clauses):
+            limit = self.limit_value(clauses["LIMIT"], end)
+            if limit is not None:
+                examined = min(examined, max(1, limit) * EARLY_STOP_FACTOR)
+        examined += sub_cost * (result if correlated_sub else 1)
+        if self.single_row(start, select_end, clauses):
+            result = 1
+        return QueryAnalysis(tables, examined, result, correlated)
+
+    # --- SELECT list / LIMIT ---
+
+    def is_distinct(self, start: int) -> bool:
+        return start + 1 < len(self.tokens) and self.tokens[start + 1].upper == "DISTINCT"
+
+    def select_items(self, start: int, end: int) -> List[Tuple[int, int]]:
+        depth = self.tokens[start].depth
+        first = start + 2 if self.is_distinct(start) or self.tokens[start + 1].upper == "ALL" else start + 1
+        items = []
+        item_start = first
+        for i in range(first, end):
+            if self.tokens[i].depth == depth and self.tokens[i].text == ",":
+                items.append((item_start, i))
+                item_start = i + 1
+        items.append((item_start, end))
+        return items
+
+    def single_row(self, start: int, select_end: int, clauses: Dict[str, int]) -> bool:
+        """
+        Query chỉ gồm hàm tổng hợp và không GROUP BY (vd. COUNT(*)) luôn trả về một dòng
+        """
+        if "GROUP" in clauses:
+            return False
+        for item_start, item_end in self.select_items(start, select_end):
+            token = self.tokens[item_start]
+            if not (token.upper in AGGREGATE_FUNCTIONS and item_start + 1 < item_end and self.tokens[item_start + 1].text == "("):
+                return False
+            close = self.matching[item_start + 1]
+            rest = self.tokens[close + 1:item_end]
+            if rest and not (rest[0].upper == "AS" or (len(rest) == 1 and rest[0].kind in ("word", "ident"))):
+                return False
+        return True
+
+    def limit_value(self, limit_index: int, end: int) -> Optional[int]:
+        count_index = self.limit_count_index(limit_index, end)
+        return int(self.tokens[count_index].text) if count_index is not None else None
+
+    def limit_count_index(self, limit_index: int, end: int) -> Optional[int]:
+        """
+        Vị trí token số dòng của LIMIT n / LIMIT offset, n / LIMIT n OFFSET m
+        """
+        tokens = self.tokens
+        first = limit_index + 1
+        if first >= end or tokens[first].kind != "number":
+            return None
+        if first + 2 < end and tokens[first + 1].text == "," and tokens[first + 2].kind == "number":
+            return first + 2
+        return first
+
+
+class SQLGuard:
+    """
+    Kiểm tra và rewrite SQL sinh ra; từ chối query không phải một câu SELECT chỉ đọc
+    hoặc có số dòng đọc ước lượng vượt max_examined_rows. Query tổng hợp trả về một dòng
+    trên một bảng (vd. COUNT(*) cả bảng) đọc tối đa một lượt bảng nên chỉ bị đánh dấu
+    """
+
+    def __init__(self, max_rows: int = 100, wide_max_rows: int = 20, max_examined_rows: int = 1_000_000,
+                 default_table_rows: int = 10000):
+        self.max_rows = max_rows
+        self.wide_max_rows = wide_max_rows
+        self.max_examined_rows = max_examined_rows
+        self.default_table_rows = default_table_rows
+        self.counters = {"checked": 0, "allowed": 0, "rewritten": 0, "rejected": 0, "flagged": 0}
+        self.reject_reasons: Dict[str, int] = {}
+
+    def check(self, sql: str, index: Optional[SchemaIndex] = None) -> SQLCheck:
+        self.counters["checked"] += 1
+        result = SQLCheck(sql=None)
+        try:
+            self._check(sql, index or SchemaIndex({}), result)
+        except SQLRejected as e:
+            result.sql = None
+            result.reason = str(e)
+            self.counters["rejected"] += 1
+            self.reject_reasons[e.code] = self.reject_reasons.get(e.code, 0) + 1
+            return result
+        except (IndexError, KeyError, ValueError) as e:
+            # Cấu trúc không phân tích được: không gửi sang Node
+            result.sql = None
+            result.reason = f"could not analyze query: {e}"
+            self.counters["rejected"] += 1
+            self.reject_reasons["unparsable"] = self.reject_reasons.get("unparsable", 0) + 1
+            return result
+        self.counters["allowed"] += 1
+        if result.rewrites:
+            self.counters["rewritten"] += 1
+        if result.warnings:
+            self.counters["flagged"] += 1
+        return result
+
+    def _check(self, sql: str, index: SchemaIndex, result: SQLCheck) -> None:
+        tokens = tokenize(sql)
+        while tokens and tokens[-1].text == ";":
+            tokens.pop()
+        if not tokens:
+            raise SQLRejected("syntax", "empty query")
+        if any(token.text == ";" for token in tokens):
+            raise SQLRejected("multiple_statements", "multiple statements are not allowed")
+        if tokens[0].upper != "SELECT":
+            raise SQLRejected("not_select", "only SELECT statements are allowed")
+        for i, token in enumerate(tokens):
+            followed_by_paren = i + 1 < len(tokens) and tokens[i + 1].text == "("
+            if token.upper in FORBIDDEN_WORDS:
+                raise SQLRejected("forbidden", f"keyword {token.upper} is not allowed")
+            if token.upper in FORBIDDEN_FUNCTIONS and followed_by_paren:
+                raise SQLRejected("forbidden", f"function {token.upper} is not allowed")
+            if token.kind in ("word", "ident") and token.name.lower() in FORBIDDEN_SCHEMAS \
+                    and i + 1 < len(tokens) and tokens[i + 1].text == ".":
+                raise SQLRejected("forbidden", f"access to schema {token.name} is not allowed")
+
+        analyzer = _Analyzer(tokens, index, self.default_table_rows, result)
+        analysis = analyzer.analyze(0, len(tokens))
+        single_query = len(analyzer.union_parts(0, len(tokens))) == 1
+        clauses = analyzer.clauses(0, len(tokens))
+        aggregate_scan = (
+            single_query and len(analysis.tables) == 1 and analysis.tables[0].table is not None
+            and analysis.examined <= analysis.tables[0].rows
+            and analyzer.single_row(0, min(clauses.values()) if clauses else len(tokens), clauses)
+        )
+        returns_wide = False
+        if single_query and index:
+            tokens, returns_wide = self._prune_wide(analyzer, tokens, analysis, result)
+            analyzer = _Analyzer(tokens, index, self.default_table_rows, SQLCheck(sql=None))
+        tokens = self._enforce_limit(analyzer, tokens, returns_wide, single_query, result)
+
+        result.estimated_rows = int(analysis.examined)
+        # Cảnh báo trùng lặp (cùng cột ở nhiều điều kiện) chỉ giữ một lần
+        result.warnings = list(dict.fromkeys(result.warnings))
+        if analysis.examined > self.max_examined_rows and aggregate_scan:
+            result.warnings.append(
+                f"single-row aggregate reads ~{int(analysis.examined)} rows (over limit {self.max_examined_rows})"
+            )
+        elif analysis.examined > self.max_examined_rows:
+            raise SQLRejected(
+                "cost",
+                f"estimated {int(analysis.examined)} rows examined exceeds limit {self.max_examined_rows}"
+                + (f" ({'; '.join(result.warnings)})" if result.warnings else "")
+            )
+        result.sql = render(tokens)
+
+    def _prune_wide(self, analyzer: _Analyzer, tokens: List[Token], analysis: QueryAnalysis,
+                    result: SQLCheck) -> Tuple[List[Token], bool]:
+        """
+        Mở rộng SELECT * / alias.* thành các cột không rộng; cho biết query có chọn cột rộng không
+        """
+        clauses = analyzer.clauses(0, len(tokens))
+        select_end = min(clauses.values()) if clauses else len(tokens)
+        known = [ref for ref in analysis.tables if ref.table]
+        qualify = len(analysis.tables) > 1
+        returns_wide = False
+        replacements: List[Tuple[int, int, str]] = []
+
+        for item_start, item_end in analyzer.select_items(0, select_end):
+            item = tokens[item_start:item_end]
+            if len(item) == 1 and item[0].text == "*":
+                targets = analysis.tables
+            elif len(item) == 3 and item[1].text == "." and item[2].text == "*":
+                targets = [ref for ref in analysis.tables if ref.alias == item[0].name]
+            else:
+                if len(item) >= 3 and item[-2].upper == "AS":
+                    item_end -= 2
+                ref = analyzer._column_before(item_end - 1) if item_end - item_start in (1, 3) else None
+                resolved = analyzer.resolve(ref, {r.alias: r for r in known}, known) if ref else None
+                if resolved and is_wide(resolved[1]):
+                    returns_wide = True
+                continue
+            if not targets or any(ref.table is None for ref in targets):
+                continue
+            columns: List[str] = []
+            pruned: List[str] = []
+            for ref in targets:
+                table = analyzer.index.tables[ref.table]
+                for name in table.columns:
+                    info = table.column_info[name.lower()]
+                    if is_wide(info):
+                        pruned.append(f"{ref.table}.{name}")
+                        continue
+                    columns.append(f"{ref.alias}.`{name}`" if qualify or len(item) == 3 else f"`{name}`")
+            if pruned and columns:
+                replacements.append((item_start, item_end, ", ".join(columns)))
+                result.rewrites.append(f"pruned wide columns from SELECT *: {', '.join(pruned)}")
+
+        for item_start, item_end, text in reversed(replacements):
+            tokens = tokens[:item_start] + [Token("word", text, tokens[item_start].space)] + tokens[item_end:]
+        return tokens, returns_wide
+
+    def _enforce_limit(self, analyzer: _Analyzer, tokens: List[Token], returns_wide: bool, single_query: bool,
+                       result: SQLCheck) -> List[Token]:
+        """
+        Thêm LIMIT nếu thiếu, siết LIMIT quá lớn (nhỏ hơn khi trả về cột rộng)
+        """
+        cap = self.wide_max_rows if returns_wide else self.max_rows
+        limit_index = None
+        depth = tokens[0].depth
+        for i, token in enumerate(tokens):
+            if token.depth == depth and token.upper == "LIMIT":
+                limit_index = i
+        if limit_index is None:
+            clauses = analyzer.clauses(0, len(tokens))
+            select_end = min(clauses.values()) if clauses else len(tokens)
+            if single_query and analyzer.single_row(0, select_end, clauses):
+                return tokens
+            result.rewrites.append(f"added LIMIT {cap}")
+            return tokens + [Token("word", "LIMIT", True), Token("number", str(cap), True)]
+        count_index = analyzer.limit_count_index(limit_index, len(tokens))
+        if count_index is None:
+            raise SQLRejected("syntax", "unsupported LIMIT clause")
+        value = int(tokens[count_index].text)
+        if value > cap:
+            tokens = list(tokens)
+            tokens[count_index] = Token("number", str(cap), tokens[count_index].space, tokens[count_index].depth)
+            result.rewrites.append(f"tightened LIMIT {value} -> {cap}")
+        return tokens
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "reject_reasons": dict(self.reject_reasons),
+            "max_rows": self.max_rows,
+            "max_examined_rows": self.max_examined_rows,
+        }
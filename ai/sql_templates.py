@@ -0,0 +1,371 @@
+"""
+Cache SQL template cho các dạng câu hỏi phổ biến (đếm, liệt kê, top-N)
+Câu hỏi được đưa về dạng chuẩn (entity, aggregate, filters, order, N) rồi ghép vào
+template SQL đã được kiểm tra với schema, nên không cần gọi LLM khi cache hit.
+"""
+
+import logging
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from schema_index import SchemaIndex
+from text_utils import fold_text, normalize_question, strip_diacritics
+
+logger = logging.getLogger(__name__)
+
+MAX_LIMIT = 100
+DEFAULT_TOP_N = 5
+
+# Cụm từ (đã bỏ dấu) -> tên bảng
+ENTITY_PHRASES = {
+    "khoa hoc": "courses", "courses": "courses", "course": "courses",
+    "bai tap": "problems", "problems": "problems", "problem": "problems",
+    "tai lieu": "documents", "documents": "documents", "document": "documents",
+    "nguoi dung": "users", "users": "users", "user": "users",
+    "cuoc thi": "contests", "contests": "contests", "contest": "contests",
+}
+
+COUNT_PHRASES = ["bao nhieu", "so luong", "tong so", "how many", "count"]
+
+# Cụm từ đếm chỉ khớp ở dạng có dấu: dạng bỏ dấu trùng với từ khác ("đếm" và "đêm" đều thành "dem")
+ACCENTED_COUNT_PHRASES = ["đếm"]
+
+LIST_PHRASES = ["danh sach", "liet ke", "hien thi", "show", "list"]
+
+ORDER_PHRASES = {
+    "rating cao nhat": "rating", "danh gia cao nhat": "rating", "danh gia cao": "rating",
+    "rating cao": "rating", "top rated": "rating", "highest rated": "rating",
+    "nhieu hoc vien nhat": "popular", "nhieu nguoi hoc nhat": "popular",
+    "pho bien nhat": "popular", "pho bien": "popular", "most popular": "popular", "popular": "popular",
+    "moi nhat": "newest", "gan day nhat": "newest", "newest": "newest", "latest": "newest",
+    "kho nhat": "difficulty", "hardest": "difficulty",
+}
+
+FILTER_PHRASES = {
+    "difficulty": {
+        "trung binh": "Medium", "medium": "Medium",
+        "de": "Easy", "easy": "Easy",
+        "kho": "Hard", "hard": "Hard",
+    },
+    "level": {
+        "nguoi moi bat dau": "Beginner", "co ban": "Beginner", "beginner": "Beginner",
+        "trung cap": "Intermediate", "intermediate": "Intermediate",
+        "nang cao": "Advanced", "advanced": "Advanced",
+    },
+}
+
+# Các từ không mang thông tin lọc, được phép còn sót lại sau khi canonicalize
+FILLER_WORDS = {
+    "co", "nhung", "cac", "trong", "he", "thong", "hien", "tai", "nao", "la", "gi",
+    "cho", "toi", "xem", "tat", "ca", "duoc", "hay", "vui", "long", "muc", "do",
+    "cap", "the", "of", "in", "are", "there", "what", "which", "all", "is", "me",
+    "top", "nhat", "theo", "voi", "a", "an", "ve", "bai", "mot", "so",
+}
+
+# Thông tin từng entity dùng để sinh template mặc định (không lấy cột văn bản dài như description:
+# template chỉ phục vụ danh sách / top-N được render local)
+ENTITY_SPECS: Dict[str, Dict[str, Any]] = {
+    "courses": {
+        "columns": ["id", "title", "rating", "students", "level"],
+        "where": ["is_deleted = false", "status = 'published'"],
+        "filters": ["level"],
+        "orders": {"rating": "rating DESC", "popular": "students DESC", "newest": "created_at DESC"},
+        "default_order": "rating",
+    },
+    "problems": {
+        "columns": ["id", "title", "difficulty", "acceptance", "solved_count"],
+        "where": ["is_deleted = false"],
+        "filters": ["difficulty"],
+        "orders": {
+            "difficulty": "FIELD(difficulty, 'Easy', 'Medium', 'Hard') DESC",
+            "popular": "solved_count DESC",
+            "newest": "created_at DESC",
+        },
+        "default_order": "popular",
+    },
+    "documents": {
+        "columns": ["id", "title", "level", "rating", "students"],
+        "where": ["is_deleted = false"],
+        "filters": ["level"],
+        "orders": {"rating": "rating DESC", "popular": "students DESC", "newest": "created_at DESC"},
+        "default_order": "rating",
+    },
+    "contests": {
+        "columns": ["id", "title", "start_time", "end_time"],
+        "where": ["is_deleted = false"],
+        "filters": [],
+        "orders": {"newest": "start_time DESC"},
+        "default_order": "newest",
+    },
+    "users": {
+        # Không liệt kê người dùng (thông tin cá nhân), chỉ cho phép đếm
+        "columns": [],
+        "where": ["is_active = true"],
+        "filters": [],
+        "orders": {},
+        "default_order": None,
+    },
+}
+
+_IDENTIFIER_RE = re.compile(r"\b([a-z_][a-z0-9_]*)\b")
+_SLOT_RE = re.compile(r"(?<![\w':]):([a-z_]+)\b")
+
+
+@dataclass(frozen=True)
+class CanonicalQuery:
+    entity: str
+    aggregate: str  # "count" | "list" | "top"
+    filters: Tuple[Tuple[str, str], ...] = ()
+    order_by: Optional[str] = None
+    limit: Optional[int] = None
+
+    def signature(self) -> Tuple:
+        """
+        Khóa template: dạng câu hỏi không bao gồm giá trị tham số
+        """
+        return (self.entity, self.aggregate, tuple(name for name, _ in self.filters), self.order_by, self.limit is not None)
+
+    def params(self) -> Dict[str, Any]:
+        params: Dict[str, Any] = dict(self.filters)
+        if self.limit is not None:
+            params["limit"] = self.limit
+        return params
+
+
+def _consume(text: str, phrases) -> Tuple[str, List[str]]:
+    """
+    Tìm và xóa các cụm từ (ưu tiên cụm dài) khỏi text, trả về text còn lại và các cụm đã khớp
+    """
+    matched = []
+    for phrase in sorted(phrases, key=len, reverse=True):
+        pattern = r"\b" + re.escape(phrase) + r"\b"
+        if re.search(pattern, text):
+            matched.append(phrase)
+            text = re.sub(pattern, " ", text)
+    return text, matched
+
+
+def consume_count(question: str, text: str) -> Tuple[str, List[str]]:
+    """
+    Như _consume với COUNT_PHRASES; cụm từ trong ACCENTED_COUNT_PHRASES được tìm trên câu hỏi
+    còn dấu, mỗi lần khớp xóa một lần xuất hiện dạng bỏ dấu khỏi text
+    """
+    text, matched = _consume(text, COUNT_PHRASES)
+    normalized = normalize_question(question)
+    for phrase in ACCENTED_COUNT_PHRASES:
+        occurrences = len(re.findall(r"\b" + re.escape(phrase) + r"\b", normalized))
+        if occurrences:
+            matched.append(phrase)
+            text = re.sub(r"\b" + re.escape(strip_diacritics(phrase)) + r"\b", " ", text, count=occurrences)
+    return text, matched
+
+
+def canonicalize(question: str) -> Optional[CanonicalQuery]:
+    """
+    Đưa câu hỏi về dạng chuẩn; trả về None nếu câu hỏi có thông tin không hiểu được
+    """
+    text = fold_text(question)
+
+    text, entities = _consume(text, ENTITY_PHRASES)
+    tables = {ENTITY_PHRASES[e] for e in entities}
+    if len(tables) != 1:
+        return None
+    entity = tables.pop()
+    spec = ENTITY_SPECS[entity]
+
+    text, counts = consume_count(question, text)
+    text, _ = _consume(text, LIST_PHRASES)
+    text, orders = _consume(text, ORDER_PHRASES)
+    order_keys = {ORDER_PHRASES[o] for o in orders}
+    if len(order_keys) > 1:
+        return None
+    order_by = order_keys.pop() if order_keys else None
+
+    filters = []
+    for column in spec["filters"]:
+        text, values = _consume(text, FILTER_PHRASES[column])
+        resolved = {FILTER_PHRASES[column][v] for v in values}
+        if len(resolved) > 1:
+            return None
+        if resolved:
+            filters.append((column, resolved.pop()))
+
+    limit = None
+    numbers = re.findall(r"\b\d+\b", text)
+    if len(numbers) > 1:
+        return None
+    if numbers:
+        limit = min(int(numbers[0]), MAX_LIMIT)
+        if limit <= 0:
+            return None
+        text = re.sub(r"\b\d+\b", " ", text)
+
+    leftover = [token for token in re.findall(r"\w+", text) if token not in FILLER_WORDS]
+    if leftover:
+        return None
+
+    if counts:
+        if order_by or limit is not None:
+            return None
+        aggregate = "count"
+    elif order_by or limit is not None:
+        # "top 10 khóa học" không nói sắp xếp theo gì: dùng thứ tự mặc định của entity
+        # (LIMIT không có ORDER BY trả về dòng tùy ý)
+        order_by = order_by or spec["default_order"]
+        if order_by not in spec["orders"]:
+            return None
+        aggregate = "top"
+        limit = limit or DEFAULT_TOP_N
+    else:
+        aggregate = "list"
+
+    if aggregate != "count" and not spec["columns"]:
+        return None
+
+    return CanonicalQuery(entity, aggregate, tuple(filters), order_by, limit)
+
+
+def _referenced_columns(fragment: str) -> Set[str]:
+    """
+    Các identifier trong một đoạn SQL (bỏ qua literal và từ khóa)
+    """
+    without_literals = re.sub(r"'[^']*'", "", fragment)
+    keywords = {"and", "or", "desc", "asc", "false", "true", "field", "null", "is", "not"}
+    return {name for name in _IDENTIFIER_RE.findall(without_literals.lower()) if name not in keywords}
+
+
+class SQLTemplateCache:
+    """
+    Cache template SQL theo dạng câu hỏi, tự xóa khi schema thay đổi
+    """
+
+    def __init__(self):
+        self._templates: Dict[Tuple, str] = {}
+        self._tables: Dict[str, Set[str]] = {}
+        self.schema_hash: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        self.learned = 0
+        self.invalidations = 0
+
+    def sync_schema(self, schema_index: SchemaIndex) -> None:
+        """
+        Xóa cache khi nội dung schema thay đổi
+        """
+        if schema_index.hash == self.schema_hash:
+            return
+        if self.schema_hash is not None:
+            self.invalidations += 1
+            logger.info("Schema changed, invalidating %d SQL templates", len(self._templates))
+        self.schema_hash = schema_index.hash
+        self._templates = {}
+        self._tables = {name: schema_index.columns(name) for name in schema_index.tables}
+
+    def _has_columns(self, table: str, fragment: str) -> bool:
+        columns = self._tables.get(table)
+        return bool(columns) and _referenced_columns(fragment) <= columns
+
+    def _build_default(self, query: CanonicalQuery) -> Optional[str]:
+        """
+        Sinh template mặc định cho dạng câu hỏi, kiểm tra mọi cột với schema
+        """
+        spec = ENTITY_SPECS[query.entity]
+        if query.entity not in self._tables:
+            return None
+
+        conditions = list(spec["where"]) + [f"{name} = :{name}" for name, _ in query.filters]
+        where = " AND ".join(conditions)
+        if not self._has_columns(query.entity, re.sub(r":\w+", "", where)):
+            return None
+
+        if query.aggregate == "count":
+            return f"SELECT COUNT(*) as total FROM {query.entity} WHERE {where}"
+
+        columns = [c for c in spec["columns"] if c in self._tables[query.entity]]
+        if "id" not in columns or "title" not in columns:
+            return None
+        sql = f"SELECT {', '.join(columns)} FROM {query.entity} WHERE {where}"
+        if query.order_by:
+            order = spec["orders"][query.order_by]
+            if not self._has_columns(query.entity, order):
+                return None
+            sql += f" ORDER BY {order}"
+        return sql + (" LIMIT :limit" if query.limit is not None else f" LIMIT {MAX_LIMIT}")
+
+    def _template_for(self, query: CanonicalQuery) -> Optional[str]:
+        signature = query.signature()
+        template = self._templates.get(signature)
+        if template is None:
+            template = self._build_default(query)
+            if template is not None:
+                self._templates[signature] = template
+        return template
+
+    def lookup(self, question: str) -> Optional[str]:
+        """
+        Trả về SQL nếu câu hỏi khớp một template đã kiểm tra, ngược lại None
+        """
+        if not self._tables:
+            return None
+        query = canonicalize(question)
+        template = self._template_for(query) if query else None
+        if template is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return render(template, query.params())
+
+    def learn(self, question: str, sql: str) -> bool:
+        """
+        Tham số hóa SQL do LLM sinh ra và lưu làm template nếu dạng câu hỏi chưa có template
+        """
+        query = canonicalize(question)
+        if query is None or query.entity not in self._tables or self._template_for(query) is not None:
+            return False
+
+        template = sql.strip().rstrip(";").strip()
+        if not template.upper().startswith("SELECT") or ";" in template:
+            return False
+        if not re.search(r"\bFROM\s+`?" + re.escape(query.entity) + r"`?\b", template, re.IGNORECASE):
+            return False
+
+        for name, value in query.filters:
+            literal = f"'{value}'"
+            if template.count(literal) != 1:
+                return False
+            template = template.replace(literal, f":{name}")
+        if query.limit is not None:
+            template, replaced = re.subn(r"\bLIMIT\s+" + str(query.limit) + r"\b", "LIMIT :limit", template, flags=re.IGNORECASE)
+            if replaced != 1:
+                return False
+
+        self._templates[query.signature()] = template
+        self.learned += 1
+        logger.info("Learned SQL template for %s", query.signature())
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "templates": len(self._templates),
+            "hits": self.hits,
+            "misses": self.misses,
+            "learned": self.learned,
+            "invalidations": self.invalidations,
+        }
+
+
+def render(template: str, params: Dict[str, Any]) -> str:
+    """
+    Điền tham số vào template; giá trị chỉ đến từ whitelist enum hoặc số nguyên
+    """
+    def replace(match):
+        name = match.group(1)
+        if name not in params:
+            return match.group(0)
+        value = params[name]
+        if isinstance(value, int):
+            return str(value)
+        return "'" + str(value).replace("'", "''") + "'"
+
+    return _SLOT_RE.sub(replace, template)
@@ -2,25 +2,91 @@
 """
 ChatAI System Server Startup Script
 
-This script starts the FastAPI server with proper configuration for development and testing.
+This script starts the FastAPI server with proper configuration for development and production.
 Make sure to set up your environment variables in .env file before running.
+
+- DEBUG=True: một process uvicorn với auto-reload (phát triển)
+- DEBUG=False: gunicorn + UvicornWorker, số worker theo số core, preload app và tắt êm
+  (graceful shutdown); cache schema/câu trả lời dùng chung giữa các worker qua SHARED_CACHE_PATH
 """
 
 import uvicorn
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+
+def worker_count() -> int:
+    """
+    Số worker: WEB_CONCURRENCY / AI_WORKERS nếu có, mặc định bằng số core
+    """
+    configured = os.getenv("WEB_CONCURRENCY") or os.getenv("AI_WORKERS")
+    if configured:
+        return max(1, int(configured))
+    return max(1, os.cpu_count() or 1)
+
+
+def run_production(host: str, port: int, workers: int) -> None:
+    """
+    Chạy bằng gunicorn (quản lý worker, restart worker chết, graceful shutdown khi SIGTERM);
+    không có gunicorn (vd. Windows) thì dùng chế độ nhiều worker của uvicorn
+    """
+    graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+    preload = os.getenv("AI_PRELOAD", "true").lower() in ("1", "true", "yes")
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        uvicorn.run(
+            "service:app",
+            host=host,
+            port=port,
+            workers=workers,
+            timeout_graceful_shutdown=graceful_timeout,
+            log_level="warning"
+        )
+        return
+
+    class ChatAIApplication(BaseApplication):
+        def load_config(self):
+            options = {
+                "bind": f"{host}:{port}",
+                "workers": workers,
+                "worker_class": "uvicorn.workers.UvicornWorker",
+                "preload_app": preload,
+                "graceful_timeout": graceful_timeout,
+                # Request stream dài (SSE) không bị coi là worker treo
+                "timeout": int(os.getenv("WORKER_TIMEOUT", "120")),
+                "keepalive": int(os.getenv("KEEPALIVE_TIMEOUT", "5")),
+                "max_requests": int(os.getenv("MAX_REQUESTS", "0")),
+                "max_requests_jitter": int(os.getenv("MAX_REQUESTS_JITTER", "0")),
+                "loglevel": "warning",
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from service import app
+            return app
+
+    ChatAIApplication().run()
+
+
 def main():
     """Start the FastAPI server with appropriate configuration."""
-    
+
     # Server configuration
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", 8000))
-    debug = os.getenv("DEBUG", "True").lower() == "true"
-    
+    debug = os.getenv("DEBUG", "False").lower() == "true"
+    workers = 1 if debug else worker_count()
+
+    # Nhiều worker: dùng chung cache để thêm worker không nhân số lần cache miss
+    if workers > 1 and "SHARED_CACHE_PATH" not in os.environ:
+        os.environ["SHARED_CACHE_PATH"] = os.path.join(tempfile.gettempdir(), f"chatai-cache-{port}.sqlite3")
+
     print("=" * 60)
     print("🤖 ChatAI System API Server")
     print("=" * 60)
@@ -28,31 +94,37 @@ def main():
     print(f"📚 Swagger UI: http://{host}:{port}/docs")
     print(f"📖 ReDoc: http://{host}:{port}/redoc")
     print(f"🔍 Debug Mode: {debug}")
+    print(f"⚙️  Workers: {workers}")
+    if os.getenv("SHARED_CACHE_PATH"):
+        print(f"🗄️  Shared cache: {os.environ['SHARED_CACHE_PATH']}")
     print("=" * 60)
-    
+
     # Check if OpenRouter API key is configured
     if not os.getenv("OPENROUTER_API_KEY"):
         print("⚠️  WARNING: OPENROUTER_API_KEY is not set!")
         print("   Please set your OpenRouter API key in the .env file")
         print("   Get your API key from: https://openrouter.ai/keys")
         print("=" * 60)
-    
+
     print("🚀 Starting server...")
     print("   Press Ctrl+C to stop")
     print("=" * 60)
-    
+
     try:
-        uvicorn.run(
-            "service:app",
-            host=host,
-            port=port,
-            reload=debug,
-            log_level="info" if debug else "warning"
-        )
+        if debug:
+            uvicorn.run(
+                "service:app",
+                host=host,
+                port=port,
+                reload=True,
+                log_level="info"
+            )
+        else:
+            run_production(host, port, workers)
     except KeyboardInterrupt:
         print("\n👋 Server stopped by user")
     except Exception as e:
         print(f"❌ Error starting server: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,9 @@
+"""
+Unit test cho các module của AI service (chạy từ thư mục ai/: python -m pytest tests)
+"""
+
+import os
+import sys
+
+# Các module của service được import dạng top-level (from sql_guard import ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,69 @@
+import pytest
+
+from answer_renderer import AnswerRenderer
+
+
+@pytest.fixture
+def renderer():
+    return AnswerRenderer(max_rows=20)
+
+
+@pytest.mark.parametrize("question, result", [
+    ("Có bao nhiêu bài tập trong khóa học Python?", [{"COUNT(*)": 12}]),
+    ("Có bao nhiêu khóa học của người dùng admin?", [{"COUNT(*)": 5}]),
+    ("How many problems are in the Python course?", [{"total": 8}]),
+    ("Liệt kê khóa học của người dùng admin", [{"title": "Python cơ bản", "rating": 4.5}]),
+])
+def test_multiple_entities_fall_back_to_llm(renderer, question, result):
+    assert renderer.render(question, result) is None
+    assert renderer.counters["llm"] == 1
+
+
+def test_whole_table_count(renderer):
+    answer = renderer.render("Có bao nhiêu khóa học?", [{"COUNT(*)": 7}])
+    assert answer == "Hiện tại hệ thống có **7** khóa học."
+
+
+@pytest.mark.parametrize("question", [
+    "Có bao nhiêu khóa học Python?",
+    "Có bao nhiêu khóa học nâng cao?",
+])
+def test_filtered_count_keeps_qualifier(renderer, question):
+    answer = renderer.render(question, [{"total": 3}])
+    assert answer == "Có **3** khóa học phù hợp với câu hỏi của bạn."
+
+
+def test_count_without_entity(renderer):
+    answer = renderer.render("Có bao nhiêu?", [{"total": 3}])
+    assert answer == "Dựa trên dữ liệu từ hệ thống, có **3** kết quả."
+
+
+def test_aggregate(renderer):
+    answer = renderer.render("Rating trung bình của khóa học", [{"avg_rating": "4.250"}])
+    assert answer == "Đánh giá trung bình của các khóa học là **4.25**."
+
+
+def test_grouped_count(renderer):
+    answer = renderer.render(
+        "Số lượng bài tập theo độ khó",
+        [{"difficulty": "Easy", "count": 10}, {"difficulty": "Hard", "count": 4}],
+    )
+    assert answer == "Số lượng bài tập theo độ khó:\n- Dễ: **10**\n- Khó: **4**"
+
+
+def test_list(renderer):
+    answer = renderer.render(
+        "Top khóa học rating cao nhất",
+        [{"id": 1, "title": "Python cơ bản", "rating": 4.5}, {"id": 2, "title": "Java", "rating": 4.1}],
+    )
+    assert answer.splitlines() == [
+        "Tìm thấy **2** khóa học:",
+        "",
+        "1. **Python cơ bản** — Đánh giá: 4.5",
+        "2. **Java** — Đánh giá: 4.1",
+    ]
+
+
+def test_description_needs_llm(renderer):
+    rows = [{"id": 1, "title": "Python cơ bản", "description": "Học Python từ đầu"}]
+    assert renderer.render("Danh sách khóa học", rows) is None
@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+from intent_classifier import SEED_EXAMPLES, IntentClassifier
+
+THRESHOLD = 0.75
+
+
+@pytest.fixture(scope="module")
+def classifier():
+    return IntentClassifier()
+
+
+def test_seed_examples_classify_locally(classifier):
+    assert classifier.misclassified_seeds(THRESHOLD) == []
+
+
+@pytest.mark.parametrize("question, label", SEED_EXAMPLES)
+def test_seed_example_label(classifier, question, label):
+    decision = classifier.classify(question)
+    assert decision.needs_database == label
+    assert decision.confidence >= THRESHOLD
+
+
+@pytest.mark.parametrize("question", [
+    "What courses are available?",
+    "List all problems",
+    "How many users are there?",
+    "Which contests are open?",
+])
+def test_english_plural_entities(classifier, question):
+    decision = classifier.classify(question)
+    assert decision.has_entity
+    assert decision.needs_database
+
+
+def test_general_question_with_list_keyword(classifier):
+    assert not classifier.classify("sự khác nhau giữa list và tuple").needs_database
+
+
+def test_decision_log_rotates(tmp_path):
+    log_path = str(tmp_path / "intent.jsonl")
+    classifier = IntentClassifier(log_path=log_path, log_max_bytes=200)
+    for i in range(20):
+        classifier.learn(f"câu hỏi số {i}", i % 2 == 0)
+    assert (tmp_path / "intent.jsonl").stat().st_size < 400
+    assert (tmp_path / "intent.jsonl.1").exists()
+    with open(log_path, encoding="utf-8") as f:
+        assert all("needs_database" in json.loads(line) for line in f)
+    # Khởi động lại: học từ cả file hiện tại và file đã xoay vòng
+    assert IntentClassifier(log_path=log_path)._docs[True] > IntentClassifier()._docs[True]
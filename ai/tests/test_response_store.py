@@ -0,0 +1,83 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+import response_store
+from response_store import ResponseStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ResponseStore(str(tmp_path / "responses.sqlite3"), max_entries=10, busy_timeout=0.05)
+    store.put("k", "sql", "model", "SELECT 1", 60)
+    return store
+
+
+@pytest.fixture
+def locked(store):
+    """
+    Worker khác đang giữ write lock của file
+    """
+    conn = sqlite3.connect(store.path, isolation_level=None)
+    conn.execute("BEGIN IMMEDIATE")
+    yield conn
+    conn.execute("ROLLBACK")
+    conn.close()
+
+
+def test_get_and_put(store):
+    assert store.get("k", "model") == "SELECT 1"
+    assert store.get("k", "other-model") is None
+    assert store.counters["hits"] == 1
+    assert store.counters["misses"] == 1
+
+
+def test_write_lock_does_not_block_put(store, locked):
+    started = time.monotonic()
+    store.put("k2", "sql", "model", "SELECT 2", 60)
+    assert time.monotonic() - started < 1.0
+    # Lần ghi bị bỏ qua, không phải lỗi của request
+    assert store.counters["errors"] == 1
+    assert store.counters["writes"] == 1
+
+
+def test_write_lock_does_not_block_get(store, locked):
+    started = time.monotonic()
+    # WAL: đọc không bị chặn bởi writer khác
+    assert store.get("k", "model") == "SELECT 1"
+    assert time.monotonic() - started < 1.0
+
+
+def test_trim_runs_off_the_event_loop(store, monkeypatch):
+    monkeypatch.setattr(response_store, "TRIM_EVERY", 5)
+    calls = []
+    trim = store.trim
+
+    def record(conn=None):
+        calls.append(conn)
+        return trim(conn)
+
+    monkeypatch.setattr(store, "trim", record)
+
+    async def write():
+        for i in range(20):
+            store.put(f"q{i}", "answer", "model", i, 60)
+        await asyncio.sleep(0.2)
+
+    asyncio.run(write())
+    assert calls and all(conn is not None and conn is not store._conn for conn in calls)
+    assert store.stats()["entries"] <= store.max_entries
+
+
+def test_flush_writes_hits(store):
+    store.get("k", "model")
+    store.record_hit("k", "model")
+
+    async def stop():
+        await store.stop()
+
+    asyncio.run(stop())
+    assert store.stats()["pending_hits"] == 0
+    assert store.most_used(1)[0].hits == 3
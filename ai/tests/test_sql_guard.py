@@ -0,0 +1,169 @@
+import pytest
+
+from schema_index import SchemaIndex
+from sql_guard import SQLGuard
+
+SCHEMA = """# Database Schema
+
+## Table: users
+
+Columns:
+  - id (bigint, PRIMARY KEY, NOT NULL)
+  - username (varchar(50), UNIQUE, NOT NULL)
+  - email (varchar(255), UNIQUE, NOT NULL)
+  - bio (text)
+  - is_active (tinyint, NOT NULL, DEFAULT: 1)
+  - created_at (datetime, NOT NULL)
+
+## Table: courses
+
+Columns:
+  - id (bigint, PRIMARY KEY, NOT NULL)
+  - instructor_id (bigint, INDEXED, NOT NULL)
+  - title (varchar(255), NOT NULL)
+  - description (text)
+  - status (enum, INDEXED, NOT NULL, DEFAULT: draft)
+  - rating (float, NOT NULL, DEFAULT: 0)
+
+Foreign Keys:
+  - instructor_id -> users.id
+"""
+
+ROW_ESTIMATES = {"users": 2000000, "courses": 5000}
+
+
+@pytest.fixture
+def guard():
+    return SQLGuard(max_rows=100, wide_max_rows=20, max_examined_rows=1_000_000)
+
+
+@pytest.fixture(scope="module")
+def index():
+    schema_index = SchemaIndex.from_text(SCHEMA)
+    schema_index.apply_row_estimates(ROW_ESTIMATES)
+    return schema_index
+
+
+# --- Từ chối ---
+
+@pytest.mark.parametrize("sql, code", [
+    ("SELECT id FROM courses; DROP TABLE users", "multiple_statements"),
+    ("SELECT id FROM courses; SELECT id FROM users", "multiple_statements"),
+    ("SELECT COUNT(*) INTO total FROM courses", "forbidden"),
+    ("SELECT id FROM courses INTO OUTFILE '/tmp/courses.csv'", "forbidden"),
+    ("SELECT SLEEP(10)", "forbidden"),
+    ("SELECT id FROM courses WHERE SLEEP(1) = 0", "forbidden"),
+    ("SELECT table_name FROM information_schema.tables", "forbidden"),
+    ("SELECT user, authentication_string FROM mysql.user", "forbidden"),
+    ("SELECT * FROM `performance_schema`.threads", "forbidden"),
+    ("UPDATE courses SET rating = 5", "not_select"),
+    ("SELECT id INTO @total FROM courses", "syntax"),
+])
+def test_rejects(guard, index, sql, code):
+    result = guard.check(sql, index)
+    assert not result.allowed
+    assert guard.reject_reasons == {code: 1}
+
+
+def test_trailing_semicolon_is_not_multiple_statements(guard, index):
+    assert guard.check("SELECT id FROM courses LIMIT 5;", index).allowed
+
+
+def test_forbidden_words_inside_strings_are_allowed(guard, index):
+    result = guard.check("SELECT id FROM courses WHERE title = 'sleep(1); drop table users' LIMIT 5", index)
+    assert result.allowed
+
+
+def test_rejects_expensive_join(guard, index):
+    result = guard.check("SELECT u.username, c.title FROM users u, courses c", index)
+    assert not result.allowed
+    assert guard.reject_reasons == {"cost": 1}
+
+
+# --- Rewrite ---
+
+def test_adds_limit(guard, index):
+    result = guard.check("SELECT id, title FROM courses", index)
+    assert result.sql.endswith("LIMIT 100")
+    assert result.rewrites == ["added LIMIT 100"]
+
+
+def test_tightens_limit(guard, index):
+    result = guard.check("SELECT id, title FROM courses LIMIT 500", index)
+    assert result.sql.endswith("LIMIT 100")
+    assert result.rewrites == ["tightened LIMIT 500 -> 100"]
+
+
+def test_tightens_limit_with_offset(guard, index):
+    result = guard.check("SELECT id, title FROM courses LIMIT 10, 500", index)
+    assert result.sql.endswith("LIMIT 10, 100")
+
+
+def test_keeps_small_limit(guard, index):
+    result = guard.check("SELECT id, title FROM courses LIMIT 5", index)
+    assert result.sql == "SELECT id, title FROM courses LIMIT 5"
+    assert result.rewrites == []
+
+
+def test_wide_column_uses_smaller_limit(guard, index):
+    result = guard.check("SELECT title, description FROM courses", index)
+    assert result.sql.endswith("LIMIT 20")
+
+
+def test_single_row_aggregate_gets_no_limit(guard, index):
+    result = guard.check("SELECT COUNT(*) AS total FROM courses WHERE status = 'published'", index)
+    assert "LIMIT" not in result.sql
+    assert result.rewrites == []
+
+
+def test_prunes_wide_columns_from_select_star(guard, index):
+    result = guard.check("SELECT * FROM courses WHERE status = 'published'", index)
+    assert result.sql.startswith("SELECT `id`, `instructor_id`, `title`, `status`, `rating` FROM courses")
+    assert "description" not in result.sql
+    assert result.rewrites[0] == "pruned wide columns from SELECT *: courses.description"
+    # Không còn cột rộng nên dùng LIMIT thường
+    assert result.sql.endswith("LIMIT 100")
+
+
+def test_prunes_qualified_star_in_join(guard, index):
+    result = guard.check(
+        "SELECT c.*, u.username FROM courses c JOIN users u ON u.id = c.instructor_id LIMIT 10", index)
+    assert "c.`title`" in result.sql
+    assert "description" not in result.sql
+    assert "u.username" in result.sql
+
+
+# --- Ngưỡng chi phí ---
+
+def test_whole_table_count_is_flagged_not_rejected(guard, index):
+    result = guard.check("SELECT COUNT(*) FROM users", index)
+    assert result.allowed
+    assert result.estimated_rows == 2000000
+    assert any("single-row aggregate" in warning for warning in result.warnings)
+    assert guard.counters["flagged"] == 1
+    assert guard.counters["rejected"] == 0
+
+
+def test_single_row_aggregate_with_filter_is_flagged(guard, index):
+    result = guard.check("SELECT AVG(id) AS avg_id, MAX(created_at) FROM users WHERE is_active = 1", index)
+    assert result.allowed
+    assert any("unindexed column users.is_active" in warning for warning in result.warnings)
+
+
+def test_grouped_aggregate_over_cap_is_rejected(guard, index):
+    result = guard.check("SELECT is_active, COUNT(*) FROM users GROUP BY is_active", index)
+    assert not result.allowed
+    assert guard.reject_reasons == {"cost": 1}
+
+
+def test_aggregate_over_join_over_cap_is_rejected(guard, index):
+    result = guard.check("SELECT COUNT(*) FROM users u, courses c", index)
+    assert not result.allowed
+    assert guard.reject_reasons == {"cost": 1}
+
+
+def test_indexed_lookup_is_not_flagged(guard, index):
+    result = guard.check("SELECT id, username FROM users WHERE id = 42", index)
+    assert result.allowed
+    assert result.warnings == []
+    assert result.estimated_rows == 1
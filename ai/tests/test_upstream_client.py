@@ -0,0 +1,257 @@
+import asyncio
+from collections import deque
+
+import httpx
+import pytest
+from openai import BadRequestError, InternalServerError
+
+from upstream_client import CircuitBreaker, CircuitOpenError, UpstreamPool, UpstreamTimeout
+
+ENDPOINTS = [("http://primary.test/v1", "key-a"), ("http://secondary.test/v1", "key-b")]
+
+
+def api_error(cls, status: int):
+    response = httpx.Response(status, request=httpx.Request("POST", "http://upstream.test/v1/chat/completions"))
+    return cls(f"status {status}", response=response, body=None)
+
+
+def make_pool(endpoints=ENDPOINTS, **kwargs) -> UpstreamPool:
+    options = {"hedge_enabled": False, "default_timeout": 1.0}
+    options.update(kwargs)
+    return UpstreamPool(endpoints, httpx.AsyncClient(), **options)
+
+
+def enable_hedge(pool: UpstreamPool, key: str, delay: float = 0.01) -> None:
+    """
+    Đủ mẫu latency để hedge sau `delay` giây
+    """
+    pool.hedge_enabled = True
+    pool.hedge_min_delay = delay
+    pool.hedge_max_ratio = 1.0
+    pool._samples[key] = deque([delay] * pool.hedge_min_samples)
+
+
+class FakeEndpoints:
+    """
+    attempt() giả lập: mỗi endpoint (theo thứ tự trong pool) chạy một coroutine kịch bản
+    """
+
+    def __init__(self, pool: UpstreamPool, *behaviours):
+        self.behaviours = {endpoint.name: behaviour for endpoint, behaviour in zip(pool.endpoints, behaviours)}
+        self.calls = []
+        self.cancelled = []
+
+    async def __call__(self, endpoint):
+        self.calls.append(endpoint.name)
+        try:
+            return await self.behaviours[endpoint.name]()
+        except asyncio.CancelledError:
+            self.cancelled.append(endpoint.name)
+            raise
+
+
+def reply(value, delay: float = 0.0):
+    async def behaviour():
+        await asyncio.sleep(delay)
+        return value
+    return behaviour
+
+
+def fail(error, delay: float = 0.0):
+    async def behaviour():
+        await asyncio.sleep(delay)
+        raise error
+    return behaviour
+
+
+# --- CircuitBreaker ---
+
+def test_breaker_opens_after_threshold_and_half_opens():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.0)
+    breaker.failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opened_count == 1
+
+    assert breaker.available()
+    breaker.acquire()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Chỉ một request thử tại một thời điểm
+    assert not breaker.available()
+    breaker.success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.available()
+
+
+def test_breaker_half_open_failure_reopens():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    breaker.failure()
+    breaker.acquire()
+    breaker.failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opened_count == 2
+
+
+def test_breaker_stays_open_until_reset_timeout():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60.0)
+    breaker.failure()
+    assert not breaker.available()
+
+
+# --- UpstreamPool._race ---
+
+def test_hedge_win_cancels_loser():
+    pool = make_pool()
+    enable_hedge(pool, "answer")
+    primary, secondary = pool.endpoints
+    fake = FakeEndpoints(pool, reply("slow", delay=5.0), reply("fast", delay=0.01))
+
+    result, winner = asyncio.run(pool._race("answer", "answer", fake))
+
+    assert (result, winner) == ("fast", secondary)
+    assert fake.calls == [primary.name, secondary.name]
+    assert fake.cancelled == [primary.name]
+    assert pool.counters["hedges"] == 1
+    assert pool.counters["hedge_wins"] == 1
+    assert pool.counters["cancelled_attempts"] == 1
+    assert primary.counters["cancelled"] == 1
+    assert primary.in_flight == 0 and secondary.in_flight == 0
+    # Attempt bị hủy không tính là lỗi của endpoint
+    assert primary.breaker.failures == 0
+
+
+def test_no_hedge_before_delay():
+    pool = make_pool()
+    enable_hedge(pool, "answer", delay=1.0)
+    fake = FakeEndpoints(pool, reply("ok", delay=0.01), reply("unused"))
+
+    result, winner = asyncio.run(pool._race("answer", "answer", fake))
+
+    assert (result, winner) == ("ok", pool.endpoints[0])
+    assert len(fake.calls) == 1
+    assert pool.counters["hedges"] == 0
+
+
+def test_failover_on_5xx():
+    pool = make_pool()
+    primary, secondary = pool.endpoints
+    fake = FakeEndpoints(pool, fail(api_error(InternalServerError, 502)), reply("ok"))
+
+    result, winner = asyncio.run(pool._race("answer", "answer", fake))
+
+    assert (result, winner) == ("ok", secondary)
+    assert pool.counters["failovers"] == 1
+    assert primary.counters["failures"] == 1
+    assert primary.breaker.failures == 1
+    assert secondary.counters["successes"] == 1
+
+
+def test_client_error_is_not_retried():
+    pool = make_pool()
+    primary = pool.endpoints[0]
+    primary.breaker.failure_threshold = 1
+    primary.breaker.failure()
+    primary.breaker.reset_timeout = 0.0
+    fake = FakeEndpoints(pool, fail(api_error(BadRequestError, 400)), reply("unused"))
+
+    with pytest.raises(BadRequestError):
+        asyncio.run(pool._race("answer", "answer", fake))
+
+    assert len(fake.calls) == 1
+    assert pool.counters["failovers"] == 0
+    # Lỗi 4xx của request thử half-open trả lượt thử, không mở lại circuit
+    assert primary.breaker.state == CircuitBreaker.HALF_OPEN
+    assert primary.breaker.available()
+
+
+def test_all_attempts_fail_raises_last_error():
+    pool = make_pool()
+    fake = FakeEndpoints(pool, fail(api_error(InternalServerError, 500)), fail(api_error(InternalServerError, 503)))
+
+    with pytest.raises(InternalServerError):
+        asyncio.run(pool._race("answer", "answer", fake))
+
+    assert fake.calls == [endpoint.name for endpoint in pool.endpoints]
+
+
+def test_deadline_timeout():
+    pool = make_pool(stage_timeouts={"decision": 0.05})
+    primary = pool.endpoints[0]
+    fake = FakeEndpoints(pool, reply("late", delay=5.0), reply("unused"))
+
+    with pytest.raises(UpstreamTimeout):
+        asyncio.run(pool._race("decision", "decision", fake))
+
+    assert fake.cancelled == [primary.name]
+    assert pool.counters["timeouts"] == 1
+    assert primary.counters["timeouts"] == 1
+    assert primary.breaker.failures == 1
+    assert primary.in_flight == 0
+
+
+def test_circuit_open_rejects_without_attempt():
+    pool = make_pool(failure_threshold=1, reset_timeout=60.0)
+    for endpoint in pool.endpoints:
+        endpoint.breaker.failure()
+    fake = FakeEndpoints(pool, reply("unused"), reply("unused"))
+
+    assert not pool.available
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(pool._race("answer", "answer", fake))
+    assert fake.calls == []
+    assert pool.counters["circuit_rejected"] == 1
+
+
+def test_cancelled_half_open_trial_releases_breaker():
+    pool = make_pool(endpoints=ENDPOINTS[:1], failure_threshold=1, reset_timeout=0.0)
+    endpoint = pool.endpoints[0]
+    endpoint.breaker.failure()
+    fake = FakeEndpoints(pool, reply("never", delay=5.0))
+
+    async def caller_disconnects():
+        task = asyncio.ensure_future(pool._race("answer", "answer", fake))
+        await asyncio.sleep(0.02)
+        assert endpoint.breaker.state == CircuitBreaker.HALF_OPEN
+        assert not pool.available
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(caller_disconnects())
+
+    assert fake.cancelled == [endpoint.name]
+    assert not endpoint.breaker.trial_in_flight
+    assert pool.available
+    assert endpoint.in_flight == 0
+
+
+def test_simultaneous_win_discards_unused_result():
+    pool = make_pool()
+    enable_hedge(pool, "answer:ttft")
+    discarded = []
+
+    async def discard(result):
+        discarded.append(result)
+
+    async def race():
+        finished = asyncio.Event()
+
+        async def wait_then(value):
+            await finished.wait()
+            return value
+
+        fake = FakeEndpoints(pool, lambda: wait_then("primary"), lambda: wait_then("secondary"))
+        task = asyncio.ensure_future(pool._race("answer", "answer:ttft", fake, discard))
+        # Cả hai attempt (request chính + hedge) xong trong cùng một vòng event loop
+        while len(fake.calls) < 2:
+            await asyncio.sleep(0.005)
+        finished.set()
+        return await task
+
+    result, _ = asyncio.run(race())
+
+    assert len(discarded) == 1
+    assert {result, discarded[0]} == {"primary", "secondary"}
+    assert all(endpoint.in_flight == 0 for endpoint in pool.endpoints)
+    assert pool.counters["cancelled_attempts"] == 0
@@ -0,0 +1,70 @@
+"""
+Các hàm tiện ích xử lý text dùng chung cho cache và phân loại câu hỏi
+"""
+
+import hashlib
+import json
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_TRAILING_PUNCT_RE = re.compile(r"[\s?!.。…]+$")
+_CHUNK_RE = re.compile(r"\S+\s*|\s+")
+
+
+def normalize_question(text: str) -> str:
+    """
+    Chuẩn hóa câu hỏi: Unicode NFC (gộp dấu tiếng Việt tổ hợp), casefold,
+    gộp khoảng trắng và bỏ dấu câu ở cuối
+    """
+    if not text:
+        return ""
+    normalized = unicodedata.normalize("NFC", text).casefold()
+    normalized = _WHITESPACE_RE.sub(" ", normalized).strip()
+    return _TRAILING_PUNCT_RE.sub("", normalized)
+
+
+def strip_diacritics(text: str) -> str:
+    """
+    Bỏ dấu tiếng Việt (kể cả đ/Đ) để so khớp không phân biệt dấu
+    """
+    decomposed = unicodedata.normalize("NFD", text or "")
+    stripped = "".join(ch for ch in decomposed if unicodedata.category(ch) != "Mn")
+    return stripped.replace("đ", "d").replace("Đ", "D")
+
+
+def fold_text(text: str) -> str:
+    """
+    Chuẩn hóa câu hỏi rồi bỏ dấu (dùng cho keyword matching và n-gram)
+    """
+    return strip_diacritics(normalize_question(text))
+
+
+def hash_history(conversation_history: Optional[List[Dict[str, str]]], window: Optional[int] = None) -> str:
+    """
+    Hash của `window` messages gần nhất trong conversation history (mặc định toàn bộ)
+    """
+    if not conversation_history:
+        return "-"
+    recent = conversation_history[-window:] if window else conversation_history
+    payload = [
+        (msg.get("role", "user"), normalize_question(msg.get("content", "")))
+        for msg in recent
+    ]
+    return hash_payload(payload)
+
+
+def hash_payload(payload: Any) -> str:
+    """
+    Hash ổn định (sha1 rút gọn) của một object JSON-serializable
+    """
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def split_stream_chunks(text: str) -> List[str]:
+    """
+    Tách câu trả lời thành các chunk theo từ (giữ nguyên khoảng trắng) để phát lại qua SSE
+    """
+    return _CHUNK_RE.findall(text or "")
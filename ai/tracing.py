@@ -0,0 +1,325 @@
+"""
+Tracing có cấu trúc theo request thay cho log INFO từng bước: mỗi request HTTP là một trace
+(trace ID nhận từ Node qua header X-Trace-Id), các stage (decision, schema, SQL, gọi LLM,
+stream) là span. Ghi nhận span/event chỉ tốn vài phép gán; event giữ nguyên format + tham số
+và chỉ được format khi trace được xuất ra log:
+- trace được lấy mẫu (theo sample rate, quyết định từ trace ID): một dòng JSON các span
+- request chậm hơn ngưỡng: một dòng JSON đầy đủ span + event (slow-request log)
+"""
+
+import json
+import logging
+import re
+import time
+import uuid
+import zlib
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger("trace")
+
+TRACE_HEADER = "x-trace-id"
+# W3C trace context: version-traceid-parentid-flags
+_TRACEPARENT_RE = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-[0-9a-f]{16}-[0-9a-f]{2}$")
+_TRACE_ID_RE = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+
+
+class Span:
+    __slots__ = ("name", "parent", "start", "end", "attrs")
+
+    def __init__(self, name: str, parent: Optional["Span"], start: float, attrs: Dict[str, Any]):
+        self.name = name
+        self.parent = parent
+        self.start = start
+        self.end: Optional[float] = None
+        self.attrs = attrs
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+    def finish(self) -> None:
+        if self.end is None:
+            self.end = time.perf_counter()
+
+
+class Trace:
+    def __init__(self, trace_id: str, name: str, sampled: bool, max_spans: int):
+        self.trace_id = trace_id
+        self.name = name
+        self.sampled = sampled
+        self.max_spans = max_spans
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attrs: Dict[str, Any] = {}
+        self.spans: List[Span] = []
+        self.events: List[Tuple[float, Optional[Span], str, tuple]] = []
+        self.dropped = 0
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def add_span(self, name: str, parent: Optional[Span], attrs: Dict[str, Any]) -> Optional[Span]:
+        if len(self.spans) >= self.max_spans:
+            self.dropped += 1
+            return None
+        span = Span(name, parent, time.perf_counter(), attrs)
+        self.spans.append(span)
+        return span
+
+    def add_event(self, span: Optional[Span], message: str, args: tuple) -> None:
+        if len(self.events) >= self.max_spans:
+            self.dropped += 1
+            return
+        self.events.append((time.perf_counter(), span, message, args))
+
+    def to_dict(self, detail: bool) -> Dict[str, Any]:
+        """
+        detail=True: kèm thuộc tính span và event (được format tại đây)
+        """
+        def ms(value: float) -> float:
+            return round((value - self.start) * 1000, 1)
+
+        index = {id(span): i for i, span in enumerate(self.spans)}
+        spans = []
+        for span in self.spans:
+            item: Dict[str, Any] = {
+                "name": span.name,
+                "start_ms": ms(span.start),
+                "duration_ms": round(((span.end or self.end or time.perf_counter()) - span.start) * 1000, 1),
+            }
+            if span.parent is not None and id(span.parent) in index:
+                item["parent"] = index[id(span.parent)]
+            if span.end is None:
+                item["unfinished"] = True
+            if detail and span.attrs:
+                item["attrs"] = span.attrs
+            spans.append(item)
+        result: Dict[str, Any] = {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "start": round(self.wall_start, 3),
+            "duration_ms": round(self.duration * 1000, 1),
+            **self.attrs,
+            "spans": spans,
+        }
+        if detail:
+            result["events"] = [
+                {"at_ms": ms(at), "span": index.get(id(span)) if span is not None else None, "message": _format(message, args)}
+                for at, span, message, args in self.events
+            ]
+        if self.dropped:
+            result["dropped"] = self.dropped
+        return result
+
+
+def _format(message: str, args: tuple) -> str:
+    try:
+        return message % args if args else message
+    except (TypeError, ValueError):
+        return f"{message} {args!r}"
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.trace_id if trace is not None else None
+
+
+@contextmanager
+def span(name: str, **attrs: Any):
+    """
+    Span con của span hiện tại (dùng trong coroutine; không có trace thì không làm gì)
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    current = trace.add_span(name, _current_span.get(), attrs)
+    if current is None:
+        yield None
+        return
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        current.finish()
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # Reset trong context khác (generator được resume ở task khác)
+            pass
+
+
+def start_span(name: str, **attrs: Any) -> Optional[Span]:
+    """
+    Span không trở thành span hiện tại, kết thúc bằng span.finish() (dùng trong async generator,
+    nơi context có thể khác nhau giữa các lần resume)
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    return trace.add_span(name, _current_span.get(), attrs)
+
+
+def annotate(**attrs: Any) -> None:
+    """
+    Gắn thuộc tính vào span hiện tại (hoặc vào trace nếu chưa có span)
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    current = _current_span.get()
+    if current is not None:
+        current.attrs.update(attrs)
+    else:
+        trace.attrs.update(attrs)
+
+
+def event(message: str, *args: Any) -> None:
+    """
+    Event chi tiết (có thể chứa nội dung câu hỏi / SQL): chỉ format và ghi ra
+    trong slow-request log
+    """
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_event(_current_span.get(), message, args)
+
+
+class Tracer:
+    """
+    Tạo / kết thúc trace và quyết định trace nào được ghi ra log
+    """
+
+    def __init__(self, sample_rate: float = 0.01, slow_threshold: float = 5.0, keep_slow: int = 50,
+                 max_spans: int = 200):
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+        self.slow_threshold = slow_threshold
+        self.max_spans = max_spans
+        self.recent_slow: Deque[Dict[str, Any]] = deque(maxlen=keep_slow)
+        self.counters = {"traces": 0, "sampled": 0, "slow": 0, "propagated": 0}
+
+    @staticmethod
+    def trace_id_from_headers(headers: Iterable[Tuple[bytes, bytes]]) -> Optional[str]:
+        traceparent = None
+        for name, value in headers:
+            name = name.lower()
+            if name == TRACE_HEADER.encode():
+                candidate = value.decode("latin-1").strip()
+                if _TRACE_ID_RE.match(candidate):
+                    return candidate
+            elif name == b"traceparent":
+                traceparent = value.decode("latin-1").strip()
+        if traceparent:
+            match = _TRACEPARENT_RE.match(traceparent)
+            if match:
+                return match.group(1)
+        return None
+
+    def is_sampled(self, trace_id: str) -> bool:
+        """
+        Quyết định theo trace ID (không random) để mọi worker / lần retry của cùng một trace
+        cho cùng kết quả
+        """
+        if self.sample_rate >= 1.0:
+            return True
+        if self.sample_rate <= 0.0:
+            return False
+        return zlib.crc32(trace_id.encode("utf-8")) % 10000 < self.sample_rate * 10000
+
+    def begin(self, name: str, trace_id: Optional[str] = None):
+        """
+        Bắt đầu trace và đặt làm trace hiện tại, trả về (trace, token để reset context)
+        """
+        if trace_id:
+            self.counters["propagated"] += 1
+        trace_id = trace_id or uuid.uuid4().hex
+        trace = Trace(trace_id, name, self.is_sampled(trace_id), self.max_spans)
+        self.counters["traces"] += 1
+        return trace, (_current_trace.set(trace), _current_span.set(None))
+
+    def finish(self, trace: Trace, tokens=None) -> None:
+        trace.end = time.perf_counter()
+        if tokens is not None:
+            for var, token in zip((_current_trace, _current_span), tokens):
+                try:
+                    var.reset(token)
+                except ValueError:
+                    pass
+        if trace.duration >= self.slow_threshold:
+            self.counters["slow"] += 1
+            # Bản giữ trong bộ nhớ (trả qua HTTP) chỉ có thời gian các span, không có event/thuộc tính
+            # (event chứa câu hỏi, SQL); chi tiết đầy đủ chỉ nằm trong log
+            self.recent_slow.append(trace.to_dict(detail=False))
+            logger.warning("slow request %s", _JSONLine(trace.to_dict(detail=True)))
+        elif trace.sampled:
+            self.counters["sampled"] += 1
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("trace %s", _JSONLine(trace.to_dict(detail=False)))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "sample_rate": self.sample_rate,
+            "slow_threshold_seconds": self.slow_threshold,
+            "recent_slow": len(self.recent_slow),
+        }
+
+
+class _JSONLine:
+    """
+    JSON chỉ được serialize khi handler thực sự ghi bản ghi log
+    """
+    __slots__ = ("payload",)
+
+    def __init__(self, payload: Dict[str, Any]):
+        self.payload = payload
+
+    def __str__(self) -> str:
+        return json.dumps(self.payload, ensure_ascii=False, default=str)
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware: một trace cho mỗi request tới các endpoint được theo dõi (kéo dài tới khi
+    body stream gửi xong), trả trace ID về client qua header X-Trace-Id
+    """
+
+    def __init__(self, app, tracer: Tracer, endpoints: Iterable[str]):
+        self.app = app
+        self.tracer = tracer
+        self.endpoints = set(endpoints)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path") not in self.endpoints:
+            await self.app(scope, receive, send)
+            return
+        trace, tokens = self.tracer.begin(scope["path"], self.tracer.trace_id_from_headers(scope.get("headers", [])))
+        header = (TRACE_HEADER.encode(), trace.trace_id.encode("latin-1"))
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                trace.attrs["status"] = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), header]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace)
+        except BaseException as e:
+            trace.attrs["error"] = type(e).__name__
+            raise
+        finally:
+            self.tracer.finish(trace, tokens)
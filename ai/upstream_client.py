@@ -0,0 +1,409 @@
+"""
+Client upstream LLM chịu lỗi: deadline theo stage, hedged request (gửi bản sao khi request chính
+chậm hơn percentile latency, hủy bản thua), circuit breaker theo endpoint (fail fast khi upstream lỗi)
+và pool nhiều base URL/API key cân bằng theo latency quan sát được
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import httpx
+from openai import APIConnectionError, AsyncOpenAI, InternalServerError, RateLimitError
+
+logger = logging.getLogger(__name__)
+
+# Hệ số EWMA cho latency của endpoint
+LATENCY_ALPHA = 0.2
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class UpstreamTimeout(UpstreamError):
+    pass
+
+
+class CircuitOpenError(UpstreamError):
+    pass
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """
+    Lỗi do upstream (kết nối, timeout, 5xx, 429) - được failover/hedge và tính vào circuit breaker;
+    lỗi 4xx khác do chính request nên không thử lại
+    """
+    return isinstance(error, (APIConnectionError, InternalServerError, RateLimitError, UpstreamTimeout))
+
+
+def parse_endpoints(value: str, default_url: str, default_key: Optional[str]) -> List[Tuple[str, Optional[str]]]:
+    """
+    "url1|key1,url2|key2" -> [(url, key)]; thiếu key thì dùng key mặc định
+    """
+    endpoints = []
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        url, _, key = item.partition("|")
+        endpoints.append((url.strip(), key.strip() or default_key))
+    return endpoints or [(default_url, default_key)]
+
+
+def parse_stage_timeouts(value: str) -> Dict[str, float]:
+    """
+    "decision=5,answer=60" -> {"decision": 5.0, "answer": 60.0}
+    """
+    timeouts = {}
+    for item in (value or "").split(","):
+        stage, _, seconds = item.partition("=")
+        if stage.strip() and seconds.strip():
+            timeouts[stage.strip()] = float(seconds)
+    return timeouts
+
+
+class CircuitBreaker:
+    """
+    closed -> open sau `failure_threshold` lỗi liên tiếp; sau `reset_timeout` chuyển half-open
+    và cho một request thử, thành công thì đóng lại
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.opened_count = 0
+
+    def available(self) -> bool:
+        if self.state == self.OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_timeout
+        if self.state == self.HALF_OPEN:
+            return not self.trial_in_flight
+        return True
+
+    def acquire(self) -> None:
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            self.trial_in_flight = True
+
+    def success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trial_in_flight = False
+
+    def release(self) -> None:
+        """
+        Request thử bị hủy hoặc lỗi không do upstream: trả lượt thử, không tính thành công hay lỗi
+        """
+        self.trial_in_flight = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opened_count += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class Endpoint:
+    """
+    Một base URL/API key upstream với latency EWMA theo stage và circuit breaker riêng
+    """
+
+    def __init__(self, name: str, client: AsyncOpenAI, breaker: CircuitBreaker):
+        self.name = name
+        self.client = client
+        self.breaker = breaker
+        self.latency: Dict[str, float] = {}
+        self.in_flight = 0
+        self.counters = {"requests": 0, "successes": 0, "failures": 0, "timeouts": 0, "cancelled": 0}
+
+    def score(self, key: str) -> float:
+        # Endpoint chưa có số liệu được thử trước (latency 0)
+        return self.latency.get(key, 0.0) * (1 + self.in_flight)
+
+    def observe(self, key: str, seconds: float) -> None:
+        previous = self.latency.get(key)
+        self.latency[key] = seconds if previous is None else previous + LATENCY_ALPHA * (seconds - previous)
+
+
+def _endpoint_name(url: str, index: int) -> str:
+    return f"{index}:{urlparse(url).netloc or url}"
+
+
+class UpstreamPool:
+    """
+    Pool endpoint OpenAI-compatible; mỗi lần gọi tối đa 2 attempt (request chính + hedge/failover)
+    """
+
+    max_attempts = 2
+
+    def __init__(self, endpoints: List[Tuple[str, Optional[str]]], http_client: httpx.AsyncClient,
+                 stage_timeouts: Optional[Dict[str, float]] = None, default_timeout: float = 60.0,
+                 hedge_enabled: bool = True, hedge_percentile: float = 95.0, hedge_min_delay: float = 0.5,
+                 hedge_min_samples: int = 20, hedge_max_ratio: float = 0.1,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0, window: int = 200):
+        self.endpoints = [
+            Endpoint(
+                _endpoint_name(url, index),
+                # Không retry trong SDK: failover/hedge do pool quyết định trong deadline của stage
+                AsyncOpenAI(base_url=url, api_key=key, http_client=http_client, max_retries=0),
+                CircuitBreaker(failure_threshold, reset_timeout),
+            )
+            for index, (url, key) in enumerate(endpoints)
+        ]
+        self.stage_timeouts = dict(stage_timeouts or {})
+        self.default_timeout = default_timeout
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_max_ratio = hedge_max_ratio
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self.counters = {
+            "calls": 0, "hedges": 0, "hedge_wins": 0, "failovers": 0,
+            "timeouts": 0, "circuit_rejected": 0, "cancelled_attempts": 0,
+        }
+
+    @property
+    def available(self) -> bool:
+        """
+        Còn ít nhất một endpoint nhận request (circuit không mở)
+        """
+        return any(endpoint.breaker.available() for endpoint in self.endpoints)
+
+    def timeout(self, stage: str) -> float:
+        return self.stage_timeouts.get(stage, self.default_timeout)
+
+    def hedge_delay(self, key: str) -> Optional[float]:
+        """
+        Thời điểm gửi hedge: percentile latency gần đây của stage (chưa đủ mẫu thì không hedge)
+        """
+        samples = self._samples.get(key)
+        if not self.hedge_enabled or not samples or len(samples) < self.hedge_min_samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile / 100.0))
+        return max(self.hedge_min_delay, ordered[index])
+
+    def _hedge_allowed(self) -> bool:
+        return self.counters["hedges"] < max(1, self.counters["calls"]) * self.hedge_max_ratio
+
+    def _pick(self, key: str, tried: List[Endpoint]) -> Optional[Endpoint]:
+        """
+        Endpoint có latency thấp nhất trong số endpoint chưa thử; pool một endpoint thì hedge vào chính nó
+        """
+        candidates = [endpoint for endpoint in self.endpoints if endpoint.breaker.available()]
+        fresh = [endpoint for endpoint in candidates if endpoint not in tried]
+        candidates = fresh or candidates
+        if not candidates:
+            return None
+        return min(candidates, key=lambda endpoint: endpoint.score(key))
+
+    def _succeeded(self, endpoint: Endpoint, key: str, seconds: float) -> None:
+        endpoint.breaker.success()
+        endpoint.counters["successes"] += 1
+        endpoint.observe(key, seconds)
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = self._samples[key] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def _failed(self, endpoint: Endpoint, timeout: bool = False) -> None:
+        endpoint.breaker.failure()
+        endpoint.counters["timeouts" if timeout else "failures"] += 1
+        if endpoint.breaker.state == CircuitBreaker.OPEN:
+            logger.warning("Upstream endpoint %s circuit open after %d failures", endpoint.name, endpoint.breaker.failures)
+
+    @staticmethod
+    async def _discard(discard: Optional[Callable[[Any], Awaitable[None]]], result: Any) -> None:
+        if discard is None:
+            return
+        try:
+            await discard(result)
+        except Exception as e:
+            logger.debug("Failed to close unused upstream result: %s", e)
+
+    async def _race(self, stage: str, key: str, attempt: Callable[[Endpoint], Awaitable[Any]],
+                    discard: Optional[Callable[[Any], Awaitable[None]]] = None) -> Tuple[Any, Endpoint]:
+        """
+        Chạy attempt trên endpoint tốt nhất; chậm hơn hedge delay thì gửi thêm bản sao tới endpoint khác,
+        lỗi upstream thì failover ngay; attempt thắng trước được dùng, attempt còn lại bị hủy.
+        Kết quả thành công không được dùng (nhiều attempt xong cùng lúc) được đóng bằng `discard`
+        """
+        self.counters["calls"] += 1
+        timeout = self.timeout(stage)
+        started = time.monotonic()
+        deadline = started + timeout
+        delay = self.hedge_delay(key)
+        hedge_at = started + delay if delay is not None else None
+        tasks: Dict[asyncio.Task, Tuple[Endpoint, float]] = {}
+        tried: List[Endpoint] = []
+        last_error: Optional[BaseException] = None
+
+        def launch() -> bool:
+            endpoint = self._pick(key, tried)
+            if endpoint is None:
+                return False
+            endpoint.breaker.acquire()
+            endpoint.in_flight += 1
+            endpoint.counters["requests"] += 1
+            tried.append(endpoint)
+            tasks[asyncio.ensure_future(attempt(endpoint))] = (endpoint, time.monotonic())
+            return True
+
+        if not launch():
+            self.counters["circuit_rejected"] += 1
+            raise CircuitOpenError("All upstream endpoints are unavailable (circuit open)")
+
+        try:
+            while tasks:
+                now = time.monotonic()
+                if now >= deadline:
+                    self.counters["timeouts"] += 1
+                    for endpoint, _ in tasks.values():
+                        self._failed(endpoint, timeout=True)
+                    raise UpstreamTimeout(f"{stage} exceeded {timeout:.1f}s deadline")
+
+                wake = deadline
+                if hedge_at is not None and len(tried) < self.max_attempts:
+                    wake = min(wake, max(hedge_at, now))
+                done, _ = await asyncio.wait(list(tasks), timeout=wake - now, return_when=asyncio.FIRST_COMPLETED)
+
+                winner: Optional[Tuple[Any, Endpoint]] = None
+                fatal: Optional[BaseException] = None
+                for task in done:
+                    endpoint, launched_at = tasks.pop(task)
+                    endpoint.in_flight -= 1
+                    error = task.exception()
+                    if error is None:
+                        self._succeeded(endpoint, key, time.monotonic() - launched_at)
+                        if winner is None:
+                            winner = (task.result(), endpoint)
+                        else:
+                            await self._discard(discard, task.result())
+                        continue
+                    last_error = error
+                    if not is_upstream_failure(error):
+                        endpoint.breaker.release()
+                        fatal = fatal or error
+                        continue
+                    self._failed(endpoint)
+                if winner is not None:
+                    if len(tried) > 1 and winner[1] is not tried[0]:
+                        self.counters["hedge_wins"] += 1
+                    return winner
+                if fatal is not None:
+                    raise fatal
+
+                if len(tried) >= self.max_attempts:
+                    hedge_at = None
+                    continue
+                if not tasks:
+                    # Request chính lỗi: failover ngay (còn trong deadline)
+                    self.counters["failovers"] += 1
+                    if not launch():
+                        break
+                elif hedge_at is not None and time.monotonic() >= hedge_at:
+                    if self._hedge_allowed() and launch():
+                        self.counters["hedges"] += 1
+                    hedge_at = None
+
+            if last_error is not None:
+                raise last_error
+            self.counters["circuit_rejected"] += 1
+            raise CircuitOpenError("All upstream endpoints are unavailable (circuit open)")
+        finally:
+            for task, (endpoint, _) in tasks.items():
+                if task.done() and not task.cancelled() and task.exception() is None:
+                    # Xong sau lượt wait cuối nhưng không được dùng
+                    await self._discard(discard, task.result())
+                task.cancel()
+                # Attempt bị hủy có thể là request thử half-open: trả lượt thử để endpoint dùng lại được
+                endpoint.breaker.release()
+                endpoint.in_flight -= 1
+                endpoint.counters["cancelled"] += 1
+                self.counters["cancelled_attempts"] += 1
+
+    async def create(self, stage: str, **kwargs) -> Any:
+        """
+        Chat completion (non-streaming) với deadline, hedge và failover
+        """
+        async def attempt(endpoint: Endpoint):
+            return await endpoint.client.chat.completions.create(**kwargs)
+
+        completion, _ = await self._race(stage, stage, attempt)
+        return completion
+
+    async def stream(self, stage: str, **kwargs) -> AsyncIterator[Any]:
+        """
+        Chat completion streaming; deadline và hedge áp dụng tới chunk đầu tiên
+        (sau đó stream tiếp tục trên endpoint đã thắng)
+        """
+        async def attempt(endpoint: Endpoint):
+            stream = await endpoint.client.chat.completions.create(stream=True, **kwargs)
+            try:
+                iterator = stream.__aiter__()
+                try:
+                    first = [await iterator.__anext__()]
+                except StopAsyncIteration:
+                    first = []
+                return stream, iterator, first
+            except BaseException:
+                # Attempt thua bị hủy: đóng kết nối stream
+                await stream.close()
+                raise
+
+        async def discard(result) -> None:
+            await result[0].close()
+
+        (stream, iterator, first), endpoint = await self._race(stage, f"{stage}:ttft", attempt, discard)
+        endpoint.in_flight += 1
+        try:
+            for chunk in first:
+                yield chunk
+            async for chunk in iterator:
+                yield chunk
+        except Exception as e:
+            if is_upstream_failure(e):
+                self._failed(endpoint)
+            raise
+        finally:
+            endpoint.in_flight -= 1
+            await stream.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "available": self.available,
+            "hedge_delays": {
+                key: round(delay, 3) for key in sorted(self._samples)
+                for delay in [self.hedge_delay(key)] if delay is not None
+            },
+            "endpoints": [
+                {
+                    "name": endpoint.name,
+                    "circuit": endpoint.breaker.state,
+                    "circuit_opened": endpoint.breaker.opened_count,
+                    "in_flight": endpoint.in_flight,
+                    "latency_ms": {key: round(value * 1000, 1) for key, value in sorted(endpoint.latency.items())},
+                    **endpoint.counters,
+                }
+                for endpoint in self.endpoints
+            ],
+        }
@@ -0,0 +1,118 @@
+"""
+Trạng thái sức khỏe của upstream LLM cho readiness probe: probe nền định kỳ (GET /models,
+không tốn token) kết hợp kết quả của các lần gọi LLM thật, probe endpoint chỉ đọc trạng thái đã cache
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamHealth:
+    """
+    Cache kết quả kiểm tra upstream; các lần gọi LLM thật cũng cập nhật trạng thái,
+    nên probe nền chỉ chạy khi không có traffic gần đây
+    """
+
+    def __init__(self, http_client: httpx.AsyncClient, base_url: str, api_key: Optional[str] = None,
+                 interval: float = 30.0, timeout: float = 5.0, failure_threshold: int = 3):
+        self.http_client = http_client
+        self.url = f"{base_url.rstrip('/')}/models"
+        self.api_key = api_key
+        self.interval = interval
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+
+        self.last_success: Optional[float] = None
+        self.last_failure: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.last_probe_latency: Optional[float] = None
+        self.consecutive_failures = 0
+        self.counters = {"probes": 0, "probe_failures": 0, "passive_successes": 0, "passive_failures": 0}
+        self._task: Optional[asyncio.Task] = None
+
+    def record_success(self) -> None:
+        self.last_success = time.monotonic()
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.counters["passive_successes"] += 1
+
+    def record_failure(self, error: BaseException) -> None:
+        self._failed(str(error) or type(error).__name__)
+        self.counters["passive_failures"] += 1
+
+    def _failed(self, error: str) -> None:
+        self.last_failure = time.monotonic()
+        self.consecutive_failures += 1
+        self.last_error = error
+
+    @property
+    def checked(self) -> bool:
+        return self.last_success is not None or self.last_failure is not None
+
+    @property
+    def healthy(self) -> bool:
+        """
+        Upstream được coi là sẵn sàng khi đã kiểm tra ít nhất một lần và chưa lỗi liên tiếp quá ngưỡng
+        """
+        return self.checked and self.consecutive_failures < self.failure_threshold
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._probe_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _probe_loop(self) -> None:
+        while True:
+            last_seen = max(self.last_success or 0.0, self.last_failure or 0.0)
+            # Có kết quả từ request thật gần đây thì không cần probe
+            if not self.checked or self.last_error or time.monotonic() - last_seen >= self.interval:
+                await self.probe()
+            await asyncio.sleep(self.interval)
+
+    async def probe(self) -> bool:
+        """
+        Một lần probe chủ động: liệt kê model (không sinh completion)
+        """
+        self.counters["probes"] += 1
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        started = time.perf_counter()
+        try:
+            response = await self.http_client.get(self.url, headers=headers, timeout=self.timeout)
+            if response.status_code >= 400:
+                raise RuntimeError(f"status {response.status_code}")
+        except Exception as e:
+            self.counters["probe_failures"] += 1
+            self._failed(str(e) or type(e).__name__)
+            logger.warning("Upstream probe failed (%d consecutive): %s", self.consecutive_failures, self.last_error)
+            return False
+        finally:
+            self.last_probe_latency = time.perf_counter() - started
+        self.last_success = time.monotonic()
+        self.consecutive_failures = 0
+        self.last_error = None
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            **self.counters,
+            "healthy": self.healthy,
+            "consecutive_failures": self.consecutive_failures,
+            "last_success_seconds_ago": round(now - self.last_success, 1) if self.last_success else None,
+            "last_probe_latency_ms": round(self.last_probe_latency * 1000, 1) if self.last_probe_latency else None,
+            "last_error": self.last_error,
+        }
@@ -1,4 +1,5 @@
 const axios = require('axios');
+const crypto = require('crypto');
 const { Readable } = require('stream');
 const SQLExecutor = require('../services/sqlExecutor');
 const DatabaseSchemaService = require('../services/databaseSchemaService');
@@ -11,6 +12,23 @@ const DatabaseSchemaService = require('../services/databaseSchemaService');
 // Cấu hình Python AI service URL
 const PYTHON_AI_API_URL = process.env.PYTHON_AI_API_URL || 'http://localhost:8000';
 
+/**
+ * Trace ID của request: dùng lại X-Trace-Id / X-Request-Id từ client nếu hợp lệ, không thì tạo mới.
+ * Gửi kèm mọi lời gọi sang Python AI service để log hai bên nối được với nhau
+ */
+const getTraceId = (req) => {
+  const incoming = req.get('x-trace-id') || req.get('x-request-id');
+  if (incoming && /^[A-Za-z0-9._:-]{1,64}$/.test(incoming)) {
+    return incoming;
+  }
+  return crypto.randomUUID().replace(/-/g, '');
+};
+
+const aiHeaders = (traceId) => ({
+  'Content-Type': 'application/json',
+  'X-Trace-Id': traceId
+});
+
 /**
  * Gửi câu hỏi cho AI và nhận phản hồi
  * POST /api/v1/chat-ai/ask
@@ -37,16 +55,17 @@ const askAI = async (req, res) => {
       });
     }
 
-    // Log request để monitoring
-    console.log(`[ChatAI] Received question: ${question.substring(0, 100)}${question.length > 100 ? '...' : ''}`);
+    const traceId = getTraceId(req);
+    res.setHeader('X-Trace-Id', traceId);
+
+    // Log request để monitoring (không log nội dung câu hỏi / history)
+    console.log(`[ChatAI] trace=${traceId} question received (${question.length} chars)`);
 
     const userId = req.user?.id || null;
 
     // Lấy conversation history từ request (nếu có)
     const conversationHistory = req.body.conversation_history || null;
     
-    console.log(`[ChatAI] Raw conversation_history from request:`, conversationHistory ? JSON.stringify(conversationHistory, null, 2) : 'null');
-    
     // Gọi Python AI service với decision layer
     const requestBody = {
       question: question.trim()
@@ -58,26 +77,14 @@ const askAI = async (req, res) => {
         role: msg.role || (msg.isUser ? 'user' : 'assistant'),
         content: msg.text || msg.content || msg.message || ''
       })).filter(msg => msg.content.trim().length > 0);
-      
-      console.log(`[ChatAI] Processed conversation_history (${requestBody.conversation_history.length} messages):`, JSON.stringify(requestBody.conversation_history, null, 2));
-    } else {
-      console.log(`[ChatAI] No conversation history to send (received: ${conversationHistory ? 'empty array' : 'null'})`);
     }
     
     const aiResponse = await axios.post(`${PYTHON_AI_API_URL}/ask`, requestBody, {
       timeout: 30000, // 30 seconds timeout
-      headers: {
-        'Content-Type': 'application/json'
-      }
+      headers: aiHeaders(traceId)
     });
 
-    // Log response từ Python để debug
-    console.log(`[ChatAI] Python response:`, JSON.stringify({
-      requires_sql: aiResponse.data.requires_sql,
-      has_sql: !!aiResponse.data.sql,
-      sql_preview: aiResponse.data.sql ? aiResponse.data.sql.substring(0, 100) : null,
-      data_source: aiResponse.data.data_source
-    }));
+    console.log(`[ChatAI] trace=${traceId} Python response: requires_sql=${!!aiResponse.data.requires_sql}, data_source=${aiResponse.data.data_source}`);
 
     // Kiểm tra xem AI có trả về SQL không
     let finalAnswer = aiResponse.data.answer;
@@ -87,7 +94,6 @@ const askAI = async (req, res) => {
 
     // Nếu AI trả về SQL, thực thi và format kết quả
     if (aiResponse.data.requires_sql && aiResponse.data.sql) {
-      console.log(`[ChatAI] AI generated SQL, executing: ${aiResponse.data.sql}`);
       
       try {
         // Thực thi SQL query
@@ -115,15 +121,11 @@ const askAI = async (req, res) => {
                 role: msg.role || (msg.isUser ? 'user' : 'assistant'),
                 content: msg.text || msg.content || msg.message || ''
               })).filter(msg => msg.content.trim().length > 0);
-              
-              console.log(`[ChatAI] Sending conversation_history to format-answer: ${formatRequestBody.conversation_history.length} messages`);
             }
             
             const formattedResponse = await axios.post(`${PYTHON_AI_API_URL}/format-answer`, formatRequestBody, {
               timeout: 15000,
-              headers: {
-                'Content-Type': 'application/json'
-              }
+              headers: aiHeaders(traceId)
             });
 
             finalAnswer = formattedResponse.data.answer || formattedData;
@@ -167,7 +169,7 @@ const askAI = async (req, res) => {
       timestamp: new Date().toISOString()
     };
 
-    console.log(`[ChatAI] Response sent successfully (source: ${dataSource})`);
+    console.log(`[ChatAI] trace=${traceId} response sent (source: ${dataSource})`);
     return res.status(200).json(formattedResponse);
 
   } catch (error) {
@@ -254,7 +256,8 @@ const checkHealth = async (req, res) => {
       success: false,
       data: {
         status: 'unhealthy',
-        ai_service: {
+        // AI service trả 503 kèm trạng thái readiness (upstream, schema) khi chưa sẵn sàng
+        ai_service: error.response?.data || {
           status: 'unavailable',
           error: error.message
         },
@@ -336,16 +339,101 @@ const getQuickQuestions = async (req, res) => {
   }
 };
 
+/**
+ * Stream một câu trả lời đã có sẵn về frontend theo từng từ, kết thúc bằng event done
+ */
+const streamAnswerText = async (res, text) => {
+  const answerChunks = text.split(' ');
+  for (let i = 0; i < answerChunks.length; i++) {
+    const chunk = (i === 0 ? '' : ' ') + answerChunks[i];
+    const data = JSON.stringify({
+      type: 'chunk',
+      content: chunk
+    }, { ensureAscii: false });
+    res.write(`data: ${data}\n\n`);
+    
+    // Small delay để tạo hiệu ứng streaming
+    await new Promise(resolve => setTimeout(resolve, 30));
+  }
+  
+  // Gửi signal kết thúc
+  res.write(`data: ${JSON.stringify({ type: 'done' }, { ensureAscii: false })}\n\n`);
+  res.end();
+};
+
+/**
+ * Thực thi SQL do Python sinh ra, gửi kết quả về Python để format rồi stream câu trả lời
+ */
+const streamSqlAnswer = async (res, { question, sql, queryInfo, conversationHistory, userId, traceId }) => {
+  try {
+    // Thực thi SQL query
+    const queryResult = await SQLExecutor.executeQuery(sql, {
+      timeout: 10000,
+      maxRows: 100,
+      userId: userId
+    });
+
+    if (!queryResult.success) {
+      // SQL execution failed
+      console.warn('[ChatAI Stream] SQL execution failed:', queryResult.error);
+      return streamAnswerText(res, 'Xin lỗi, tôi không thể truy vấn dữ liệu lúc này.');
+    }
+
+    // Format kết quả query
+    const formattedData = SQLExecutor.formatResult(queryResult);
+
+    // Gửi kết quả về Python để format lại câu trả lời
+    try {
+      const formatRequestBody = {
+        question,
+        query_result: queryResult.data,
+        query_info: queryInfo
+      };
+      
+      // Thêm conversation history nếu có
+      if (conversationHistory && conversationHistory.length > 0) {
+        formatRequestBody.conversation_history = conversationHistory;
+      }
+      
+      // Python stream câu trả lời đã format theo cùng định dạng SSE (chunk..., done)
+      const formattedStream = await axios.post(`${PYTHON_AI_API_URL}/format-answer-stream`, formatRequestBody, {
+        timeout: 15000,
+        responseType: 'stream',
+        headers: aiHeaders(traceId)
+      });
+
+      return await new Promise((resolve) => {
+        formattedStream.data.on('data', (chunk) => {
+          res.write(chunk);
+        });
+        formattedStream.data.on('end', () => {
+          res.end();
+          resolve();
+        });
+        formattedStream.data.on('error', (streamError) => {
+          console.error('[ChatAI Stream] Format stream error:', streamError.message);
+          res.write(`data: ${JSON.stringify({ type: 'error', content: 'Xin lỗi, có lỗi xảy ra khi format câu trả lời.' })}\n\n`);
+          res.end();
+          resolve();
+        });
+      });
+    } catch (formatError) {
+      console.warn('[ChatAI Stream] Error formatting answer, using direct format:', formatError.message);
+      // Fallback: stream formatted data trực tiếp
+      return streamAnswerText(res, `Dựa trên dữ liệu từ hệ thống:\n\n${formattedData}`);
+    }
+  } catch (sqlError) {
+    console.error('[ChatAI Stream] SQL execution error:', sqlError.message);
+    return streamAnswerText(res, 'Xin lỗi, có lỗi xảy ra khi truy vấn dữ liệu.');
+  }
+};
+
 /**
  * Gửi câu hỏi cho AI và nhận streaming response
  * POST /api/v1/chat-ai/ask-stream
  */
 const askAIStream = async (req, res) => {
   try {
-    // Log toàn bộ request body để debug
-    console.log(`[ChatAI Stream] Full request body keys:`, Object.keys(req.body || {}));
-    console.log(`[ChatAI Stream] Request body:`, JSON.stringify(req.body, null, 2));
-    
     const { question } = req.body;
 
     // Validation
@@ -366,8 +454,10 @@ const askAIStream = async (req, res) => {
       });
     }
 
-    // Log request để monitoring
-    console.log(`[ChatAI] Received streaming question: ${question.substring(0, 100)}${question.length > 100 ? '...' : ''}`);
+    const traceId = getTraceId(req);
+
+    // Log request để monitoring (không log nội dung câu hỏi / history)
+    console.log(`[ChatAI Stream] trace=${traceId} question received (${question.length} chars)`);
 
     const userId = req.user?.id || null;
 
@@ -376,18 +466,13 @@ const askAIStream = async (req, res) => {
     res.setHeader('Cache-Control', 'no-cache');
     res.setHeader('Connection', 'keep-alive');
     res.setHeader('X-Accel-Buffering', 'no'); // Disable buffering for nginx
+    res.setHeader('X-Trace-Id', traceId);
 
     try {
       // Lấy conversation history từ request (nếu có)
       const conversationHistory = req.body.conversation_history || null;
       
-      console.log(`[ChatAI Stream] Conversation history received: ${conversationHistory ? conversationHistory.length : 0} messages`);
-      if (conversationHistory && conversationHistory.length > 0) {
-        console.log(`[ChatAI Stream] First message: ${JSON.stringify(conversationHistory[0])}`);
-        console.log(`[ChatAI Stream] Last message: ${JSON.stringify(conversationHistory[conversationHistory.length - 1])}`);
-      }
-      
-      // Bước 1: Gọi Python AI service với /ask (non-streaming) để check SQL
+      // Gọi Python AI service một lần: pipeline đầy đủ (decision, SQL, trả lời) qua một kết nối SSE
       const requestBody = {
         question: question.trim()
       };
@@ -398,178 +483,65 @@ const askAIStream = async (req, res) => {
           role: msg.role || (msg.isUser ? 'user' : 'assistant'),
           content: msg.text || msg.content || msg.message || ''
         })).filter(msg => msg.content && msg.content.trim().length > 0);
-        
-        console.log(`[ChatAI Stream] Sending ${requestBody.conversation_history.length} messages to Python`);
-      } else {
-        console.log(`[ChatAI Stream] No conversation history to send`);
-      }
-      
-      const aiResponse = await axios.post(`${PYTHON_AI_API_URL}/ask`, requestBody, {
-        timeout: 30000,
-        headers: {
-          'Content-Type': 'application/json'
-        }
-      });
-
-      console.log(`[ChatAI Stream] Python response:`, JSON.stringify({
-        requires_sql: aiResponse.data.requires_sql,
-        has_sql: !!aiResponse.data.sql,
-        sql_preview: aiResponse.data.sql ? aiResponse.data.sql.substring(0, 100) : null
-      }));
-
-      // Bước 2: Nếu có SQL, thực thi và stream kết quả
-      if (aiResponse.data.requires_sql && aiResponse.data.sql) {
-        console.log(`[ChatAI Stream] Executing SQL: ${aiResponse.data.sql}`);
-        
-        try {
-          // Thực thi SQL query
-          const queryResult = await SQLExecutor.executeQuery(aiResponse.data.sql, {
-            timeout: 10000,
-            maxRows: 100,
-            userId: userId
-          });
-
-          if (queryResult.success) {
-            // Format kết quả query
-            const formattedData = SQLExecutor.formatResult(queryResult);
-            
-            // Gửi kết quả về Python để format lại câu trả lời
-            try {
-              const formatRequestBody = {
-                question: question.trim(),
-                query_result: queryResult.data,
-                query_info: aiResponse.data.query_info
-              };
-              
-              // Thêm conversation history nếu có
-              if (conversationHistory && Array.isArray(conversationHistory) && conversationHistory.length > 0) {
-                formatRequestBody.conversation_history = conversationHistory.map(msg => ({
-                  role: msg.role || (msg.isUser ? 'user' : 'assistant'),
-                  content: msg.text || msg.content || msg.message || ''
-                })).filter(msg => msg.content.trim().length > 0);
-              }
-              
-              const formattedResponse = await axios.post(`${PYTHON_AI_API_URL}/format-answer`, formatRequestBody, {
-                timeout: 15000,
-                headers: {
-                  'Content-Type': 'application/json'
-                }
-              });
-
-              const finalAnswer = formattedResponse.data.answer || formattedData;
-              
-              // Stream kết quả về frontend
-              const answerChunks = finalAnswer.split(' ');
-              for (let i = 0; i < answerChunks.length; i++) {
-                const chunk = (i === 0 ? '' : ' ') + answerChunks[i];
-                const data = JSON.stringify({
-                  type: 'chunk',
-                  content: chunk
-                }, { ensureAscii: false });
-                res.write(`data: ${data}\n\n`);
-                
-                // Small delay để tạo hiệu ứng streaming
-                await new Promise(resolve => setTimeout(resolve, 30));
-              }
-              
-              // Gửi signal kết thúc
-              res.write(`data: ${JSON.stringify({ type: 'done' }, { ensureAscii: false })}\n\n`);
-              res.end();
-              console.log(`[ChatAI Stream] SQL query completed and streamed`);
-              return;
-              
-            } catch (formatError) {
-              console.warn('[ChatAI Stream] Error formatting answer, using direct format:', formatError.message);
-              // Fallback: stream formatted data trực tiếp
-              const finalAnswer = `Dựa trên dữ liệu từ hệ thống:\n\n${formattedData}`;
-              const answerChunks = finalAnswer.split(' ');
-              for (let i = 0; i < answerChunks.length; i++) {
-                const chunk = (i === 0 ? '' : ' ') + answerChunks[i];
-                const data = JSON.stringify({
-                  type: 'chunk',
-                  content: chunk
-                }, { ensureAscii: false });
-                res.write(`data: ${data}\n\n`);
-                await new Promise(resolve => setTimeout(resolve, 30));
-              }
-              res.write(`data: ${JSON.stringify({ type: 'done' }, { ensureAscii: false })}\n\n`);
-              res.end();
-              return;
-            }
-          } else {
-            // SQL execution failed, fallback to AI answer
-            console.warn('[ChatAI Stream] SQL execution failed:', queryResult.error);
-            const fallbackAnswer = `Xin lỗi, tôi không thể truy vấn dữ liệu lúc này. ${aiResponse.data.answer}`;
-            const answerChunks = fallbackAnswer.split(' ');
-            for (let i = 0; i < answerChunks.length; i++) {
-              const chunk = (i === 0 ? '' : ' ') + answerChunks[i];
-              const data = JSON.stringify({
-                type: 'chunk',
-                content: chunk
-              }, { ensureAscii: false });
-              res.write(`data: ${data}\n\n`);
-              await new Promise(resolve => setTimeout(resolve, 30));
-            }
-            res.write(`data: ${JSON.stringify({ type: 'done' }, { ensureAscii: false })}\n\n`);
-            res.end();
-            return;
-          }
-        } catch (sqlError) {
-          console.error('[ChatAI Stream] SQL execution error:', sqlError.message);
-          const errorAnswer = `Xin lỗi, có lỗi xảy ra khi truy vấn dữ liệu. ${aiResponse.data.answer}`;
-          const answerChunks = errorAnswer.split(' ');
-          for (let i = 0; i < answerChunks.length; i++) {
-            const chunk = (i === 0 ? '' : ' ') + answerChunks[i];
-            const data = JSON.stringify({
-              type: 'chunk',
-              content: chunk
-            }, { ensureAscii: false });
-            res.write(`data: ${data}\n\n`);
-            await new Promise(resolve => setTimeout(resolve, 30));
-          }
-          res.write(`data: ${JSON.stringify({ type: 'done' }, { ensureAscii: false })}\n\n`);
-          res.end();
-          return;
-        }
-      }
-
-      // Bước 3: Nếu không có SQL, dùng streaming từ Python service
-      console.log(`[ChatAI Stream] No SQL, using Python streaming`);
-      
-      const streamRequestBody = {
-        question: question.trim()
-      };
-      
-      // Thêm conversation history nếu có
-      if (conversationHistory && Array.isArray(conversationHistory) && conversationHistory.length > 0) {
-        streamRequestBody.conversation_history = conversationHistory.map(msg => ({
-          role: msg.role || (msg.isUser ? 'user' : 'assistant'),
-          content: msg.text || msg.content || msg.message || ''
-        })).filter(msg => msg.content && msg.content.trim().length > 0);
-        
-        console.log(`[ChatAI Stream] Sending ${streamRequestBody.conversation_history.length} messages to Python streaming`);
       }
       
       const response = await axios.post(
-        `${PYTHON_AI_API_URL}/ask-stream`,
-        streamRequestBody,
+        `${PYTHON_AI_API_URL}/ask-stream-unified`,
+        requestBody,
         {
           responseType: 'stream',
           timeout: 60000,
-          headers: {
-            'Content-Type': 'application/json'
-          }
+          headers: aiHeaders(traceId)
         }
       );
 
-      // Forward streaming từ Python service
+      let buffer = '';
+      let sqlEvent = null;
+
+      // Đọc các event SSE từ Python: chunk/error forward thẳng cho frontend, sql giữ lại để thực thi
       response.data.on('data', (chunk) => {
-        res.write(chunk);
+        buffer += chunk.toString('utf8');
+        const frames = buffer.split('\n\n');
+        buffer = frames.pop();
+
+        for (const frame of frames) {
+          if (!frame.startsWith('data: ')) continue;
+          let event;
+          try {
+            event = JSON.parse(frame.slice(6));
+          } catch (parseError) {
+            continue;
+          }
+
+          if (event.type === 'decision') {
+            console.log(`[ChatAI Stream] trace=${traceId} Python decision: needs_database=${event.needs_database}`);
+          } else if (event.type === 'sql') {
+            sqlEvent = event;
+          } else if (event.type === 'done') {
+            if (!sqlEvent) {
+              res.write(`${frame}\n\n`);
+            }
+          } else {
+            res.write(`${frame}\n\n`);
+          }
+        }
       });
 
-      response.data.on('end', () => {
+      response.data.on('end', async () => {
+        if (sqlEvent) {
+          await streamSqlAnswer(res, {
+            question: question.trim(),
+            sql: sqlEvent.sql,
+            queryInfo: sqlEvent.query_info,
+            conversationHistory: requestBody.conversation_history,
+            userId,
+            traceId
+          });
+          console.log(`[ChatAI Stream] trace=${traceId} SQL query completed and streamed`);
+          return;
+        }
         res.end();
-        console.log(`[ChatAI Stream] Streaming completed`);
+        console.log(`[ChatAI Stream] trace=${traceId} streaming completed`);
       });
 
       response.data.on('error', (error) => {
@@ -633,12 +605,17 @@ const getSchema = async (req, res) => {
         timestamp: new Date().toISOString()
       });
     } else {
-      const schemaText = await DatabaseSchemaService.getSchemaDescription();
+      const [schemaText, rowEstimates] = await Promise.all([
+        DatabaseSchemaService.getSchemaDescription(),
+        DatabaseSchemaService.getRowEstimates()
+      ]);
       return res.status(200).json({
         success: true,
         data: {
           schema: schemaText,
-          format: 'text'
+          format: 'text',
+          // Số dòng ước lượng tách khỏi schema text (thay đổi liên tục, không được làm đổi hash schema)
+          rowEstimates
         },
         timestamp: new Date().toISOString()
       });
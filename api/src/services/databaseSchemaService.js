@@ -65,6 +65,10 @@ class DatabaseSchemaService {
           if (col.COLUMN_KEY === 'UNI') {
             colDesc += ', UNIQUE';
           }
+          // MUL: cột đầu tiên của một index không unique
+          if (col.COLUMN_KEY === 'MUL') {
+            colDesc += ', INDEXED';
+          }
           if (col.IS_NULLABLE === 'NO') {
             colDesc += ', NOT NULL';
           }
@@ -113,6 +117,29 @@ class DatabaseSchemaService {
     }
   }
 
+  /**
+   * Số dòng ước lượng của từng bảng (InnoDB TABLE_ROWS) để AI service ước lượng chi phí query.
+   * Giá trị thay đổi sau mỗi lần InnoDB cập nhật thống kê nên không nằm trong schema text
+   * (schema text phải ổn định để AI service không parse lại / xóa cache khi schema không đổi)
+   * @returns {Promise<Object>} { tableName: rows }
+   */
+  static async getRowEstimates() {
+    const [tables] = await sequelize.query(`
+      SELECT TABLE_NAME, TABLE_ROWS
+      FROM INFORMATION_SCHEMA.TABLES
+      WHERE TABLE_SCHEMA = DATABASE()
+      AND TABLE_TYPE = 'BASE TABLE'
+    `);
+
+    const estimates = {};
+    for (const table of tables) {
+      if (table.TABLE_ROWS !== null && table.TABLE_ROWS !== undefined) {
+        estimates[table.TABLE_NAME] = Number(table.TABLE_ROWS);
+      }
+    }
+    return estimates;
+  }
+
   /**
    * Lấy schema dưới dạng JSON
    * @returns {Promise<Object>} Schema object
@@ -120,7 +147,7 @@ class DatabaseSchemaService {
   static async getSchemaJSON() {
     try {
       const [tables] = await sequelize.query(`
-        SELECT TABLE_NAME
+        SELECT TABLE_NAME, TABLE_ROWS
         FROM INFORMATION_SCHEMA.TABLES
         WHERE TABLE_SCHEMA = DATABASE()
         AND TABLE_TYPE = 'BASE TABLE'
@@ -167,6 +194,7 @@ class DatabaseSchemaService {
 
         schema.tables.push({
           name: tableName,
+          rows: table.TABLE_ROWS,
           columns: columns.map(col => ({
             name: col.COLUMN_NAME,
             type: col.DATA_TYPE,
@@ -175,6 +203,7 @@ class DatabaseSchemaService {
             default: col.COLUMN_DEFAULT,
             primaryKey: col.COLUMN_KEY === 'PRI',
             unique: col.COLUMN_KEY === 'UNI',
+            indexed: col.COLUMN_KEY !== '',
             comment: col.COLUMN_COMMENT
           })),
           foreignKeys: foreignKeys.map(fk => ({